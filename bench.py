@@ -0,0 +1,342 @@
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+import metrics
+from storage import init_db, rebuild_user_stats
+
+ACTIONS = ("start", "inventory", "sync", "open_case", "open_cases", "sell_item")
+# Действие бенчмарка -> действие Web App в метриках ошибок
+WEBAPP_ACTIONS = {"sync": "sync_data", "open_case": "open_case", "open_cases": "open_cases",
+                  "sell_item": "sell_item"}
+BENCH_BOT_TOKEN = "123456:BENCHMARK"
+INVENTORY_QUANTITY = 1000
+
+
+def seed_database(path: str, users: int, inventory: int, history: int, seed: int = 1) -> Dict:
+    """Заполнение базы: пользователи, стопки инвентаря и история открытий.
+
+    У пользователя u лежат inventory разных предметов по INVENTORY_QUANTITY
+    штук, так что продажи не заканчиваются. История раскидана по
+    пользователям и по последнему году.
+    """
+    rng = random.Random(seed)
+    conn = sqlite3.connect(path, isolation_level=None)
+    try:
+        init_db(conn)
+        item_ids = [row[0] for row in conn.execute("SELECT item_id FROM items ORDER BY item_id")]
+        case_ids = [row[0] for row in conn.execute("SELECT case_id FROM cases WHERE is_active = 1")]
+        inventory = min(inventory, len(item_ids))
+        now = datetime.now(timezone.utc)
+
+        conn.execute("BEGIN IMMEDIATE")
+        conn.executemany(
+            "INSERT OR IGNORE INTO users (user_id, first_name, balance) VALUES (?, 'Bench', ?)",
+            ((user_id, 10 ** 12) for user_id in range(1, users + 1))
+        )
+        conn.executemany(
+            "INSERT OR IGNORE INTO inventory (user_id, item_id, quantity, obtained_at) VALUES (?, ?, ?, ?)",
+            (
+                (user_id, item_ids[(user_id + k) % len(item_ids)], INVENTORY_QUANTITY,
+                 (now - timedelta(minutes=k)).strftime("%Y-%m-%d %H:%M:%S"))
+                for user_id in range(1, users + 1) for k in range(inventory)
+            )
+        )
+        conn.executemany(
+            "INSERT INTO opening_history (user_id, case_id, item_id, opened_at) VALUES (?, ?, ?, ?)",
+            (
+                (rng.randint(1, users), rng.choice(case_ids), rng.choice(item_ids),
+                 (now - timedelta(seconds=rng.randint(0, 365 * 86400))).strftime("%Y-%m-%d %H:%M:%S"))
+                for _ in range(history)
+            )
+        )
+        rebuild_user_stats(conn)
+        conn.execute("COMMIT")
+        return {"item_ids": item_ids, "case_ids": case_ids, "inventory": inventory}
+    finally:
+        conn.close()
+
+
+async def start_fake_api(host: str = "127.0.0.1", port: int = 0):
+    """Фейковый Bot API без ограничения темпа на свободном порту"""
+    from aiohttp import web
+    from fake_bot_api import FakeBotAPI
+
+    fake = FakeBotAPI(chat_interval=0)
+    runner = web.AppRunner(fake.app)
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    port = runner.addresses[0][1]
+    return fake, runner, f"http://{host}:{port}"
+
+
+def configure_bot_environment(db_path: str, api_url: str):
+    """Окружение для импорта bot.py против фейкового API.
+
+    Вызывается до первого импорта bot и config: настройки читаются при
+    импорте. Лимиты частоты и темп исходящих запросов сняты, чтобы
+    измерялась работа обработчиков, а не ограничители.
+    """
+    os.environ.update({
+        "BOT_TOKEN": os.environ.get("BOT_TOKEN") or BENCH_BOT_TOKEN,
+        "ADMIN_ID": os.environ.get("ADMIN_ID") or "1",
+        "DATABASE_URL": f"sqlite:///{db_path}",
+        "TELEGRAM_API_URL": api_url,
+        "OUTBOUND_GLOBAL_RATE": "0",
+        "OUTBOUND_CHAT_INTERVAL": "0",
+        "RATE_LIMITS": ",".join(
+            f"{kind}=1000000:1000000" for kind in ("command", "callback", "webapp", "message")
+        ),
+        "CALLBACK_COALESCE_SECONDS": "0",
+        "MENU_BUTTON_REFRESH_RATE": "0",
+        # Иначе RECORD_UPDATES=True из .env дописывал бы прогон в ту же
+        # запись, которую воспроизводит replay.py
+        "RECORD_UPDATES": "False",
+        "RECORD_UPDATES_PATH": os.path.join(os.path.dirname(os.path.abspath(db_path)), "updates.jsonl.gz"),
+        # Копия базы не трогает рабочий архив и не архивируется во время замеров
+        "HISTORY_RETENTION_DAYS": "0",
+        "HISTORY_ARCHIVE_PATH": "",
+    })
+
+
+class UpdateFactory:
+    """Синтетические обновления Telegram в формате Bot API"""
+
+    def __init__(self, users: int, item_ids: List[int], case_ids: List[int], inventory: int, seed: int = 1):
+        self.users = users
+        self.item_ids = item_ids
+        self.case_ids = case_ids
+        self.inventory = inventory
+        self.rng = random.Random(seed)
+        self._ids = itertools.count(1)
+
+    def _user(self, user_id: int) -> Dict:
+        return {"id": user_id, "is_bot": False, "first_name": "Bench"}
+
+    def _message(self, user_id: int, **fields) -> Dict:
+        return {
+            "message_id": next(self._ids),
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": self._user(user_id),
+            **fields
+        }
+
+    def command(self, user_id: int, command: str) -> Dict:
+        text = f"/{command}"
+        return {"update_id": next(self._ids), "message": self._message(
+            user_id, text=text, entities=[{"type": "bot_command", "offset": 0, "length": len(text)}]
+        )}
+
+    def callback(self, user_id: int, data: str) -> Dict:
+        message = self._message(user_id, text="menu")
+        message["from"] = {"id": 1, "is_bot": True, "first_name": "Bot"}
+        return {"update_id": next(self._ids), "callback_query": {
+            "id": str(next(self._ids)),
+            "from": self._user(user_id),
+            "chat_instance": str(user_id),
+            "message": message,
+            "data": data
+        }}
+
+    def web_app(self, user_id: int, payload: Dict) -> Dict:
+        return {"update_id": next(self._ids), "message": self._message(
+            user_id, web_app_data={"data": json.dumps(payload), "button_text": "Играть"}
+        )}
+
+    def make(self, action: str) -> Dict:
+        user_id = self.rng.randint(1, self.users)
+        if action == "start":
+            return self.command(user_id, "start")
+        if action == "inventory":
+            return self.callback(user_id, "inventory")
+        if action == "sync":
+            return self.web_app(user_id, {"action": "sync_data", "compact": True})
+        if action == "open_case":
+            return self.web_app(user_id, {
+                "action": "open_case", "case_id": self.rng.choice(self.case_ids),
+                "request_id": uuid.uuid4().hex, "compact": True
+            })
+        if action == "open_cases":
+            return self.web_app(user_id, {
+                "action": "open_cases", "case_id": self.rng.choice(self.case_ids), "count": 10,
+                "request_id": uuid.uuid4().hex, "compact": True
+            })
+        if action == "sell_item":
+            item_id = self.item_ids[(user_id + self.rng.randrange(self.inventory)) % len(self.item_ids)]
+            return self.web_app(user_id, {
+                "action": "sell_item", "item_id": item_id,
+                "request_id": uuid.uuid4().hex, "compact": True
+            })
+        raise ValueError(f"Неизвестное действие: {action}")
+
+
+def percentile(values: List[float], q: float) -> float:
+    """Перцентиль по ближайшему рангу"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, int(round(q * len(ordered))) - 1))]
+
+
+async def drive(feed: Callable, make_update: Callable[[], Dict], requests: int, concurrency: int) -> Dict:
+    """requests обновлений при concurrency одновременно обрабатываемых"""
+    latencies: List[float] = []
+    errors = 0
+    remaining = iter(range(requests))
+
+    async def client():
+        nonlocal errors
+        for _ in remaining:
+            update = make_update()
+            started = time.perf_counter()
+            try:
+                await feed(update)
+            except Exception:
+                errors += 1
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    return summarize(latencies, errors, time.perf_counter() - started)
+
+
+def summarize(latencies: List[float], errors: int, elapsed: float) -> Dict:
+    """Пропускная способность и перцентили задержек, в миллисекундах"""
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "throughput": round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 2)
+    }
+
+
+def compare(results: Dict, baseline: Dict, tolerance: float) -> List[str]:
+    """Регрессии относительно базовой линии: рост задержек или падение пропускной способности"""
+    regressions = []
+    for action, current in results.items():
+        previous = baseline.get(action)
+        if not previous:
+            continue
+        for key in ("p50_ms", "p95_ms", "p99_ms"):
+            # Шум в доли миллисекунды регрессией не считается
+            if current[key] > previous[key] * (1 + tolerance) and current[key] - previous[key] > 0.5:
+                regressions.append(f"{action}: {key} {previous[key]} -> {current[key]}")
+        if current["throughput"] < previous["throughput"] * (1 - tolerance):
+            regressions.append(f"{action}: throughput {previous['throughput']} -> {current['throughput']}")
+    return regressions
+
+
+async def run(args) -> Dict[str, Dict]:
+    db_path = args.db or os.path.join(tempfile.mkdtemp(), "bench.db")
+    started = time.perf_counter()
+    seeded = seed_database(db_path, args.users, args.inventory, args.history)
+    print(f"🌱 База {db_path}: {args.users} пользователей, {seeded['inventory']} стопок у каждого, "
+          f"{args.history} записей истории за {time.perf_counter() - started:.1f} с")
+
+    fake, fake_runner, api_url = await start_fake_api()
+    configure_bot_environment(db_path, api_url)
+    from bot import bot, db, dp, outbound
+
+    await db.connect()
+    factory = UpdateFactory(args.users, seeded["item_ids"], seeded["case_ids"], seeded["inventory"])
+
+    async def feed(update: Dict):
+        await dp.feed_raw_update(bot, update)
+
+    results = {}
+    try:
+        for action in args.actions:
+            # Прогрев: каталог, кэши и соединения
+            await drive(feed, lambda: factory.make(action), min(args.warmup, args.requests), args.concurrency)
+            webapp_action = WEBAPP_ACTIONS.get(action)
+            failed_before = metrics.webapp_action_errors.value(action=webapp_action)
+            stats = await drive(feed, lambda: factory.make(action), args.requests, args.concurrency)
+            # Ответы Web App с success=false тоже считаются ошибками
+            if webapp_action:
+                stats["errors"] += int(metrics.webapp_action_errors.value(action=webapp_action) - failed_before)
+            results[action] = stats
+            print(f"  {action:<11} {stats['throughput']:>8} rps  p50 {stats['p50_ms']:>7} мс  "
+                  f"p95 {stats['p95_ms']:>7} мс  p99 {stats['p99_ms']:>7} мс  ошибок {stats['errors']}")
+    finally:
+        await outbound.close()
+        await db.close()
+        await bot.session.close()
+        await fake_runner.cleanup()
+    print(f"📡 Вызовов Bot API: {len(fake.calls)}")
+    return results
+
+
+def main():
+    """Нагрузочный тест обработчиков: python bench.py --users 1000 --history 1000000
+
+    Заполняет временную базу, поднимает фейковый Bot API и прогоняет через
+    настоящий диспетчер aiogram синтетические обновления каждого действия
+    с заданным числом одновременных запросов. Результаты сравниваются с
+    сохраненной базовой линией для того же сценария; при регрессии больше
+    --tolerance код выхода 1. --save-baseline записывает новую линию.
+    """
+    parser = argparse.ArgumentParser(description="Бенчмарк обработчиков бота")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--inventory", type=int, default=20, help="стопок предметов у пользователя")
+    parser.add_argument("--history", type=int, default=100000, help="записей в opening_history")
+    parser.add_argument("--requests", type=int, default=2000, help="запросов на действие")
+    parser.add_argument("--warmup", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--actions", default=",".join(ACTIONS))
+    parser.add_argument("--db", help="путь к базе (по умолчанию временный файл)")
+    parser.add_argument("--baseline", default="bench_baseline.json")
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="допустимое ухудшение, доля")
+    parser.add_argument("--output", help="файл для результатов в JSON")
+    args = parser.parse_args()
+    args.actions = [action.strip() for action in args.actions.split(",") if action.strip()]
+    unknown = set(args.actions) - set(ACTIONS)
+    if unknown:
+        parser.error(f"неизвестные действия: {', '.join(sorted(unknown))}")
+
+    scenario = f"users={args.users},inventory={args.inventory},history={args.history},concurrency={args.concurrency}"
+    print(f"🏁 Сценарий: {scenario}")
+    results = asyncio.run(run(args))
+
+    if args.output:
+        Path(args.output).write_text(json.dumps({scenario: results}, indent=2, ensure_ascii=False))
+
+    baseline_path = Path(args.baseline)
+    baselines: Dict = json.loads(baseline_path.read_text()) if baseline_path.exists() else {}
+    if args.save_baseline:
+        baselines[scenario] = results
+        baseline_path.write_text(json.dumps(baselines, indent=2, ensure_ascii=False) + "\n")
+        print(f"💾 Базовая линия сохранена: {baseline_path}")
+        return
+
+    baseline: Optional[Dict] = baselines.get(scenario)
+    if baseline is None:
+        print("⚠️ Для сценария нет базовой линии, сравнение пропущено (--save-baseline)")
+        return
+    regressions = compare(results, baseline, args.tolerance)
+    failed = [f"{action}: ошибок {stats['errors']}" for action, stats in results.items() if stats["errors"]]
+    if regressions or failed:
+        print("❌ Регрессия:")
+        for line in regressions + failed:
+            print(f"  {line}")
+        sys.exit(1)
+    print("✅ Регрессий нет")
+
+
+if __name__ == "__main__":
+    main()
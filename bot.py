@@ -1,22 +1,37 @@
 import os
 import asyncio
 import json
-import sqlite3
+import logging
+import time
 from datetime import datetime
-from typing import Dict, List
-import random
+from typing import Dict, List, Optional, Tuple
 from dotenv import load_dotenv
 
 from aiogram import Bot, Dispatcher, Router, F
 from aiogram.types import (
     Message, InlineKeyboardMarkup,
-    InlineKeyboardButton, WebAppInfo, CallbackQuery,
-    MenuButtonWebApp
+    InlineKeyboardButton, CallbackQuery
 )
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
 from aiogram.filters import Command
 from aiogram.enums import ParseMode
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 
+import metrics
+from config import config
+from jsonlog import setup_logging
+from loopwatch import LoopWatchdog
+from maintenance import MaintenanceJob
+from menu_button import MenuButtonManager
+from outbound import OutboundDispatcher
+from profiler import MODES as PROFILE_MODES, HandlerProfiler
+from ratelimit import RateLimiter, RateLimitMiddleware, parse_limits
+from replay import UpdateRecorder
+from storage import Database
+from webhook import run_webhook
+from wire import encode_response, size_stats
+
 # Загрузка переменных окружения из .env файла
 load_dotenv()
 
@@ -26,527 +41,102 @@ ADMIN_ID = int(os.getenv('ADMIN_ID', 0))
 DEBUG = os.getenv('DEBUG', 'False').lower() == 'true'
 DB_PATH = os.getenv('DATABASE_URL', 'sqlite:///minecraft_cases.db').replace('sqlite:///', '')
 
+log = logging.getLogger("bot")
+
 # Проверка наличия обязательных переменных
 if not BOT_TOKEN:
     raise ValueError("❌ BOT_TOKEN не найден в .env файле!")
 
-bot = Bot(token=BOT_TOKEN)
+# Свой адрес Bot API нужен для локального сервера или fake_bot_api.py
+if config.TELEGRAM_API_URL:
+    session = AiohttpSession(api=TelegramAPIServer.from_base(config.TELEGRAM_API_URL))
+else:
+    session = AiohttpSession()
+bot = Bot(token=BOT_TOKEN, session=session)
+
+# Все исходящие запросы к чатам идут через очередь с учетом лимитов Telegram
+outbound = OutboundDispatcher(
+    global_rate=config.OUTBOUND_GLOBAL_RATE,
+    chat_interval=config.OUTBOUND_CHAT_INTERVAL,
+    workers=config.OUTBOUND_WORKERS,
+    max_retries=config.OUTBOUND_MAX_RETRIES
+)
+bot.session.middleware(outbound)
+metrics.register_queue("outbound", outbound.queued)
 dp = Dispatcher()
 router = Router()
 dp.include_router(router)
 
-def init_db():
-    """Инициализация базы данных"""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    
-    # Таблица пользователей
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS users (
-        user_id INTEGER PRIMARY KEY,
-        username TEXT,
-        first_name TEXT,
-        last_name TEXT,
-        balance INTEGER DEFAULT 10000,
-        experience INTEGER DEFAULT 0,
-        level INTEGER DEFAULT 1,
-        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-        last_login TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-    )
-    ''')
-    
-    # Таблица предметов Minecraft
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS items (
-        item_id INTEGER PRIMARY KEY AUTOINCREMENT,
-        name TEXT NOT NULL,
-        icon TEXT NOT NULL,
-        rarity TEXT NOT NULL CHECK(rarity IN ('common', 'uncommon', 'rare', 'epic', 'legendary')),
-        category TEXT NOT NULL CHECK(category IN ('food', 'resources', 'weapons', 'tools', 'special')),
-        price INTEGER NOT NULL,
-        sell_price INTEGER NOT NULL,
-        description TEXT,
-        texture_url TEXT,
-        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-    )
-    ''')
-    
-    # Таблица инвентаря
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS inventory (
-        inventory_id INTEGER PRIMARY KEY AUTOINCREMENT,
-        user_id INTEGER NOT NULL,
-        item_id INTEGER NOT NULL,
-        quantity INTEGER DEFAULT 1,
-        obtained_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-        is_favorite BOOLEAN DEFAULT FALSE,
-        FOREIGN KEY (user_id) REFERENCES users(user_id) ON DELETE CASCADE,
-        FOREIGN KEY (item_id) REFERENCES items(item_id) ON DELETE CASCADE
-    )
-    ''')
-    
-    # Таблица кейсов
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS cases (
-        case_id INTEGER PRIMARY KEY AUTOINCREMENT,
-        name TEXT NOT NULL,
-        price INTEGER NOT NULL,
-        icon TEXT NOT NULL,
-        description TEXT,
-        rarity_weights TEXT NOT NULL, -- JSON с весами редкостей
-        texture_url TEXT,
-        is_active BOOLEAN DEFAULT TRUE,
-        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-    )
-    ''')
-    
-    # Таблица истории открытий
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS opening_history (
-        history_id INTEGER PRIMARY KEY AUTOINCREMENT,
-        user_id INTEGER NOT NULL,
-        case_id INTEGER NOT NULL,
-        item_id INTEGER NOT NULL,
-        opened_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-        FOREIGN KEY (user_id) REFERENCES users(user_id),
-        FOREIGN KEY (case_id) REFERENCES cases(case_id),
-        FOREIGN KEY (item_id) REFERENCES items(item_id)
-    )
-    ''')
-    
-    # Таблица транзакций
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS transactions (
-        transaction_id INTEGER PRIMARY KEY AUTOINCREMENT,
-        user_id INTEGER NOT NULL,
-        type TEXT NOT NULL CHECK(type IN ('deposit', 'withdraw', 'purchase', 'reward')),
-        amount INTEGER NOT NULL,
-        description TEXT,
-        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-        FOREIGN KEY (user_id) REFERENCES users(user_id)
-    )
-    ''')
-    
-    conn.commit()
-    
-    # Добавляем тестовые данные только если таблицы пустые
-    cursor.execute("SELECT COUNT(*) FROM items")
-    if cursor.fetchone()[0] == 0:
-        add_initial_data(cursor)
-    
-    conn.commit()
-    conn.close()
-    print(f"✅ База данных инициализирована: {DB_PATH}")
-
-def add_initial_data(cursor):
-    """Добавление начальных данных в БД"""
-    print("📦 Добавление начальных данных...")
-    
-    # Minecraft предметы
-    minecraft_items = [
-        # Common - Еда
-        ("Яблоко", "🍎", "common", "food", 40, 20, "Восстанавливает 2 единицы голода", "apple.png"),
-        ("Хлеб", "🍞", "common", "food", 45, 22, "Восстанавливает 5 единиц голода", "bread.png"),
-        ("Мясо", "🍖", "common", "food", 50, 25, "Восстанавливает 8 единиц голода", "meat.png"),
-        ("Тыквенный пирог", "🥧", "common", "food", 60, 30, "Восстанавливает 8 единицы голода", "pie.png"),
-        ("Золотое яблоко", "🍏", "uncommon", "food", 400, 200, "Даёт регенерацию здоровья", "golden_apple.png"),
-        
-        # Common - Ресурсы
-        ("Уголь", "⚫", "common", "resources", 30, 15, "Топливо и краситель", "coal.png"),
-        ("Железный слиток", "⛓️", "common", "resources", 50, 25, "Базовый ресурс для крафта", "iron.png"),
-        ("Золотой слиток", "🟨", "common", "resources", 80, 40, "Редкий ресурс", "gold.png"),
-        ("Красная пыль", "🔴", "common", "resources", 40, 20, "Для механизмов и зелий", "redstone.png"),
-        
-        # Uncommon
-        ("Алмаз", "💎", "uncommon", "resources", 150, 75, "Ценный минерал", "diamond.png"),
-        ("Изумруд", "🟩", "uncommon", "resources", 200, 100, "Торговая валюта", "emerald.png"),
-        ("Лазурит", "🔵", "uncommon", "resources", 100, 50, "Для зачарования", "lapis.png"),
-        
-        # Uncommon - Оружие
-        ("Железный меч", "⚔️", "uncommon", "weapons", 180, 90, "Базовое оружие", "iron_sword.png"),
-        ("Лук", "🏹", "uncommon", "weapons", 120, 60, "Дальнобойное оружие", "bow.png"),
-        ("Щит", "🛡️", "uncommon", "weapons", 150, 75, "Защита от атак", "shield.png"),
-        
-        # Rare
-        ("Алмазный меч", "⚔️💎", "rare", "weapons", 250, 125, "Мощное оружие", "diamond_sword.png"),
-        ("Алмазная кирка", "⛏️💎", "rare", "tools", 300, 150, "Быстрая добыча", "diamond_pickaxe.png"),
-        ("Незеритовый слиток", "🔱", "rare", "resources", 500, 250, "Элитный материал", "netherite.png"),
-        ("Элитра", "🧥", "rare", "special", 800, 400, "Позволяет летать", "elytra.png"),
-        
-        # Epic
-        ("Тотем бессмертия", "🐦", "epic", "special", 1000, 500, "Спасение от смерти", "totem.png"),
-        ("Сердце моря", "💙", "epic", "resources", 1200, 600, "Редкая реликвия", "heart.png"),
-        ("Голова дракона", "🐲", "epic", "special", 1500, 750, "Трофей дракона", "dragon_head.png"),
-        
-        # Legendary
-        ("Командный блок", "🟪", "legendary", "special", 5000, 2500, "Божественный предмет", "command_block.png"),
-        ("Меч незера", "🗡️", "legendary", "weapons", 3000, 1500, "Легендарное оружие", "netherite_sword.png"),
-        ("Корона власти", "👑", "legendary", "special", 10000, 5000, "Знак абсолютной власти", "crown.png"),
-        ("Броня незера", "🛡️🔥", "legendary", "weapons", 4000, 2000, "Неуязвимая защита", "netherite_armor.png"),
-    ]
-    
-    cursor.executemany(
-        """INSERT INTO items (name, icon, rarity, category, price, sell_price, description, texture_url) 
-           VALUES (?, ?, ?, ?, ?, ?, ?, ?)""",
-        minecraft_items
-    )
-    
-    # Кейсы
-    cases = [
-        ("Кейс с Едой", 100, "🍎", "Содержит разнообразную еду", 
-        '{"common": 70, "uncommon": 30}', "bot.py"),
-        ("Ресурсный Кейс", 250, "⛏️", "Руды, минералы и базовые ресурсы", 
-        '{"common": 50, "uncommon": 40, "rare": 10}', "assets/textures/cases/case_resources.png"),
-        ("Оружейный Кейс", 500, "⚔️", "Оружие, броня и инструменты", 
-        '{"uncommon": 40, "rare": 50, "epic": 10}', "assets/textures/cases/case_weapons.png"),
-        ("Легендарный Кейс", 1000, "🌟", "Уникальные предметы", 
-        '{"rare": 30, "epic": 50, "legendary": 20}', "assets/textures/cases/case_legendary.png"),
-        ("Донат Кейс", 5000, "👑", "Эксклюзивные донат предметы", 
-        '{"epic": 40, "legendary": 60}', "assets/textures/cases/case_donate.png"),
-        ("Случайный Кейс", 750, "🧰", "Микс из всех категорий", 
-        '{"common": 30, "uncommon": 40, "rare": 20, "epic": 10}', "assets/textures/cases/case_random.png"),
-    ]
-    
-    cursor.executemany(
-        """INSERT INTO cases (name, price, icon, description, rarity_weights, texture_url) 
-           VALUES (?, ?, ?, ?, ?, ?)""",
-        cases
-    )
-    
-    print(f"✅ Добавлено {len(minecraft_items)} предметов и {len(cases)} кейсов")
-
-def get_user(user_id: int) -> Dict:
-    """Получение или создание пользователя"""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    
-    cursor.execute(
-        """SELECT user_id, username, first_name, last_name, balance, experience, level 
-           FROM users WHERE user_id = ?""",
-        (user_id,)
-    )
-    
-    user_data = cursor.fetchone()
-    if not user_data:
-        cursor.execute(
-            """INSERT INTO users (user_id, balance, experience, level, last_login) 
-               VALUES (?, 10000, 0, 1, CURRENT_TIMESTAMP)""",
-            (user_id,)
-        )
-        conn.commit()
-        
-        # Создаем начальную транзакцию
-        cursor.execute(
-            """INSERT INTO transactions (user_id, type, amount, description) 
-               VALUES (?, 'reward', 10000, 'Стартовый бонус')""",
-            (user_id,)
-        )
-        conn.commit()
-        
-        cursor.execute(
-            """SELECT user_id, username, first_name, last_name, balance, experience, level 
-               FROM users WHERE user_id = ?""",
-            (user_id,)
-        )
-        user_data = cursor.fetchone()
-    
-    conn.close()
-    
-    return {
-        "user_id": user_data[0],
-        "username": user_data[1],
-        "first_name": user_data[2],
-        "last_name": user_data[3],
-        "balance": user_data[4],
-        "experience": user_data[5],
-        "level": user_data[6]
-    }
-
-def update_balance(user_id: int, amount: int, transaction_type: str, description: str = "") -> int:
-    """Обновление баланса пользователя"""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    
-    cursor.execute(
-        "UPDATE users SET balance = balance + ? WHERE user_id = ?",
-        (amount, user_id)
-    )
-    
-    cursor.execute(
-        """INSERT INTO transactions (user_id, type, amount, description) 
-           VALUES (?, ?, ?, ?)""",
-        (user_id, transaction_type, amount, description)
-    )
-    
-    cursor.execute("SELECT balance FROM users WHERE user_id = ?", (user_id,))
-    new_balance = cursor.fetchone()[0]
-    
-    conn.commit()
-    conn.close()
-    
-    return new_balance
-
-def get_inventory(user_id: int) -> List[Dict]:
-    """Получение инвентаря пользователя"""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    
-    cursor.execute('''
-    SELECT i.item_id, i.name, i.icon, i.rarity, i.category, i.price, i.sell_price, 
-           i.description, i.texture_url, inv.quantity, inv.obtained_at, inv.is_favorite
-    FROM inventory inv
-    JOIN items i ON inv.item_id = i.item_id
-    WHERE inv.user_id = ?
-    ORDER BY inv.is_favorite DESC, inv.obtained_at DESC
-    ''', (user_id,))
-    
-    inventory = []
-    for row in cursor.fetchall():
-        inventory.append({
-            "id": row[0],
-            "name": row[1],
-            "icon": row[2],
-            "rarity": row[3],
-            "category": row[4],
-            "price": row[5],
-            "sell_price": row[6],
-            "description": row[7],
-            "texture_url": row[8],
-            "quantity": row[9],
-            "obtained_at": row[10],
-            "is_favorite": bool(row[11])
-        })
-    
-    conn.close()
-    return inventory
-
-def get_cases() -> List[Dict]:
-    """Получение списка кейсов"""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    
-    cursor.execute(
-        "SELECT case_id, name, price, icon, description, rarity_weights, texture_url FROM cases WHERE is_active = TRUE"
-    )
-    
-    cases = []
-    for row in cursor.fetchall():
-        cases.append({
-            "id": row[0],
-            "name": row[1],
-            "price": row[2],
-            "icon": row[3],
-            "description": row[4],
-            "rarity_weights": json.loads(row[5]),
-            "texture_url": row[6]
-        })
-    
-    conn.close()
-    return cases
-
-def open_case(user_id: int, case_id: int) -> Dict:
-    """Открытие кейса"""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    
-    # Получаем информацию о кейсе
-    cursor.execute(
-        "SELECT name, price, rarity_weights FROM cases WHERE case_id = ?",
-        (case_id,)
-    )
-    case_data = cursor.fetchone()
-    
-    if not case_data:
-        conn.close()
-        return {"error": "Кейс не найден"}
-    
-    case_name, case_price, rarity_weights_json = case_data
-    rarity_weights = json.loads(rarity_weights_json)
-    
-    # Получаем предметы по редкости
-    total_weight = sum(rarity_weights.values())
-    random_value = random.uniform(0, total_weight)
-    
-    selected_rarity = None
-    cumulative_weight = 0
-    for rarity, weight in rarity_weights.items():
-        cumulative_weight += weight
-        if random_value <= cumulative_weight:
-            selected_rarity = rarity
-            break
-    
-    # Получаем случайный предмет выбранной редкости
-    cursor.execute(
-        """SELECT item_id, name, icon, rarity, price, description, texture_url 
-           FROM items WHERE rarity = ? ORDER BY RANDOM() LIMIT 1""",
-        (selected_rarity,)
-    )
-    
-    item_data = cursor.fetchone()
-    if not item_data:
-        conn.close()
-        return {"error": "Не удалось выбрать предмет"}
-    
-    item = {
-        "id": item_data[0],
-        "name": item_data[1],
-        "icon": item_data[2],
-        "rarity": item_data[3],
-        "price": item_data[4],
-        "description": item_data[5],
-        "texture_url": item_data[6]
-    }
-    
-    # Проверяем баланс
-    cursor.execute("SELECT balance FROM users WHERE user_id = ?", (user_id,))
-    balance_result = cursor.fetchone()
-    if not balance_result:
-        conn.close()
-        return {"error": "Пользователь не найден"}
-    
-    balance = balance_result[0]
-    
-    if balance < case_price:
-        conn.close()
-        return {"error": "Недостаточно средств"}
-    
-    # Списание средств
-    cursor.execute(
-        "UPDATE users SET balance = balance - ? WHERE user_id = ?",
-        (case_price, user_id)
-    )
-    
-    cursor.execute(
-        """INSERT INTO transactions (user_id, type, amount, description) 
-           VALUES (?, 'purchase', ?, ?)""",
-        (user_id, -case_price, f"Покупка кейса: {case_name}")
-    )
-    
-    # Добавляем предмет в инвентарь
-    cursor.execute(
-        """INSERT INTO inventory (user_id, item_id) 
-           VALUES (?, ?)""",
-        (user_id, item["id"])
-    )
-    
-    # Получаем ID добавленного предмета
-    inventory_id = cursor.lastrowid
-    
-    # Добавляем в историю открытий
-    cursor.execute(
-        """INSERT INTO opening_history (user_id, case_id, item_id) 
-           VALUES (?, ?, ?)""",
-        (user_id, case_id, item["id"])
-    )
-    
-    # Начисляем опыт
-    experience_gained = case_price // 10
-    cursor.execute(
-        "UPDATE users SET experience = experience + ? WHERE user_id = ?",
-        (experience_gained, user_id)
-    )
-    
-    # Проверяем повышение уровня
-    cursor.execute(
-        "SELECT experience, level FROM users WHERE user_id = ?",
-        (user_id,)
-    )
-    user_exp, user_level = cursor.fetchone()
-    
-    # Проверяем нужно ли повысить уровень (1000 опыта за уровень)
-    new_level = user_level
-    while user_exp >= new_level * 1000:
-        new_level += 1
-    
-    if new_level > user_level:
-        cursor.execute(
-            "UPDATE users SET level = ? WHERE user_id = ?",
-            (new_level, user_id)
-        )
-    
-    # Получаем обновленные данные пользователя
-    cursor.execute(
-        "SELECT balance, experience, level FROM users WHERE user_id = ?",
-        (user_id,)
-    )
-    updated_user = cursor.fetchone()
-    
-    conn.commit()
-    conn.close()
-    
-    return {
-        "success": True,
-        "item": item,
-        "new_balance": updated_user[0],
-        "experience_gained": experience_gained,
-        "case_price": case_price,
-        "inventory_id": inventory_id,
-        "experience": updated_user[1],
-        "level": updated_user[2]
-    }
-
-def get_user_data_for_webapp(user_id: int) -> Dict:
-    """Получение данных пользователя для веб-приложения"""
-    user = get_user(user_id)
-    inventory = get_inventory(user_id)
-    cases = get_cases()
-    
-    return {
-        "user": {
-            "balance": user["balance"],
-            "experience": user["experience"],
-            "level": user["level"]
-        },
-        "inventory": inventory,
-        "cases": cases
-    }
+# Время и ошибки каждого обработчика для /metrics
+router.message.middleware(metrics.HandlerMetricsMiddleware())
+router.callback_query.middleware(metrics.HandlerMetricsMiddleware())
+# Профилирование по команде /profile, без сеанса ничего не делает
+profiler = HandlerProfiler(config.LOG_DIR)
+router.message.middleware(profiler)
+router.callback_query.middleware(profiler)
+
+# Ограничение частоты запросов от одного пользователя
+rate_limit_middleware = RateLimitMiddleware(
+    RateLimiter(parse_limits(config.RATE_LIMITS), max_buckets=config.RATE_LIMIT_MAX_BUCKETS),
+    coalesce_callbacks=("profile", "inventory", "back_to_menu"),
+    coalesce_window=config.CALLBACK_COALESCE_SECONDS,
+    exempt_user_ids=(ADMIN_ID,)
+)
+dp.message.outer_middleware(rate_limit_middleware)
+dp.callback_query.outer_middleware(rate_limit_middleware)
+
+# Запись входящих обновлений для replay.py, включается RECORD_UPDATES или /record_updates
+update_recorder = UpdateRecorder(
+    config.RECORD_UPDATES_PATH,
+    enabled=config.RECORD_UPDATES,
+    max_bytes=config.RECORD_UPDATES_MAX_MB * 1024 * 1024
+)
+dp.update.outer_middleware(update_recorder)
+db = Database(
+    DB_PATH,
+    batch_max_ops=config.DB_BATCH_MAX_OPS,
+    batch_delay_ms=config.DB_BATCH_DELAY_MS,
+    mmap_size_mb=config.DB_MMAP_SIZE_MB,
+    cache_size_mb=config.DB_CACHE_SIZE_MB,
+    catalog_refresh_seconds=config.CATALOG_REFRESH_SECONDS,
+    max_delta_revisions=config.SYNC_MAX_DELTA_REVISIONS,
+    idempotency_cache_size=config.IDEMPOTENCY_CACHE_SIZE,
+    idempotency_ttl_seconds=config.IDEMPOTENCY_TTL_SECONDS,
+    idempotency_retention_hours=config.IDEMPOTENCY_RETENTION_HOURS,
+    user_cache_size=config.USER_CACHE_SIZE,
+    user_cache_ttl_seconds=config.USER_CACHE_TTL_SECONDS,
+    archive_path=config.HISTORY_ARCHIVE_PATH if config.HISTORY_RETENTION_DAYS > 0 else ""
+)
+# Перенос старой истории и транзакций в архив и дневные сводки
+maintenance = MaintenanceJob(
+    db,
+    interval_minutes=config.MAINTENANCE_INTERVAL_MINUTES,
+    retention_days=config.HISTORY_RETENTION_DAYS,
+    batch_size=config.MAINTENANCE_BATCH_SIZE,
+    vacuum_pages=config.VACUUM_PAGES_PER_RUN
+)
+menu_button = MenuButtonManager(bot, db, config.WEB_APP_URL, config.MENU_BUTTON_REFRESH_RATE)
+# Поиск обработчиков, которые блокируют цикл событий синхронной работой
+loop_watchdog = LoopWatchdog(config.LOOP_LAG_THRESHOLD_MS, config.LOOP_LAG_INTERVAL_MS)
 
 # Обработчики команд
 @router.message(Command("start"))
 async def cmd_start(message: Message):
     """Команда /start"""
-    print(f"📥 Получена команда /start от пользователя {message.from_user.id}")
-    
-    user = get_user(message.from_user.id)
-    cases_opened = get_cases_opened_count(user["user_id"])
+    user = await db.get_user(message.from_user.id)
+    stats = await db.get_user_stats(user["user_id"])
     
     # Обновляем время последнего входа
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute(
-        "UPDATE users SET last_login = CURRENT_TIMESTAMP WHERE user_id = ?",
-        (user["user_id"],)
-    )
-    conn.commit()
-    conn.close()
+    await db.touch_last_login(user["user_id"])
     
     keyboard = build_main_menu_keyboard()
     
-    await bot.set_chat_menu_button(
-        chat_id=message.chat.id,
-        menu_button=MenuButtonWebApp(
-            text="⛏️ Minecraft Кейсы",
-            web_app=WebAppInfo(url="https://mrmicse.github.io/minecraft-cases/")
-        )
-    )
+    # Кнопка меню ставится в фоне и только если адрес в чате устарел
+    await menu_button.ensure(message.chat.id)
     
-    text = build_main_menu_text(message.from_user.first_name, user, cases_opened)
+    text = build_main_menu_text(message.from_user.first_name, user, stats["cases_opened"])
     
     await message.answer(text, reply_markup=keyboard, parse_mode=ParseMode.HTML)
-    print(f"📤 Отправлен ответ пользователю {message.from_user.id}")
-
-
-def get_cases_opened_count(user_id: int) -> int:
-    """Получаем статистику открытий кейсов для пользователя."""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute(
-        "SELECT COUNT(*) FROM opening_history WHERE user_id = ?",
-        (user_id,)
-    )
-    cases_opened = cursor.fetchone()[0]
-    conn.close()
-    return cases_opened
 
 
 def build_main_menu_text(first_name: str, user: Dict, cases_opened: int) -> str:
@@ -581,6 +171,11 @@ def build_main_menu_keyboard() -> InlineKeyboardMarkup:
     )
 
 
+def format_quantity(quantity: int) -> str:
+    """Подпись количества предметов в стопке."""
+    return f" ×{quantity}" if quantity > 1 else ""
+
+
 def build_back_keyboard() -> InlineKeyboardMarkup:
     """Клавиатура с кнопкой возврата."""
     return InlineKeyboardMarkup(
@@ -593,9 +188,8 @@ def build_back_keyboard() -> InlineKeyboardMarkup:
 @router.callback_query(F.data == "profile")
 async def handle_profile(callback: CallbackQuery):
     """Показ профиля пользователя."""
-    user = get_user(callback.from_user.id)
-    inventory = get_inventory(user["user_id"])
-    cases_opened = get_cases_opened_count(user["user_id"])
+    user = await db.get_user(callback.from_user.id)
+    stats = await db.get_user_stats(user["user_id"])
 
     text = f"""
 👤 <b>Профиль игрока</b>
@@ -604,40 +198,154 @@ async def handle_profile(callback: CallbackQuery):
 Баланс: {user['balance']} 💎
 Уровень: {user['level']}
 Опыт: {user['experience']} XP
-Открыто кейсов: {cases_opened}
-Предметов в инвентаре: {len(inventory)}
+Открыто кейсов: {stats['cases_opened']}
+Предметов в инвентаре: {stats['inventory_count']}
     """
 
     await callback.message.edit_text(text, reply_markup=build_back_keyboard(), parse_mode=ParseMode.HTML)
     await callback.answer()
 
 
-@router.callback_query(F.data == "inventory")
-async def handle_inventory(callback: CallbackQuery):
-    """Показ инвентаря пользователя."""
-    user = get_user(callback.from_user.id)
-    inventory = get_inventory(user["user_id"])
+# Коды сортировок и фильтров инвентаря в callback_data (лимит 64 байта)
+INVENTORY_SORTS = {"d": ("date", "🕒 По дате"), "p": ("price", "💎 По цене")}
+INVENTORY_RARITIES = {
+    "-": (None, "все"), "c": ("common", "обычные"), "u": ("uncommon", "необычные"),
+    "r": ("rare", "редкие"), "e": ("epic", "эпические"), "l": ("legendary", "легендарные")
+}
+INVENTORY_CATEGORIES = {
+    "-": (None, "все"), "f": ("food", "еда"), "r": ("resources", "ресурсы"),
+    "w": ("weapons", "оружие"), "t": ("tools", "инструменты"), "s": ("special", "особые")
+}
+
+
+def next_code(codes: Dict, current: str) -> str:
+    """Следующее значение фильтра при переключении по кругу."""
+    keys = list(codes)
+    return keys[(keys.index(current) + 1) % len(keys)]
+
+
+def inventory_callback(sort: str, rarity: str, category: str,
+                       direction: Optional[str] = None, cursor=None) -> str:
+    """callback_data страницы инвентаря: inv:<сорт>:<редкость>:<категория>[:<n|p>:<item_id>:<ключ>]"""
+    data = f"inv:{sort}:{rarity}:{category}"
+    if direction and cursor:
+        key, item_id = cursor
+        data += f":{direction}:{item_id}:{key}"
+    return data
+
+
+def parse_inventory_callback(data: str):
+    """Разбор callback_data страницы инвентаря, неизвестные значения сбрасываются."""
+    parts = data.split(":", 6)
+    sort = parts[1] if len(parts) > 1 and parts[1] in INVENTORY_SORTS else "d"
+    rarity = parts[2] if len(parts) > 2 and parts[2] in INVENTORY_RARITIES else "-"
+    category = parts[3] if len(parts) > 3 and parts[3] in INVENTORY_CATEGORIES else "-"
+
+    direction, cursor = None, None
+    if len(parts) == 7 and parts[4] in ("n", "p"):
+        try:
+            item_id = int(parts[5])
+            key = int(parts[6]) if sort == "p" else parts[6]
+        except ValueError:
+            pass
+        else:
+            direction, cursor = parts[4], (key, item_id)
+    return sort, rarity, category, direction, cursor
+
+
+async def show_inventory_page(callback: CallbackQuery, data: str):
+    """Показ страницы инвентаря с листанием, фильтрами и сортировкой."""
+    sort, rarity, category, direction, cursor = parse_inventory_callback(data)
+    user = await db.get_user(callback.from_user.id)
+    page = await db.get_inventory_page(
+        user["user_id"],
+        sort=INVENTORY_SORTS[sort][0],
+        rarity=INVENTORY_RARITIES[rarity][0],
+        category=INVENTORY_CATEGORIES[category][0],
+        cursor=cursor,
+        backward=direction == "p",
+        limit=config.INVENTORY_PAGE_SIZE
+    )
+    if not page["items"] and cursor is not None:
+        # Предметы соседней страницы успели продать, начинаем сначала
+        page = await db.get_inventory_page(
+            user["user_id"],
+            sort=INVENTORY_SORTS[sort][0],
+            rarity=INVENTORY_RARITIES[rarity][0],
+            category=INVENTORY_CATEGORIES[category][0],
+            limit=config.INVENTORY_PAGE_SIZE
+        )
 
-    if inventory:
+    if page["items"]:
         items_preview = "\n".join(
-            f"• {item['icon']} {item['name']} — {item['rarity'].capitalize()} ({item['price']} 💎)"
-            for item in inventory[:8]
+            f"• {item['icon']} {item['name']}{format_quantity(item['quantity'])} — "
+            f"{item['rarity'].capitalize()} ({item['price']} 💎)"
+            for item in page["items"]
         )
-        more_text = "\n\n…и другие предметы." if len(inventory) > 8 else ""
-    else:
+    elif rarity == "-" and category == "-":
         items_preview = "Инвентарь пуст. Откройте кейс, чтобы получить предметы!"
-        more_text = ""
+    else:
+        items_preview = "Нет предметов с такими фильтрами."
 
     text = f"""
 🎒 <b>Инвентарь</b>
+Редкость: {INVENTORY_RARITIES[rarity][1]} · Категория: {INVENTORY_CATEGORIES[category][1]}
 
-{items_preview}{more_text}
+{items_preview}
     """
 
-    await callback.message.edit_text(text, reply_markup=build_back_keyboard(), parse_mode=ParseMode.HTML)
+    navigation = []
+    if page["has_prev"]:
+        navigation.append(InlineKeyboardButton(
+            text="◀️ Назад", callback_data=inventory_callback(sort, rarity, category, "p", page["first"])
+        ))
+    if page["has_next"]:
+        navigation.append(InlineKeyboardButton(
+            text="Вперед ▶️", callback_data=inventory_callback(sort, rarity, category, "n", page["last"])
+        ))
+
+    other_sort = next_code(INVENTORY_SORTS, sort)
+    next_rarity = next_code(INVENTORY_RARITIES, rarity)
+    next_category = next_code(INVENTORY_CATEGORIES, category)
+    keyboard = [
+        navigation,
+        [InlineKeyboardButton(
+            text=INVENTORY_SORTS[other_sort][1],
+            callback_data=inventory_callback(other_sort, rarity, category)
+        )],
+        [
+            InlineKeyboardButton(
+                text=f"✨ {INVENTORY_RARITIES[next_rarity][1].capitalize()}",
+                callback_data=inventory_callback(sort, next_rarity, category)
+            ),
+            InlineKeyboardButton(
+                text=f"📂 {INVENTORY_CATEGORIES[next_category][1].capitalize()}",
+                callback_data=inventory_callback(sort, rarity, next_category)
+            )
+        ],
+        [InlineKeyboardButton(text="↩️ Вернуться назад", callback_data="back_to_menu")]
+    ]
+
+    await callback.message.edit_text(
+        text,
+        reply_markup=InlineKeyboardMarkup(inline_keyboard=[row for row in keyboard if row]),
+        parse_mode=ParseMode.HTML
+    )
     await callback.answer()
 
 
+@router.callback_query(F.data == "inventory")
+async def handle_inventory(callback: CallbackQuery):
+    """Показ инвентаря пользователя."""
+    await show_inventory_page(callback, "inv:d:-:-")
+
+
+@router.callback_query(F.data.startswith("inv:"))
+async def handle_inventory_page(callback: CallbackQuery):
+    """Листание, фильтры и сортировка инвентаря."""
+    await show_inventory_page(callback, callback.data)
+
+
 @router.callback_query(F.data == "deposit")
 async def handle_deposit(callback: CallbackQuery):
     """Показ информации о пополнении."""
@@ -669,9 +377,9 @@ async def handle_trade(callback: CallbackQuery):
 @router.callback_query(F.data == "back_to_menu")
 async def handle_back_to_menu(callback: CallbackQuery):
     """Возврат к главному меню."""
-    user = get_user(callback.from_user.id)
-    cases_opened = get_cases_opened_count(user["user_id"])
-    text = build_main_menu_text(callback.from_user.first_name, user, cases_opened)
+    user = await db.get_user(callback.from_user.id)
+    stats = await db.get_user_stats(user["user_id"])
+    text = build_main_menu_text(callback.from_user.first_name, user, stats["cases_opened"])
 
     await callback.message.edit_text(text, reply_markup=build_main_menu_keyboard(), parse_mode=ParseMode.HTML)
     await callback.answer()
@@ -679,10 +387,8 @@ async def handle_back_to_menu(callback: CallbackQuery):
 @router.message(Command("balance"))
 async def cmd_balance(message: Message):
     """Проверка баланса"""
-    print(f"📥 Получена команда /balance от пользователя {message.from_user.id}")
-    
-    user = get_user(message.from_user.id)
-    inventory = get_inventory(user["user_id"])
+    user = await db.get_user(message.from_user.id)
+    stats = await db.get_user_stats(user["user_id"])
     
     text = f"""
 💰 <b>Статистика аккаунта</b>
@@ -691,29 +397,78 @@ async def cmd_balance(message: Message):
 💎 <b>Баланс:</b> {user['balance']}
 🎮 <b>Уровень:</b> {user['level']}
 ⭐ <b>Опыт:</b> {user['experience']} / {user['level'] * 1000}
-📦 <b>Предметов в инвентаре:</b> {len(inventory)}
-📊 <b>Общая стоимость:</b> {sum(item['price'] for item in inventory)} 💎
+📦 <b>Предметов в инвентаре:</b> {stats['inventory_count']}
+📊 <b>Общая стоимость:</b> {stats['inventory_value']} 💎
     """
     
     await message.answer(text, parse_mode=ParseMode.HTML)
-    print(f"📤 Отправлена статистика пользователю {message.from_user.id}")
+
+WEBAPP_ACTIONS = ('init', 'sync_data', 'open_case', 'open_cases', 'sell_item')
+
+def parse_optional_int(value) -> Optional[int]:
+    """Преобразование необязательного числового поля из Web App"""
+    try:
+        return int(value) if value is not None else None
+    except (TypeError, ValueError):
+        return None
+
+def parse_request_id(value) -> Optional[str]:
+    """Идентификатор запроса из Web App: непустая строка до 64 символов"""
+    if isinstance(value, str) and 0 < len(value) <= 64:
+        return value
+    return None
+
+def webapp_action_label(action) -> str:
+    """Действие для метки метрик: произвольные строки от клиента не плодят серии"""
+    return action if action in WEBAPP_ACTIONS else "unknown"
+
+async def send_webapp_response(message: Message, action: Optional[str], response: Dict, request: Dict):
+    """Отправка ответа Web App: компактно, если клиент это поддерживает, и частями, если не влезает"""
+    if not response.get('success', True):
+        metrics.webapp_action_errors.inc(action=webapp_action_label(action))
+    messages = encode_response(action, response, db.catalog, request)
+    for text in messages:
+        await message.answer(text, parse_mode=None)
+    log.debug("Ответ Web App", extra={
+        "action": action,
+        "bytes": sum(len(text.encode()) for text in messages),
+        "messages": len(messages)
+    })
 
 @router.message(F.web_app_data)
 async def handle_web_app_data(message: Message):
+    """Обработка данных из Web App с замером времени по действиям"""
+    started = time.perf_counter()
+    action, ok = await process_web_app_data(message)
+    elapsed = time.perf_counter() - started
+    metrics.webapp_action_seconds.observe(elapsed, action=webapp_action_label(action))
+    log.info("Действие Web App", extra={
+        "user_id": message.from_user.id,
+        "action": webapp_action_label(action),
+        "latency_ms": round(elapsed * 1000, 2),
+        "outcome": "ok" if ok else "error",
+        "sampled": ok
+    })
+
+async def process_web_app_data(message: Message) -> Tuple[Optional[str], bool]:
     """Обработка данных из Web App - БЫСТРЫЙ ОТВЕТ БЕЗ ЗАДЕРЖЕК"""
+    data = {}
+    action = None
+    ok = True
     try:
-        print(f"🌐 Получены данные из Web App от пользователя {message.from_user.id}")
-        
         data = json.loads(message.web_app_data.data)
         user_id = message.from_user.id
         action = data.get('action')
-        
-        print(f"📋 Действие: {action}")
+        # Ревизия данных и версия каталога, известные клиенту
+        since_revision = parse_optional_int(data.get('revision'))
+        catalog_version = parse_optional_int(data.get('catalog_version'))
+        # Идентификатор запроса: повтор с тем же id не выполняется второй раз
+        request_id = parse_request_id(data.get('request_id'))
         
         # БЫСТРЫЙ ОТВЕТ НА ВСЕ ЗАПРОСЫ
         if action == 'init' or action == 'sync_data':
             # Инициализация или синхронизация - МГНОВЕННЫЙ ОТВЕТ
-            webapp_data = get_user_data_for_webapp(user_id)
+            webapp_data = await db.get_user_data_for_webapp(user_id, since_revision, catalog_version)
             webapp_data['success'] = True
             webapp_data['config'] = {
                 'min_bet': 10,
@@ -723,128 +478,302 @@ async def handle_web_app_data(message: Message):
             }
             
             # Отправляем ответ НЕМЕДЛЕННО
-            await message.answer(
-                json.dumps(webapp_data),
-                parse_mode=None
-            )
-            print(f"📤 Отправлен ответ на {action}")
+            await send_webapp_response(message, action, webapp_data, data)
             
         elif action == 'open_case':
             # Открытие кейса - УПРОЩЕННЫЙ ПРОЦЕСС
-            case_id = data.get('case_id')
-            print(f"🎰 Пользователь {user_id} открывает кейс {case_id}")
+            # Каталог в памяти ищет по целым ключам, а клиент может прислать "1"
+            case_id = parse_optional_int(data.get('case_id'))
+            if case_id is None:
+                response = {'success': False, 'error': 'Кейс не найден'}
+                await send_webapp_response(message, action, response, data)
+                return action, False
             
             # БЫСТРОЕ открытие кейса
-            result = open_case(user_id, case_id)
+            result = await db.open_case(user_id, case_id, request_id)
             
             if 'error' in result:
-                print(f"❌ Ошибка при открытии кейса: {result['error']}")
                 response = {'success': False, 'error': result['error']}
-                await message.answer(json.dumps(response), parse_mode=None)
-                return
+                await send_webapp_response(message, action, response, data)
+                return action, False
             
             # Добавляем дополнительные данные
-            webapp_data = get_user_data_for_webapp(user_id)
+            webapp_data = await db.get_user_data_for_webapp(user_id, since_revision, catalog_version)
             result.update(webapp_data)
             
             # Отправляем результат НЕМЕДЛЕННО
-            await message.answer(json.dumps(result), parse_mode=None)
-            print(f"📤 Отправлен результат открытия кейса")
+            await send_webapp_response(message, action, result, data)
             
+        elif action == 'open_cases':
+            # Открытие нескольких кейсов одним сообщением
+            case_id = parse_optional_int(data.get('case_id'))
+            if case_id is None:
+                response = {'success': False, 'error': 'Кейс не найден'}
+                await send_webapp_response(message, action, response, data)
+                return action, False
+            try:
+                count = int(data.get('count', 1))
+            except (TypeError, ValueError):
+                count = 0
+
+            if not 1 <= count <= config.MAX_BATCH_OPEN:
+                response = {
+                    'success': False,
+                    'error': f'Можно открыть от 1 до {config.MAX_BATCH_OPEN} кейсов за раз'
+                }
+                await send_webapp_response(message, action, response, data)
+                return action, False
+
+            result = await db.open_cases(user_id, case_id, count, request_id)
+
+            if 'error' in result:
+                response = {'success': False, 'error': result['error']}
+                await send_webapp_response(message, action, response, data)
+                return action, False
+
+            webapp_data = await db.get_user_data_for_webapp(user_id, since_revision, catalog_version)
+            result.update(webapp_data)
+
+            await send_webapp_response(message, action, result, data)
+
         elif action == 'sell_item':
             # Продажа предмета - БЫСТРАЯ ОБРАБОТКА
-            item_id = data.get('item_id')
-            print(f"💰 Пользователь {user_id} продает предмет {item_id}")
-            
-            conn = sqlite3.connect(DB_PATH)
-            cursor = conn.cursor()
-            
-            # Получаем цену предмета
-            cursor.execute("SELECT sell_price, name FROM items WHERE item_id = ?", (item_id,))
-            item_data = cursor.fetchone()
-            
-            if not item_data:
+            item_id = parse_optional_int(data.get('item_id'))
+            if item_id is None:
                 response = {'success': False, 'error': 'Предмет не найден'}
-                await message.answer(json.dumps(response), parse_mode=None)
-                conn.close()
-                return
-            
-            # Удаляем предмет из инвентаря
-            cursor.execute(
-                "DELETE FROM inventory WHERE user_id = ? AND item_id = ? LIMIT 1",
-                (user_id, item_id)
-            )
+                await send_webapp_response(message, action, response, data)
+                return action, False
             
-            if cursor.rowcount == 0:
-                response = {'success': False, 'error': 'Предмет не найден в инвентаре'}
-                await message.answer(json.dumps(response), parse_mode=None)
-                conn.close()
-                return
+            result = await db.sell_item(user_id, item_id, request_id)
             
-            # Добавляем деньги
-            sell_price, item_name = item_data
-            cursor.execute(
-                "UPDATE users SET balance = balance + ? WHERE user_id = ?",
-                (sell_price, user_id)
-            )
-            
-            cursor.execute(
-                """INSERT INTO transactions (user_id, type, amount, description) 
-                   VALUES (?, 'reward', ?, ?)""",
-                (user_id, sell_price, f"Продажа предмета: {item_name}")
-            )
-            
-            # Получаем новый баланс
-            cursor.execute("SELECT balance FROM users WHERE user_id = ?", (user_id,))
-            new_balance = cursor.fetchone()[0]
+            if 'error' in result:
+                response = {'success': False, 'error': result['error']}
+                await send_webapp_response(message, action, response, data)
+                return action, False
             
             # Получаем обновленные данные
-            webapp_data = get_user_data_for_webapp(user_id)
+            webapp_data = await db.get_user_data_for_webapp(user_id, since_revision, catalog_version)
             
             response = {
                 'success': True,
-                'sell_price': sell_price,
-                'new_balance': new_balance
+                'sell_price': result['sell_price'],
+                'new_balance': result['new_balance']
             }
             response.update(webapp_data)
             
-            await message.answer(json.dumps(response), parse_mode=None)
-            conn.commit()
-            conn.close()
+            await send_webapp_response(message, action, response, data)
             
         else:
             # Неизвестное действие
             response = {'success': False, 'error': 'Неизвестное действие'}
-            await message.answer(json.dumps(response), parse_mode=None)
-            print(f"❌ Неизвестное действие: {action}")
+            await send_webapp_response(message, action, response, data)
+            ok = False
             
     except json.JSONDecodeError as e:
-        print(f"❌ Ошибка декодирования JSON: {e}")
+        log.warning("Неверный JSON от Web App: %s", e, extra={"user_id": message.from_user.id})
+        ok = False
         response = {'success': False, 'error': 'Неверный формат данных'}
-        await message.answer(json.dumps(response), parse_mode=None)
+        await send_webapp_response(message, action, response, data)
     except Exception as e:
-        print(f"❌ Ошибка обработки Web App данных: {e}")
-        import traceback
-        traceback.print_exc()
-        
+        log.exception("Ошибка обработки Web App данных", extra={
+            "user_id": message.from_user.id, "action": action
+        })
+        ok = False
+
         if DEBUG:
             error_msg = str(e)
         else:
             error_msg = "Произошла ошибка. Пожалуйста, попробуйте позже."
         
         response = {'success': False, 'error': error_msg}
-        await message.answer(json.dumps(response), parse_mode=None)
+        await send_webapp_response(message, action, response, data)
+
+    return action, ok
+
+@router.message(Command("reload_catalog"), F.from_user.id == ADMIN_ID)
+async def cmd_reload_catalog(message: Message):
+    """Перезагрузка каталога предметов и кейсов (только для администратора)"""
+    catalog = await db.reload_catalog()
+    await message.answer(
+        f"📚 Каталог перезагружен: {len(catalog.items)} предметов, {len(catalog.cases)} кейсов"
+        + workers_note("каталог перечитан в каждом")
+    )
+
+@router.message(Command("payload_stats"), F.from_user.id == ADMIN_ID)
+async def cmd_payload_stats(message: Message):
+    """Размеры ответов Web App по действиям (только для администратора)"""
+    lines = size_stats.summary() or ["Ответов пока не было"]
+    await message.answer("📦 Размеры ответов Web App:\n" + "\n".join(lines) + worker_label())
+
+@router.message(Command("cache_stats"), F.from_user.id == ADMIN_ID)
+async def cmd_cache_stats(message: Message):
+    """Попадания и промахи кэшей (только для администратора)"""
+    lines = []
+    for name, cache in (("Пользователи", db.users), ("Повторы запросов", db.idempotency)):
+        stats = cache.stats()
+        total = stats["hits"] + stats["misses"]
+        hit_rate = stats["hits"] * 100 // total if total else 0
+        lines.append(
+            f"{name}: {stats['size']} записей, попаданий {stats['hits']}, "
+            f"промахов {stats['misses']} ({hit_rate}%), вытеснено {stats['evictions']}"
+        )
+    await message.answer("🧠 Кэши:\n" + "\n".join(lines) + worker_label())
+
+@router.message(Command("loop_stats"), F.from_user.id == ADMIN_ID)
+async def cmd_loop_stats(message: Message):
+    """Задержка цикла событий и последние блокировки (только для администратора)"""
+    percentiles = loop_watchdog.percentiles()
+    if not percentiles:
+        await message.answer("⏱️ Сторож цикла событий выключен или еще не собрал данные" + worker_label())
+        return
+    lines = [
+        "⏱️ Задержка цикла: " + ", ".join(
+            f"p{float(q) * 100:g} {lag * 1000:.1f} мс" for q, lag in percentiles.items()
+        )
+    ]
+    for stall in list(loop_watchdog.stalls)[-5:]:
+        when = datetime.fromtimestamp(stall["at"]).strftime("%H:%M:%S")
+        lines.append(f"{when} {stall['handler']}: {stall['duration_ms']} мс ({stall['culprit'] or '?'})")
+    await message.answer("\n".join(lines) + worker_label())
+
+def toggle_recording(argument: str) -> bool:
+    """/record_updates [on|off]: без аргумента переключает запись"""
+    return update_recorder.toggle({"on": True, "off": False}.get(argument.strip().lower()))
+
+def workers_note(detail: str = "у каждого свой файл") -> str:
+    """Пояснение к ответу на команду, разосланную всем воркерам (sharding.py)"""
+    if config.BOT_WORKERS <= 1:
+        return ""
+    return f"\nКоманда применена во всех воркерах ({config.BOT_WORKERS}), {detail}"
+
+def worker_label() -> str:
+    """Пояснение к статистике, которую каждый воркер (sharding.py) ведет сам"""
+    if config.BOT_WORKERS <= 1:
+        return ""
+    return (f"\nОтветил воркер {config.BOT_WORKER_INDEX} из {config.BOT_WORKERS}, "
+            f"у остальных своя статистика")
+
+async def apply_broadcast_command(text: str):
+    """Команда администратора, которую супервизор переслал из другого
+    воркера: применяется без ответа, отвечает воркер, получивший сообщение"""
+    command, _, argument = text.partition(" ")
+    command = command[1:].split("@")[0]
+    if command == "record_updates":
+        toggle_recording(argument)
+    elif command == "profile":
+        try:
+            profiler.start(*parse_profile_args(argument.split()))
+        except (RuntimeError, ValueError) as e:
+            log.warning("Профилирование не начато: %s", e)
+    elif command == "profile_stop":
+        await profiler.stop()
+    elif command == "reload_catalog":
+        await db.reload_catalog()
+
+@router.message(Command("record_updates"), F.from_user.id == ADMIN_ID)
+async def cmd_record_updates(message: Message):
+    """Включение и выключение записи обновлений: /record_updates [on|off] (только для администратора)"""
+    enabled = toggle_recording((message.text or "").partition(" ")[2])
+    state = "включена" if enabled else "выключена"
+    await message.answer(
+        f"📼 Запись обновлений {state}: {update_recorder.path}, записано {update_recorder.recorded}"
+        + workers_note()
+    )
+
+def parse_profile_args(args: List[str]):
+    """Аргументы /profile: цель, режим, "30s" - окно в секундах, "100" - число запросов"""
+    target, mode, seconds, requests = None, "sample", None, None
+    for arg in args:
+        if arg in PROFILE_MODES:
+            mode = arg
+        elif arg.endswith("s") and arg[:-1].replace(".", "", 1).isdigit():
+            seconds = float(arg[:-1])
+        elif arg.isdigit():
+            requests = int(arg)
+        elif target is None:
+            target = arg
+        else:
+            raise ValueError(f"Лишний аргумент: {arg}")
+    if target is None:
+        raise ValueError("Укажите цель")
+    if seconds is not None and seconds <= 0:
+        raise ValueError("Длительность должна быть больше нуля")
+    if seconds is None and requests is None:
+        seconds = 30
+    # Ограничение по числу запросов все равно не дольше 10 минут
+    return target, mode, 600 if seconds is None else seconds, requests
+
+@router.message(Command("profile"), F.from_user.id == ADMIN_ID)
+async def cmd_profile(message: Message):
+    """Профилирование обработчика или действия (только для администратора)"""
+    try:
+        target, mode, seconds, requests = parse_profile_args((message.text or "").split()[1:])
+    except ValueError as e:
+        await message.answer(
+            f"❌ {e}\n"
+            "Использование: /profile <цель> [sample|cpu|memory] [30s|100]\n"
+            "Цель: имя обработчика (cmd_start, handle_inventory_page), webapp:open_case или all"
+        )
+        return
+
+    async def report(session, paths):
+        files = "\n".join(str(path) for path in paths) or "нет файлов"
+        await message.answer(f"📊 Профилирование завершено: {session.describe()}\n{files}"
+                             + workers_note(f"файлы остальных - в {config.LOG_DIR}/worker<N>"))
+
+    try:
+        session = profiler.start(target, mode, seconds, requests, on_finish=report)
+    except (RuntimeError, ValueError) as e:
+        await message.answer(f"❌ {e}")
+        return
+    await message.answer(f"🔬 Профилирование начато: {session.describe()}"
+                         + workers_note(f"файлы - в {config.LOG_DIR}/worker<N>"))
+
+@router.message(Command("profile_stop"), F.from_user.id == ADMIN_ID)
+async def cmd_profile_stop(message: Message):
+    """Досрочная остановка профилирования (только для администратора)"""
+    if profiler.session is None:
+        await message.answer("Профилирование не запущено")
+        return
+    # Итог придет сообщением от /profile
+    await profiler.stop()
+
+@router.message(Command("rebuild_stats"), F.from_user.id == ADMIN_ID)
+async def cmd_rebuild_stats(message: Message):
+    """Пересчет счетчиков пользователей по истории (только для администратора)"""
+    rebuilt = await db.rebuild_user_stats()
+    await message.answer(f"📊 Счетчики пересчитаны для {rebuilt} пользователей")
 
 @router.message()
 async def handle_unknown(message: Message):
     """Обработка неизвестных сообщений"""
-    print(f"❓ Получено неизвестное сообщение от {message.from_user.id}: {message.text}")
+    log.info("Неизвестное сообщение", extra={"user_id": message.from_user.id, "sampled": True})
     await message.answer("🤔 Не понимаю вашу команду. Используйте /help для списка команд.")
 
+def configure_logging(filename: str = "bot.log"):
+    """Журнал в JSON с ротацией в LOG_DIR, запись в фоновом потоке"""
+    setup_logging(
+        directory=config.LOG_DIR,
+        filename=filename,
+        level="DEBUG" if DEBUG else config.LOG_LEVEL,
+        max_bytes=config.LOG_MAX_BYTES,
+        backup_count=config.LOG_BACKUP_COUNT,
+        sample_rate=config.LOG_SAMPLE_RATE,
+        console_level=config.LOG_CONSOLE_LEVEL
+    )
+
 async def main():
     """Основная функция запуска бота"""
+    configure_logging()
     # Инициализация базы данных
-    init_db()
+    await db.connect()
+    menu_button.start_refresh()
+    maintenance.start()
+    if config.LOOP_LAG_THRESHOLD_MS > 0:
+        loop_watchdog.start()
+    metrics_runner = None
+    if config.METRICS_PORT:
+        metrics_runner = await metrics.start_metrics_server(config.METRICS_HOST, config.METRICS_PORT)
     
     print("=" * 50)
     print("🎮 Minecraft Case Opening Bot")
@@ -852,16 +781,29 @@ async def main():
     print(f"👑 Админ ID: {ADMIN_ID}")
     print(f"🐛 Режим отладки: {DEBUG}")
     print(f"🗄️ База данных: {DB_PATH}")
+    print(f"📡 Режим: {config.BOT_MODE}")
     print("=" * 50)
     print("✅ Бот успешно запущен!")
     print("⛏️ Ожидание команд...")
     print("=" * 50)
     
     try:
-        await dp.start_polling(bot)
+        if config.BOT_MODE == "webhook":
+            await run_webhook(bot, dp, config)
+        else:
+            await dp.start_polling(bot)
     except Exception as e:
         print(f"❌ Ошибка при запуске бота: {e}")
         raise
+    finally:
+        await loop_watchdog.stop()
+        update_recorder.close()
+        await maintenance.close()
+        await menu_button.close()
+        await outbound.close()
+        await db.close()
+        if metrics_runner is not None:
+            await metrics_runner.cleanup()
 
 if __name__ == "__main__":
     try:
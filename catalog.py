@@ -0,0 +1,166 @@
+import json
+import random
+import sqlite3
+from typing import Dict, List, Optional, Sequence
+
+
+class AliasTable:
+    """Таблица Уолкера для выбора исхода по весам за O(1)"""
+
+    def __init__(self, outcomes: Sequence, weights: Sequence[float]):
+        if not outcomes or len(outcomes) != len(weights):
+            raise ValueError("Нужен хотя бы один исход с весом")
+
+        total = float(sum(weights))
+        if total <= 0:
+            raise ValueError("Сумма весов должна быть положительной")
+
+        count = len(outcomes)
+        self.outcomes = list(outcomes)
+        self.probability = [0.0] * count
+        self.alias = [0] * count
+
+        scaled = [weight * count / total for weight in weights]
+        small = [i for i, value in enumerate(scaled) if value < 1.0]
+        large = [i for i, value in enumerate(scaled) if value >= 1.0]
+
+        while small and large:
+            less = small.pop()
+            more = large.pop()
+            self.probability[less] = scaled[less]
+            self.alias[less] = more
+            scaled[more] -= 1.0 - scaled[less]
+            if scaled[more] < 1.0:
+                small.append(more)
+            else:
+                large.append(more)
+
+        # Остатки из-за погрешности округления считаем равными единице
+        for i in large + small:
+            self.probability[i] = 1.0
+
+    def sample(self, rng: random.Random = random):
+        column = rng.randrange(len(self.outcomes))
+        if rng.random() < self.probability[column]:
+            return self.outcomes[column]
+        return self.outcomes[self.alias[column]]
+
+
+class Catalog:
+    """Снимок предметов и кейсов в памяти.
+
+    Загружается при старте целиком и заменяется новым объектом при
+    изменении таблиц items или cases, поэтому выбор выигрыша не требует
+    обращений к базе данных.
+    """
+
+    def __init__(self, items: List[Dict], cases: List[Dict], version: int = 0):
+        self.version = version
+        self.items: Dict[int, Dict] = {item["id"]: item for item in items}
+        self.items_by_rarity: Dict[str, List[Dict]] = {}
+        for item in items:
+            self.items_by_rarity.setdefault(item["rarity"], []).append(item)
+
+        self.cases: Dict[int, Dict] = {case["id"]: case for case in cases}
+        self.drop_tables: Dict[int, AliasTable] = {}
+        for case in cases:
+            weights = {
+                rarity: weight
+                for rarity, weight in case["rarity_weights"].items()
+                if weight > 0
+            }
+            if weights:
+                self.drop_tables[case["id"]] = AliasTable(list(weights), list(weights.values()))
+
+    @classmethod
+    def load(cls, conn: sqlite3.Connection) -> "Catalog":
+        """Загрузка каталога из базы данных"""
+        cursor = conn.cursor()
+
+        cursor.execute(
+            """SELECT item_id, name, icon, rarity, category, price, sell_price, description, texture_url
+               FROM items ORDER BY item_id"""
+        )
+        items = [
+            {
+                "id": row[0],
+                "name": row[1],
+                "icon": row[2],
+                "rarity": row[3],
+                "category": row[4],
+                "price": row[5],
+                "sell_price": row[6],
+                "description": row[7],
+                "texture_url": row[8]
+            }
+            for row in cursor.fetchall()
+        ]
+
+        cursor.execute(
+            """SELECT case_id, name, price, icon, description, rarity_weights, texture_url, is_active
+               FROM cases ORDER BY case_id"""
+        )
+        cases = [
+            {
+                "id": row[0],
+                "name": row[1],
+                "price": row[2],
+                "icon": row[3],
+                "description": row[4],
+                "rarity_weights": json.loads(row[5]),
+                "texture_url": row[6],
+                "is_active": bool(row[7])
+            }
+            for row in cursor.fetchall()
+        ]
+
+        return cls(items, cases, get_catalog_version(conn))
+
+    @property
+    def active_cases(self) -> List[Dict]:
+        """Список активных кейсов в формате get_cases"""
+        return [
+            {key: value for key, value in case.items() if key != "is_active"}
+            for case in self.cases.values()
+            if case["is_active"]
+        ]
+
+    def roll(self, case_id: int, rng: random.Random = random) -> Optional[Dict]:
+        """Выбор случайного предмета из кейса без запросов к БД"""
+        table = self.drop_tables.get(case_id)
+        if table is None:
+            return None
+
+        rarity = table.sample(rng)
+        bucket = self.items_by_rarity.get(rarity)
+        if not bucket:
+            return None
+
+        return bucket[rng.randrange(len(bucket))]
+
+    def roll_many(self, case_id: int, count: int, rng: random.Random = random) -> Optional[List[Dict]]:
+        """Выбор нескольких предметов за один проход по таблице кейса"""
+        table = self.drop_tables.get(case_id)
+        if table is None:
+            return None
+
+        outcomes, probability, alias = table.outcomes, table.probability, table.alias
+        columns = len(outcomes)
+        buckets = self.items_by_rarity
+        randrange, uniform = rng.randrange, rng.random
+
+        won = []
+        for _ in range(count):
+            column = randrange(columns)
+            rarity = outcomes[column] if uniform() < probability[column] else outcomes[alias[column]]
+            bucket = buckets.get(rarity)
+            if not bucket:
+                return None
+            won.append(bucket[randrange(len(bucket))])
+        return won
+
+
+def get_catalog_version(conn: sqlite3.Connection) -> int:
+    """Версия каталога, увеличиваемая триггерами на items и cases"""
+    row = conn.execute("SELECT version FROM catalog_meta WHERE id = 1").fetchone()
+    return row[0] if row else 0
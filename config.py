@@ -14,12 +14,99 @@ class Config:
     
     # Настройки Web App
     WEB_APP_URL: str = os.getenv('WEB_APP_URL', 'https://mrmicse.github.io/minecraft-cases/')
+    # Сколько чатов в секунду обновлять после смены WEB_APP_URL
+    MENU_BUTTON_REFRESH_RATE: float = float(os.getenv('MENU_BUTTON_REFRESH_RATE', 5))
+    
+    # Адрес Bot API, пусто - api.telegram.org
+    TELEGRAM_API_URL: str = os.getenv('TELEGRAM_API_URL', '')
+    # Очередь исходящих запросов
+    # OUTBOUND_GLOBAL_RATE - общий лимит бота: при BOT_WORKERS > 1 он делится
+    # поровну между воркерами
+    OUTBOUND_GLOBAL_RATE: float = float(os.getenv('OUTBOUND_GLOBAL_RATE', 30))
+    OUTBOUND_CHAT_INTERVAL: float = float(os.getenv('OUTBOUND_CHAT_INTERVAL', 1.0))
+    OUTBOUND_WORKERS: int = int(os.getenv('OUTBOUND_WORKERS', 8))
+    OUTBOUND_MAX_RETRIES: int = int(os.getenv('OUTBOUND_MAX_RETRIES', 5))
+    
+    # Режим получения обновлений: polling или webhook
+    BOT_MODE: str = os.getenv('BOT_MODE', 'polling').lower()
+    WEBHOOK_URL: str = os.getenv('WEBHOOK_URL', '')
+    WEBHOOK_PATH: str = os.getenv('WEBHOOK_PATH', '/webhook')
+    WEBHOOK_HOST: str = os.getenv('WEBHOOK_HOST', '0.0.0.0')
+    WEBHOOK_PORT: int = int(os.getenv('WEBHOOK_PORT', 8080))
+    WEBHOOK_SECRET: str = os.getenv('WEBHOOK_SECRET', '')
+    WEBHOOK_QUEUE_SIZE: int = int(os.getenv('WEBHOOK_QUEUE_SIZE', 1000))
+    WEBHOOK_WORKERS: int = int(os.getenv('WEBHOOK_WORKERS', 16))
+    WEBHOOK_DRAIN_SECONDS: float = float(os.getenv('WEBHOOK_DRAIN_SECONDS', 25))
+    WEBHOOK_MAX_CONNECTIONS: int = int(os.getenv('WEBHOOK_MAX_CONNECTIONS', 40))
+    # Число процессов бота: больше 1 - обновления раздаются воркерам по user_id
+    BOT_WORKERS: int = int(os.getenv('BOT_WORKERS', 1))
+    # Номер текущего воркера, его задает супервизор процессов (sharding.py)
+    BOT_WORKER_INDEX: int = 0
+    WORKER_QUEUE_SIZE: int = int(os.getenv('WORKER_QUEUE_SIZE', 1000))
+    
+    # Настройки базы данных
+    DB_BATCH_MAX_OPS: int = int(os.getenv('DB_BATCH_MAX_OPS', 64))
+    DB_BATCH_DELAY_MS: float = float(os.getenv('DB_BATCH_DELAY_MS', 2))
+    DB_MMAP_SIZE_MB: int = int(os.getenv('DB_MMAP_SIZE_MB', 256))
+    DB_CACHE_SIZE_MB: int = int(os.getenv('DB_CACHE_SIZE_MB', 64))
+    CATALOG_REFRESH_SECONDS: float = float(os.getenv('CATALOG_REFRESH_SECONDS', 30))
+    
+    # Настройки синхронизации Web App
+    SYNC_MAX_DELTA_REVISIONS: int = int(os.getenv('SYNC_MAX_DELTA_REVISIONS', 500))
+    # Кэш пользователей в памяти
+    USER_CACHE_SIZE: int = int(os.getenv('USER_CACHE_SIZE', 10000))
+    USER_CACHE_TTL_SECONDS: float = float(os.getenv('USER_CACHE_TTL_SECONDS', 60))
+    # Защита от повторных запросов: кэш ответов в памяти и срок хранения в базе
+    IDEMPOTENCY_CACHE_SIZE: int = int(os.getenv('IDEMPOTENCY_CACHE_SIZE', 10000))
+    IDEMPOTENCY_TTL_SECONDS: float = float(os.getenv('IDEMPOTENCY_TTL_SECONDS', 600))
+    IDEMPOTENCY_RETENTION_HOURS: float = float(os.getenv('IDEMPOTENCY_RETENTION_HOURS', 24))
+    
+    # Ограничение частоты: класс=токенов_в_секунду:размер_корзины
+    RATE_LIMITS: str = os.getenv('RATE_LIMITS', 'command=1:5,callback=2:8,webapp=3:10,message=0.5:3')
+    RATE_LIMIT_MAX_BUCKETS: int = int(os.getenv('RATE_LIMIT_MAX_BUCKETS', 100000))
+    CALLBACK_COALESCE_SECONDS: float = float(os.getenv('CALLBACK_COALESCE_SECONDS', 1.0))
+
+    # Метрики Prometheus: GET /metrics, 0 - выключено. Воркеры при
+    # BOT_WORKERS > 1 слушают следующие порты: METRICS_PORT + 1 + номер
+    METRICS_HOST: str = os.getenv('METRICS_HOST', '127.0.0.1')
+    METRICS_PORT: int = int(os.getenv('METRICS_PORT', 9101))
+
+    # Журнал в JSON: logs/bot.log с ротацией по размеру. Частые события
+    # (каждое обновление) пишутся с вероятностью LOG_SAMPLE_RATE
+    LOG_DIR: str = os.getenv('LOG_DIR', 'logs')
+    LOG_LEVEL: str = os.getenv('LOG_LEVEL', 'INFO')
+    LOG_MAX_BYTES: int = int(os.getenv('LOG_MAX_BYTES', 10 * 1024 * 1024))
+    LOG_BACKUP_COUNT: int = int(os.getenv('LOG_BACKUP_COUNT', 5))
+    LOG_SAMPLE_RATE: float = float(os.getenv('LOG_SAMPLE_RATE', 0.1))
+    LOG_CONSOLE_LEVEL: str = os.getenv('LOG_CONSOLE_LEVEL', 'WARNING')
+
+    # Сторож цикла событий: блокировка дольше порога пишется в журнал со
+    # стеком виновного обработчика, 0 - выключено
+    LOOP_LAG_THRESHOLD_MS: float = float(os.getenv('LOOP_LAG_THRESHOLD_MS', 100))
+    LOOP_LAG_INTERVAL_MS: float = float(os.getenv('LOOP_LAG_INTERVAL_MS', 50))
+
+    # Запись входящих обновлений для воспроизведения (replay.py)
+    RECORD_UPDATES: bool = os.getenv('RECORD_UPDATES', 'False').lower() == 'true'
+    RECORD_UPDATES_PATH: str = os.getenv('RECORD_UPDATES_PATH', 'logs/updates.jsonl.gz')
+    RECORD_UPDATES_MAX_MB: int = int(os.getenv('RECORD_UPDATES_MAX_MB', 512))
+
+    # Строки истории открытий и транзакций старше срока переносятся в
+    # архив и дневные сводки и удаляются из рабочих таблиц (maintenance.py).
+    # По умолчанию 0 - выключено, всё хранится в основной базе. Пустой
+    # HISTORY_ARCHIVE_PATH - без архива, только сводки
+    HISTORY_RETENTION_DAYS: float = float(os.getenv('HISTORY_RETENTION_DAYS', 0))
+    HISTORY_ARCHIVE_PATH: str = os.getenv('HISTORY_ARCHIVE_PATH', 'archive.db')
+    MAINTENANCE_INTERVAL_MINUTES: float = float(os.getenv('MAINTENANCE_INTERVAL_MINUTES', 60))
+    MAINTENANCE_BATCH_SIZE: int = int(os.getenv('MAINTENANCE_BATCH_SIZE', 2000))
+    VACUUM_PAGES_PER_RUN: int = int(os.getenv('VACUUM_PAGES_PER_RUN', 1000))
     
     # Настройки игры
     STARTING_BALANCE: int = 1000
     DAILY_BONUS: int = 100
     MIN_BET: int = 10
     MAX_BET: int = 10000
+    MAX_BATCH_OPEN: int = int(os.getenv('MAX_BATCH_OPEN', 100))
+    INVENTORY_PAGE_SIZE: int = int(os.getenv('INVENTORY_PAGE_SIZE', 8))
     
     # Проверка обязательных настроек
     def validate(self):
@@ -0,0 +1,139 @@
+import argparse
+import asyncio
+import itertools
+import json
+import time
+from collections import defaultdict
+from typing import Dict, List
+
+from aiohttp import web
+
+
+class FakeBotAPI:
+    """Локальная замена Bot API для проверки бота под нагрузкой.
+
+    Отвечает на методы бота правдоподобными результатами, записывает все
+    вызовы и, как настоящий Telegram, возвращает 429 с retry_after, если в
+    один чат пишут чаще, чем раз в chat_interval секунд. Обновления для
+    getUpdates добавляются через POST /_inject, сводка вызовов - GET /_calls.
+    """
+
+    def __init__(self, chat_interval: float = 1.0, retry_after: int = 1, latency_ms: float = 0):
+        self.chat_interval = chat_interval
+        self.retry_after = retry_after
+        self.latency = latency_ms / 1000
+        self.updates: asyncio.Queue = asyncio.Queue()
+        self.calls: List[Dict] = []
+        self.flood_errors = 0
+        self._last_chat_call: Dict = {}
+        self._message_ids = itertools.count(1)
+        self._update_ids = itertools.count(1)
+
+        self.app = web.Application()
+        self.app.router.add_route("*", "/bot{token}/{method}", self.handle_method)
+        self.app.router.add_post("/_inject", self.handle_inject)
+        self.app.router.add_get("/_calls", self.handle_calls)
+
+    @staticmethod
+    async def _params(request: web.Request) -> Dict:
+        params = dict(request.query)
+        if request.can_read_body:
+            if request.content_type == "application/json":
+                params.update(await request.json())
+            else:
+                for key, value in (await request.post()).items():
+                    params[key] = value if isinstance(value, str) else "<file>"
+        return params
+
+    def _message(self, params: Dict) -> Dict:
+        message_id = params.get("message_id") or next(self._message_ids)
+        return {
+            "message_id": int(message_id),
+            "date": int(time.time()),
+            "chat": {"id": int(params.get("chat_id", 0)), "type": "private"},
+            "text": params.get("text", "")
+        }
+
+    async def handle_method(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        params = await self._params(request)
+
+        if method.lower() == "getupdates":
+            return await self._get_updates(params)
+
+        now = time.monotonic()
+        self.calls.append({"method": method, "chat_id": params.get("chat_id"), "at": now})
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+        chat_id = params.get("chat_id")
+        if chat_id is not None and method.lower().startswith(("send", "edit")):
+            last = self._last_chat_call.get(chat_id)
+            if last is not None and now - last < self.chat_interval:
+                self.flood_errors += 1
+                return web.json_response({
+                    "ok": False,
+                    "error_code": 429,
+                    "description": f"Too Many Requests: retry after {self.retry_after}",
+                    "parameters": {"retry_after": self.retry_after}
+                }, status=429)
+            self._last_chat_call[chat_id] = now
+
+        lowered = method.lower()
+        if lowered == "getme":
+            result = {"id": 1, "is_bot": True, "first_name": "Fake", "username": "fake_bot"}
+        elif lowered.startswith("send") or lowered.startswith("edit"):
+            result = self._message(params)
+        else:
+            result = True
+        return web.json_response({"ok": True, "result": result})
+
+    async def _get_updates(self, params: Dict) -> web.Response:
+        timeout = float(params.get("timeout") or 0)
+        updates = []
+        try:
+            updates.append(await asyncio.wait_for(self.updates.get(), timeout) if timeout
+                           else self.updates.get_nowait())
+        except (asyncio.TimeoutError, asyncio.QueueEmpty):
+            pass
+        while not self.updates.empty() and len(updates) < 100:
+            updates.append(self.updates.get_nowait())
+        return web.json_response({"ok": True, "result": updates})
+
+    async def handle_inject(self, request: web.Request) -> web.Response:
+        """Добавление одного обновления или списка обновлений для getUpdates"""
+        payload = await request.json()
+        for update in payload if isinstance(payload, list) else [payload]:
+            update.setdefault("update_id", next(self._update_ids))
+            self.updates.put_nowait(update)
+        return web.json_response({"ok": True, "queued": self.updates.qsize()})
+
+    async def handle_calls(self, request: web.Request) -> web.Response:
+        by_method = defaultdict(int)
+        for call in self.calls:
+            by_method[call["method"]] += 1
+        return web.json_response({
+            "total": len(self.calls),
+            "flood_errors": self.flood_errors,
+            "by_method": by_method
+        }, dumps=lambda obj: json.dumps(obj, ensure_ascii=False))
+
+
+def main():
+    """Запуск: python fake_bot_api.py --port 8081, затем TELEGRAM_API_URL=http://127.0.0.1:8081"""
+    parser = argparse.ArgumentParser(description="Локальный фейковый Bot API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--chat-interval", type=float, default=1.0,
+                        help="минимальный интервал между сообщениями в чат, иначе 429")
+    parser.add_argument("--retry-after", type=int, default=1)
+    parser.add_argument("--latency-ms", type=float, default=0)
+    args = parser.parse_args()
+
+    fake = FakeBotAPI(args.chat_interval, args.retry_after, args.latency_ms)
+    print(f"🧪 Фейковый Bot API: http://{args.host}:{args.port}")
+    web.run_app(fake.app, host=args.host, port=args.port, print=None)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+import atexit
+import copy
+import json
+import logging
+import queue
+import random
+import sys
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from pathlib import Path
+from typing import Optional
+
+# Стандартные поля LogRecord: всё остальное пришло через extra и
+# попадает в JSON как есть (user_id, action, latency_ms, outcome...)
+_RECORD_FIELDS = set(vars(logging.makeLogRecord({}))) | {"message", "asctime", "sampled"}
+
+_listener: Optional[QueueListener] = None
+
+
+class JsonFormatter(logging.Formatter):
+    """Одна запись - одна строка JSON"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "process": record.processName,
+            "msg": record.getMessage()
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_FIELDS:
+                entry[key] = value
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class SamplingFilter(logging.Filter):
+    """Выборка частых событий.
+
+    Записи уровня INFO и ниже с extra={"sampled": True} пропускаются с
+    вероятностью rate, остальные (предупреждения, ошибки, редкие события)
+    проходят всегда.
+    """
+
+    def __init__(self, rate: float = 1.0):
+        super().__init__()
+        self.rate = rate
+        self.dropped = 0
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno > logging.INFO or not getattr(record, "sampled", False):
+            return True
+        if self.rate >= 1 or random.random() < self.rate:
+            return True
+        self.dropped += 1
+        return False
+
+
+class _QueueHandler(QueueHandler):
+    """Постановка записи в очередь без форматирования сообщения целиком.
+
+    Стандартный QueueHandler склеивает сообщение с трассировкой; здесь
+    трассировка сохраняется отдельным полем для JSON.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        record.exc_info = None
+        return record
+
+
+def setup_logging(directory: str = "logs", filename: str = "bot.log", level: str = "INFO",
+                  max_bytes: int = 10 * 1024 * 1024, backup_count: int = 5,
+                  sample_rate: float = 1.0, console_level: str = "WARNING") -> QueueListener:
+    """Настройка журнала: обработчики только кладут записи в очередь.
+
+    Запись в файл с ротацией по размеру и вывод на консоль выполняет
+    фоновый поток, поэтому медленный stdout или диск не задерживают
+    обработку обновлений.
+    """
+    global _listener
+    if _listener is not None:
+        return _listener
+
+    Path(directory).mkdir(parents=True, exist_ok=True)
+    file_handler = RotatingFileHandler(
+        Path(directory) / filename, maxBytes=max_bytes, backupCount=backup_count, encoding="utf-8"
+    )
+    file_handler.setFormatter(JsonFormatter())
+    console_handler = logging.StreamHandler(sys.stderr)
+    console_handler.setLevel(console_level.upper())
+    console_handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+
+    log_queue: "queue.SimpleQueue" = queue.SimpleQueue()
+    queue_handler = _QueueHandler(log_queue)
+    queue_handler.addFilter(SamplingFilter(sample_rate))
+
+    root = logging.getLogger()
+    root.handlers[:] = [queue_handler]
+    root.setLevel(level.upper())
+    # Подробные журналы библиотек не нужны на каждое обновление
+    logging.getLogger("aiogram.event").setLevel(logging.WARNING)
+
+    _listener = QueueListener(log_queue, file_handler, console_handler, respect_handler_level=True)
+    _listener.start()
+    atexit.register(stop_logging)
+    return _listener
+
+
+def stop_logging():
+    """Запись оставшихся сообщений и остановка фонового потока"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
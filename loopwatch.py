@@ -0,0 +1,151 @@
+import asyncio
+import logging
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import metrics
+
+log = logging.getLogger(__name__)
+
+# Файлы проекта: по ним в стеке ищется виновная функция
+_PROJECT_DIR = str(Path(__file__).resolve().parent)
+
+QUANTILES = (0.5, 0.9, 0.99)
+
+
+class LoopWatchdog:
+    """Сторож цикла событий.
+
+    Фоновая задача просыпается каждые interval_ms и измеряет, насколько
+    позже срока она проснулась: это задержка цикла. Отдельный поток
+    следит за последним пробуждением; если цикл не отвечает дольше
+    threshold_ms, поток снимает стек потока цикла. Так видно, какой
+    обработчик и какая строка держат цикл (обычно синхронный запрос к
+    базе или тяжелый расчет прямо в корутине). Когда цикл оживает,
+    остановка записывается в журнал и метрики вместе с длительностью.
+    """
+
+    def __init__(self, threshold_ms: float = 100, interval_ms: float = 50, window: int = 2000):
+        self.threshold = threshold_ms / 1000
+        self.interval = interval_ms / 1000
+        self.lags: deque = deque(maxlen=window)
+        self.stalls: deque = deque(maxlen=20)
+        self._beat = time.monotonic()
+        self._loop_thread_id: Optional[int] = None
+        self._captured: Optional[Dict] = None
+        self._task: Optional[asyncio.Task] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stopped = threading.Event()
+
+        self.lag_seconds = metrics.registry.histogram(
+            "bot_event_loop_lag_seconds", "Задержка пробуждения в цикле событий",
+            buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+        )
+        self.blocked = metrics.registry.counter(
+            "bot_event_loop_blocked_total", "Блокировки цикла событий дольше порога", ["handler"]
+        )
+        metrics.registry.gauge(
+            "bot_event_loop_lag_quantile_seconds", "Квантили задержки цикла за последнее окно",
+            ["quantile"], callback=self.percentiles
+        )
+
+    def start(self):
+        if self._task is not None:
+            return
+        self._loop_thread_id = threading.get_ident()
+        self._beat = time.monotonic()
+        self._stopped.clear()
+        self._task = asyncio.create_task(self._heartbeat())
+        self._thread = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self._thread.start()
+
+    async def _heartbeat(self):
+        while True:
+            started = time.monotonic()
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            self._beat = now
+            lag = max(0.0, now - started - self.interval)
+            self.lags.append(lag)
+            self.lag_seconds.observe(lag)
+            if lag >= self.threshold:
+                self._report(lag)
+
+    def _watch(self):
+        """Поток-наблюдатель: снимок стека, пока цикл еще заблокирован"""
+        check_every = max(self.threshold / 4, 0.005)
+        while not self._stopped.wait(check_every):
+            beat = self._beat
+            if time.monotonic() - beat < self.threshold:
+                continue
+            if self._captured is not None and self._captured["beat"] == beat:
+                continue
+            frame = sys._current_frames().get(self._loop_thread_id)
+            if frame is not None:
+                self._captured = {"beat": beat, **self._describe(frame)}
+
+    @staticmethod
+    def _describe(frame) -> Dict:
+        """Имя обработчика и стек блокирующего вызова"""
+        stack = traceback.extract_stack(frame)
+        handler = None
+        current = frame
+        while current is not None:
+            # Имя обработчика знает middleware метрик, см. metrics.py
+            if current.f_code is metrics.HandlerMetricsMiddleware.__call__.__code__:
+                handler = current.f_locals.get("name")
+                break
+            current = current.f_back
+
+        culprit = None
+        for entry in reversed(stack):
+            if entry.filename.startswith(_PROJECT_DIR) and not entry.filename.endswith("loopwatch.py"):
+                culprit = f"{Path(entry.filename).name}:{entry.lineno} {entry.name}"
+                break
+        return {
+            "handler": handler or "background",
+            "culprit": culprit,
+            "stack": "".join(traceback.format_list(stack[-15:]))
+        }
+
+    def _report(self, lag: float):
+        captured, self._captured = self._captured, None
+        if captured is None:
+            # Поток не успел снять стек (остановка чуть дольше порога)
+            captured = {"handler": "unknown", "culprit": None, "stack": None}
+        stall = {
+            "handler": captured["handler"],
+            "culprit": captured["culprit"],
+            "duration_ms": round(lag * 1000, 1),
+            "at": time.time()
+        }
+        self.stalls.append(stall)
+        self.blocked.inc(handler=stall["handler"])
+        log.warning("Цикл событий заблокирован на %s мс", stall["duration_ms"],
+                    extra={**stall, "stack": captured["stack"]})
+
+    def percentiles(self) -> Dict[str, float]:
+        """Квантили задержки цикла по последним измерениям, в секундах"""
+        lags: List[float] = sorted(self.lags)
+        if not lags:
+            return {}
+        result = {
+            str(q): lags[min(len(lags) - 1, int(q * len(lags)))] for q in QUANTILES
+        }
+        result["1"] = lags[-1]
+        return result
+
+    async def stop(self):
+        self._stopped.set()
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        if self._thread is not None:
+            self._thread.join(timeout=1)
+            self._thread = None
@@ -0,0 +1,161 @@
+import argparse
+import asyncio
+import logging
+import os
+import sqlite3
+import time
+from typing import Dict, Optional
+
+import metrics
+from migrations import apply_pragmas, migrate
+from storage import (
+    ARCHIVED_TABLES, Database, archive_old_rows, attach_archive, checkpoint, incremental_vacuum,
+    run_write_batch
+)
+
+log = logging.getLogger(__name__)
+
+rows_archived = metrics.registry.counter(
+    "bot_maintenance_rows_total", "Строки, перенесенные из рабочих таблиц в архив и сводки", ["table"]
+)
+pages_freed = metrics.registry.counter(
+    "bot_maintenance_pages_freed_total", "Страницы, возвращенные файлу базы incremental_vacuum"
+)
+run_seconds = metrics.registry.histogram(
+    "bot_maintenance_seconds", "Длительность прохода обслуживания базы",
+    buckets=(0.1, 0.5, 1, 5, 10, 30, 60, 300, 900)
+)
+
+
+class MaintenanceJob:
+    """Фоновое обслуживание истории открытий и транзакций.
+
+    Включается явно: при retention_days = 0 (по умолчанию) задание не
+    запускается, строки из рабочих таблиц не удаляются.
+
+    Раз в interval_minutes строки старше retention_days переносятся
+    пачками по batch_size: в файл архива (если задан) и в дневные сводки
+    по пользователю и кейсу или типу транзакции, затем удаляются из
+    рабочих таблиц. Каждая пачка - одна операция общего писателя, между
+    пачками пауза, поэтому запросы пользователей не ждут весь перенос.
+    После переноса свободные страницы по частям возвращаются файлу и
+    выполняется контрольная точка WAL; всё это идет в потоке писателя,
+    а не в цикле событий.
+    """
+
+    def __init__(self, db: Database, interval_minutes: float = 60, retention_days: float = 0,
+                 batch_size: int = 2000, vacuum_pages: int = 1000, batch_pause: float = 0.05):
+        self.db = db
+        self.interval = interval_minutes * 60
+        self.retention_days = retention_days
+        self.batch_size = batch_size
+        self.vacuum_pages = vacuum_pages
+        self.batch_pause = batch_pause
+        self.last_run: Optional[Dict] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._task is None and self.retention_days > 0 and self.interval > 0:
+            self._task = asyncio.create_task(self._loop())
+
+    async def _loop(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.run_once()
+            except Exception:
+                log.exception("Ошибка обслуживания базы")
+
+    async def run_once(self) -> Dict:
+        """Один проход: перенос всех старых строк, vacuum и checkpoint"""
+        started = time.perf_counter()
+        archived = {}
+        for table in ARCHIVED_TABLES:
+            archived[table] = 0
+            while True:
+                moved = await self.db.archive_old_rows(table, self.retention_days, self.batch_size)
+                archived[table] += moved
+                rows_archived.inc(moved, table=table)
+                if moved < self.batch_size:
+                    break
+                await asyncio.sleep(self.batch_pause)
+
+        freed = 0
+        if self.vacuum_pages > 0:
+            freed = await self.db.incremental_vacuum(self.vacuum_pages)
+            pages_freed.inc(freed)
+        checkpoints = await self.db.checkpoint()
+
+        elapsed = time.perf_counter() - started
+        run_seconds.observe(elapsed)
+        self.last_run = {
+            "archived": archived,
+            "pages_freed": freed,
+            "checkpoint": checkpoints,
+            "seconds": round(elapsed, 2),
+            "at": time.time()
+        }
+        log.info("Обслуживание базы выполнено", extra=self.last_run)
+        return self.last_run
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+
+def main():
+    """Обслуживание базы без бота: python maintenance.py --retention-days 90
+
+    Выполняет тот же проход, что и фоновое задание. --vacuum переводит
+    существующую базу в auto_vacuum = INCREMENTAL полным VACUUM; он
+    блокирует базу на всё время работы, запускайте при остановленном боте.
+    """
+    parser = argparse.ArgumentParser(description="Архивация старой истории и обслуживание базы")
+    parser.add_argument("--db", default=os.getenv("DATABASE_URL", "sqlite:///minecraft_cases.db")
+                        .replace("sqlite:///", ""))
+    parser.add_argument("--archive", default=os.getenv("HISTORY_ARCHIVE_PATH", "archive.db"),
+                        help="файл архива, пусто - только сводки и удаление")
+    parser.add_argument("--retention-days", type=float,
+                        default=float(os.getenv("HISTORY_RETENTION_DAYS", 0)),
+                        help="перенос строк старше N дней, 0 - без переноса")
+    parser.add_argument("--batch-size", type=int, default=int(os.getenv("MAINTENANCE_BATCH_SIZE", 2000)))
+    parser.add_argument("--vacuum", action="store_true", help="полный VACUUM с переходом на incremental")
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.db, isolation_level=None)
+    apply_pragmas(conn)
+    migrate(conn)
+    if args.archive:
+        attach_archive(conn, args.archive)
+
+    if args.retention_days > 0:
+        for table in ARCHIVED_TABLES:
+            total = 0
+            while True:
+                [(ok, value)] = run_write_batch(conn, [(
+                    archive_old_rows, (table, args.retention_days, args.batch_size, bool(args.archive))
+                )])
+                if not ok:
+                    raise value
+                total += value
+                if value < args.batch_size:
+                    break
+            print(f"📦 {table}: перенесено строк {total}")
+
+    if args.vacuum:
+        conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        print("🧹 VACUUM...")
+        conn.execute("VACUUM")
+    else:
+        print(f"🧹 Освобождено страниц: {incremental_vacuum(conn, 0)}")
+    if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+        print("⚠️  auto_vacuum не INCREMENTAL: место вернется файлу только после --vacuum")
+    log_pages, done = checkpoint(conn)
+    print(f"✅ Контрольная точка: {done} из {log_pages} страниц WAL")
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+import asyncio
+import logging
+from typing import Optional, Set
+
+from aiogram import Bot
+from aiogram.types import MenuButtonWebApp, WebAppInfo
+
+from storage import Database
+
+log = logging.getLogger(__name__)
+
+MENU_BUTTON_TEXT = "⛏️ Minecraft Кейсы"
+
+
+class MenuButtonManager:
+    """Кнопка меню веб-приложения в чатах.
+
+    Адрес, установленный в каждом чате, хранится в базе, поэтому /start
+    обращается к Bot API, только если кнопки в чате еще нет или она
+    ведет на старый адрес, и делает это в фоне, не задерживая ответ.
+    После смены WEB_APP_URL чаты со старым адресом обновляются фоновой
+    задачей не быстрее refresh_rate чатов в секунду.
+    """
+
+    def __init__(self, bot: Bot, db: Database, url: str, refresh_rate: float = 5):
+        self.bot = bot
+        self.db = db
+        self.url = url
+        self.refresh_interval = 1 / refresh_rate if refresh_rate > 0 else 0
+        self._tasks: Set[asyncio.Task] = set()
+        self._updating: Set[int] = set()
+        self._refresh_task: Optional[asyncio.Task] = None
+
+    async def ensure(self, chat_id: int):
+        """Проверка кнопки при /start, установка - в фоне"""
+        if chat_id in self._updating:
+            return
+        if await self.db.get_menu_button_url(chat_id) == self.url:
+            return
+        self._spawn(self._update(chat_id))
+
+    def _spawn(self, coroutine):
+        task = asyncio.create_task(coroutine)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _update(self, chat_id: int) -> bool:
+        self._updating.add(chat_id)
+        try:
+            await self.bot.set_chat_menu_button(
+                chat_id=chat_id,
+                menu_button=MenuButtonWebApp(text=MENU_BUTTON_TEXT, web_app=WebAppInfo(url=self.url))
+            )
+            await self.db.set_menu_button_url(chat_id, self.url)
+            return True
+        except Exception as e:
+            log.warning("Не удалось установить кнопку меню в чате %s: %s", chat_id, e)
+            return False
+        finally:
+            self._updating.discard(chat_id)
+
+    def start_refresh(self):
+        """Запуск фонового обновления кнопок со старым адресом"""
+        if self._refresh_task is None:
+            self._refresh_task = asyncio.create_task(self._refresh_stale())
+
+    async def _refresh_stale(self):
+        after_chat_id = -2 ** 63
+        updated = 0
+        while True:
+            chat_ids = await self.db.get_stale_menu_button_chats(self.url, after_chat_id)
+            if not chat_ids:
+                break
+            for chat_id in chat_ids:
+                if chat_id not in self._updating and await self._update(chat_id):
+                    updated += 1
+                await asyncio.sleep(self.refresh_interval)
+            after_chat_id = chat_ids[-1]
+        if updated:
+            log.info("Кнопка меню обновлена в %s чатах", updated)
+
+    async def close(self):
+        tasks = list(self._tasks)
+        if self._refresh_task is not None:
+            self._refresh_task.cancel()
+            tasks.append(self._refresh_task)
+            self._refresh_task = None
+        await asyncio.gather(*tasks, return_exceptions=True)
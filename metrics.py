@@ -0,0 +1,291 @@
+import logging
+import threading
+import time
+from bisect import bisect_left
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+# Границы корзин гистограмм задержек, в секундах
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+def _label_text(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict) -> Tuple:
+        return tuple(str(labels.get(name, "")) for name in self.label_names)
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    """Монотонно растущий счетчик"""
+    kind = "counter"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: Dict[Tuple, float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = list(self._values.items())
+        return [f"{self.name}{_label_text(self.label_names, key)} {value}" for key, value in items]
+
+
+class Gauge(_Metric):
+    """Текущее значение, задаваемое напрямую или функцией при чтении"""
+    kind = "gauge"
+
+    def __init__(self, *args, callback: Optional[Callable[[], object]] = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: Dict[Tuple, float] = {}
+        self.callback = callback
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def render(self) -> List[str]:
+        if self.callback is not None:
+            value = self.callback()
+            # Функция может вернуть число или словарь {значение метки: число}
+            if isinstance(value, dict):
+                items = [((label,), number) for label, number in value.items()]
+            else:
+                items = [((), value)]
+        else:
+            with self._lock:
+                items = list(self._values.items())
+        return [f"{self.name}{_label_text(self.label_names, key)} {value}" for key, value in items]
+
+
+class Histogram(_Metric):
+    """Распределение значений по корзинам, обычно задержек"""
+    kind = "histogram"
+
+    def __init__(self, *args, buckets: Sequence[float] = DEFAULT_BUCKETS, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.buckets = tuple(sorted(buckets))
+        # метки -> [счетчики корзин..., +Inf], сумма
+        self._values: Dict[Tuple, list] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            state[0][index] += 1
+            state[1] += value
+
+    def time(self, **labels) -> "_Timer":
+        """Замер длительности блока: with histogram.time(handler="start"): ..."""
+        return _Timer(self, labels)
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = [(key, (list(counts), total)) for key, (counts, total) in self._values.items()]
+
+        lines = []
+        for key, (counts, total) in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = 'le="+Inf"' if bound == float("inf") else f'le="{bound}"'
+                lines.append(f"{self.name}_bucket{_label_text(self.label_names, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_label_text(self.label_names, key)} {total}")
+            lines.append(f"{self.name}_count{_label_text(self.label_names, key)} {cumulative}")
+        return lines
+
+
+class _Timer:
+    __slots__ = ("histogram", "labels", "started")
+
+    def __init__(self, histogram: Histogram, labels: Dict):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.perf_counter() - self.started, **self.labels)
+        return False
+
+
+class Registry:
+    """Набор метрик и их вывод в текстовом формате Prometheus"""
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+
+    def _register(self, metric: _Metric) -> _Metric:
+        # Повторная регистрация (например, второй экземпляр Database)
+        # возвращает уже существующую метрику
+        return self._metrics.setdefault(metric.name, metric)
+
+    def counter(self, name: str, documentation: str, labels: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(name, documentation, labels))
+
+    def gauge(self, name: str, documentation: str, labels: Sequence[str] = (),
+              callback: Optional[Callable[[], object]] = None) -> Gauge:
+        gauge = self._register(Gauge(name, documentation, labels, callback=callback))
+        if callback is not None:
+            gauge.callback = callback
+        return gauge
+
+    def histogram(self, name: str, documentation: str, labels: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, documentation, labels, buckets=buckets))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics.values():
+            try:
+                body = metric.render()
+            except Exception:
+                logging.getLogger(__name__).exception("Ошибка сбора метрики %s", metric.name)
+                continue
+            lines.extend(metric.header())
+            lines.extend(body)
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+log = logging.getLogger("bot.updates")
+
+# Общие метрики бота
+handler_seconds = registry.histogram(
+    "bot_handler_seconds", "Время работы обработчиков aiogram", ["handler"]
+)
+handler_errors = registry.counter(
+    "bot_handler_errors_total", "Исключения в обработчиках aiogram", ["handler"]
+)
+webapp_action_seconds = registry.histogram(
+    "bot_webapp_action_seconds", "Время обработки действий Web App", ["action"]
+)
+webapp_action_errors = registry.counter(
+    "bot_webapp_action_errors_total", "Ответы Web App с ошибкой", ["action"]
+)
+db_query_seconds = registry.histogram(
+    "bot_db_query_seconds", "Время выполнения запросов к базе", ["query", "kind"]
+)
+db_batch_size = registry.histogram(
+    "bot_db_batch_size", "Число операций в одной транзакции писателя",
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256)
+)
+db_commit_seconds = registry.histogram(
+    "bot_db_commit_seconds", "Время фиксации пачки изменений"
+)
+
+# Источники глубины очередей и кэши, опрашиваемые при чтении метрик
+_queues: Dict[str, Callable[[], int]] = {}
+_caches: Dict[str, object] = {}
+
+
+def register_queue(name: str, size: Callable[[], int]):
+    """Учет глубины очереди: size() вызывается при каждом чтении метрик"""
+    _queues[name] = size
+
+
+def register_cache(name: str, cache):
+    """Учет доли попаданий кэша с методом stats() -> hits, misses, size"""
+    _caches[name] = cache
+
+
+def _cache_stat(key: str) -> Dict[str, float]:
+    return {name: cache.stats()[key] for name, cache in _caches.items()}
+
+
+def _cache_hit_ratio() -> Dict[str, float]:
+    ratios = {}
+    for name, cache in _caches.items():
+        stats = cache.stats()
+        lookups = stats["hits"] + stats["misses"]
+        ratios[name] = stats["hits"] / lookups if lookups else 0
+    return ratios
+
+
+registry.gauge(
+    "bot_queue_depth", "Число элементов в очередях", ["queue"],
+    callback=lambda: {name: size() for name, size in _queues.items()}
+)
+registry.gauge("bot_cache_hit_ratio", "Доля попаданий в кэш", ["cache"], callback=_cache_hit_ratio)
+registry.gauge("bot_cache_entries", "Число записей в кэше", ["cache"],
+               callback=lambda: _cache_stat("size"))
+
+
+class HandlerMetricsMiddleware:
+    """Внутренний middleware aiogram: время и ошибки каждого обработчика.
+
+    Кроме метрик пишет в журнал по записи на обновление (с выборкой,
+    см. LOG_SAMPLE_RATE), а исключения - всегда, с трассировкой.
+    """
+
+    async def __call__(self, handler, event, data):
+        handler_object = data.get("handler")
+        name = getattr(getattr(handler_object, "callback", None), "__name__", "unknown")
+        user = getattr(event, "from_user", None)
+        fields = {"handler": name, "user_id": user.id if user else None}
+        started = time.perf_counter()
+        try:
+            result = await handler(event, data)
+        except Exception:
+            elapsed = time.perf_counter() - started
+            handler_seconds.observe(elapsed, handler=name)
+            handler_errors.inc(handler=name)
+            fields["latency_ms"] = round(elapsed * 1000, 2)
+            log.exception("Ошибка в обработчике %s", name, extra={**fields, "outcome": "error"})
+            raise
+        elapsed = time.perf_counter() - started
+        handler_seconds.observe(elapsed, handler=name)
+        log.info("Обновление обработано", extra={
+            **fields, "latency_ms": round(elapsed * 1000, 2), "outcome": "ok", "sampled": True
+        })
+        return result
+
+
+async def start_metrics_server(host: str, port: int):
+    """HTTP-сервер с GET /metrics, возвращает runner для остановки"""
+    from aiohttp import web
+
+    async def handle_metrics(request):
+        return web.Response(
+            text=registry.render(),
+            headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"}
+        )
+
+    app = web.Application()
+    app.router.add_get("/metrics", handle_metrics)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logging.getLogger(__name__).info("Метрики: http://%s:%s/metrics", host, port)
+    return runner
@@ -0,0 +1,397 @@
+import sqlite3
+from typing import Callable, List, Tuple
+
+
+def apply_pragmas(conn: sqlite3.Connection, mmap_size_mb: int = 256, cache_size_mb: int = 64):
+    """Настройка соединения SQLite для работы бота"""
+    # Свободные страницы после архивации старых строк возвращаются файлу
+    # по частям (см. maintenance.py). Действует только для новой базы и
+    # только до включения WAL; существующая перейдет после VACUUM
+    conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+    # WAL позволяет читателям работать параллельно с писателем
+    conn.execute("PRAGMA journal_mode = WAL")
+    # В режиме WAL NORMAL безопасен и не делает fsync на каждый COMMIT
+    conn.execute("PRAGMA synchronous = NORMAL")
+    conn.execute("PRAGMA busy_timeout = 5000")
+    conn.execute("PRAGMA temp_store = MEMORY")
+    conn.execute(f"PRAGMA mmap_size = {int(mmap_size_mb) * 1024 * 1024}")
+    # Отрицательное значение задает размер кэша в килобайтах
+    conn.execute(f"PRAGMA cache_size = -{int(cache_size_mb) * 1024}")
+
+
+def create_initial_schema(cursor: sqlite3.Cursor):
+    """Создание исходных таблиц"""
+    # Таблица пользователей
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS users (
+        user_id INTEGER PRIMARY KEY,
+        username TEXT,
+        first_name TEXT,
+        last_name TEXT,
+        balance INTEGER DEFAULT 10000,
+        experience INTEGER DEFAULT 0,
+        level INTEGER DEFAULT 1,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        last_login TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    ''')
+
+    # Таблица предметов Minecraft
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS items (
+        item_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name TEXT NOT NULL,
+        icon TEXT NOT NULL,
+        rarity TEXT NOT NULL CHECK(rarity IN ('common', 'uncommon', 'rare', 'epic', 'legendary')),
+        category TEXT NOT NULL CHECK(category IN ('food', 'resources', 'weapons', 'tools', 'special')),
+        price INTEGER NOT NULL,
+        sell_price INTEGER NOT NULL,
+        description TEXT,
+        texture_url TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    ''')
+
+    # Таблица инвентаря
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS inventory (
+        inventory_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        item_id INTEGER NOT NULL,
+        quantity INTEGER DEFAULT 1,
+        obtained_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        is_favorite BOOLEAN DEFAULT FALSE,
+        FOREIGN KEY (user_id) REFERENCES users(user_id) ON DELETE CASCADE,
+        FOREIGN KEY (item_id) REFERENCES items(item_id) ON DELETE CASCADE
+    )
+    ''')
+
+    # Таблица кейсов
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS cases (
+        case_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name TEXT NOT NULL,
+        price INTEGER NOT NULL,
+        icon TEXT NOT NULL,
+        description TEXT,
+        rarity_weights TEXT NOT NULL, -- JSON с весами редкостей
+        texture_url TEXT,
+        is_active BOOLEAN DEFAULT TRUE,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    ''')
+
+    # Таблица истории открытий
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS opening_history (
+        history_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        case_id INTEGER NOT NULL,
+        item_id INTEGER NOT NULL,
+        opened_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (user_id) REFERENCES users(user_id),
+        FOREIGN KEY (case_id) REFERENCES cases(case_id),
+        FOREIGN KEY (item_id) REFERENCES items(item_id)
+    )
+    ''')
+
+    # Таблица транзакций
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS transactions (
+        transaction_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        type TEXT NOT NULL CHECK(type IN ('deposit', 'withdraw', 'purchase', 'reward')),
+        amount INTEGER NOT NULL,
+        description TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (user_id) REFERENCES users(user_id)
+    )
+    ''')
+
+
+def create_hot_path_indexes(cursor: sqlite3.Cursor):
+    """Индексы под запросы по user_id и выбор предметов по редкости"""
+    # get_inventory: WHERE user_id = ? ORDER BY is_favorite DESC, obtained_at DESC
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_inventory_user_favorite_obtained "
+        "ON inventory(user_id, is_favorite, obtained_at)"
+    )
+    # get_cases_opened_count и история пользователя
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_opening_history_user_opened "
+        "ON opening_history(user_id, opened_at)"
+    )
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_transactions_user_created "
+        "ON transactions(user_id, created_at)"
+    )
+    # open_case: items WHERE rarity = ?
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_items_rarity ON items(rarity)")
+
+
+def create_catalog_version_triggers(cursor: sqlite3.Cursor):
+    """Счетчик версии каталога для сброса кэша предметов и кейсов"""
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS catalog_meta (
+        id INTEGER PRIMARY KEY CHECK(id = 1),
+        version INTEGER NOT NULL DEFAULT 0
+    )
+    ''')
+    cursor.execute("INSERT OR IGNORE INTO catalog_meta (id, version) VALUES (1, 0)")
+
+    # Любое изменение предметов или кейсов увеличивает версию
+    for table in ("items", "cases"):
+        for event in ("INSERT", "UPDATE", "DELETE"):
+            cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS trg_{table}_{event.lower()}_catalog_version
+            AFTER {event} ON {table}
+            BEGIN
+                UPDATE catalog_meta SET version = version + 1 WHERE id = 1;
+            END
+            ''')
+
+
+def stack_inventory(cursor: sqlite3.Cursor):
+    """Одна строка инвентаря на пару (user_id, item_id) с количеством"""
+    cursor.execute('''
+    CREATE TABLE inventory_stacked (
+        inventory_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        item_id INTEGER NOT NULL,
+        quantity INTEGER NOT NULL DEFAULT 1,
+        obtained_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        is_favorite BOOLEAN DEFAULT FALSE,
+        UNIQUE (user_id, item_id),
+        FOREIGN KEY (user_id) REFERENCES users(user_id) ON DELETE CASCADE,
+        FOREIGN KEY (item_id) REFERENCES items(item_id) ON DELETE CASCADE
+    )
+    ''')
+
+    # Схлопываем существующие дубликаты: количество суммируется,
+    # дата берется по последнему полученному экземпляру
+    cursor.execute('''
+    INSERT INTO inventory_stacked (user_id, item_id, quantity, obtained_at, is_favorite)
+    SELECT user_id, item_id, SUM(COALESCE(quantity, 1)), MAX(obtained_at), MAX(is_favorite)
+    FROM inventory
+    GROUP BY user_id, item_id
+    ''')
+
+    cursor.execute("DROP TABLE inventory")
+    cursor.execute("ALTER TABLE inventory_stacked RENAME TO inventory")
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_inventory_user_favorite_obtained "
+        "ON inventory(user_id, is_favorite, obtained_at)"
+    )
+
+
+def add_sync_revisions(cursor: sqlite3.Cursor):
+    """Ревизии пользователя и стопок инвентаря для дельта-синхронизации"""
+    cursor.execute("ALTER TABLE users ADD COLUMN revision INTEGER NOT NULL DEFAULT 0")
+    cursor.execute("ALTER TABLE inventory ADD COLUMN revision INTEGER NOT NULL DEFAULT 0")
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_inventory_user_revision "
+        "ON inventory(user_id, revision)"
+    )
+
+
+# Пересчет счетчиков пользователя по исходным таблицам. Потраченным
+# считается сумма списаний, заработанным - сумма начислений.
+REBUILD_USER_STATS_SQL = """INSERT OR REPLACE INTO user_stats
+    (user_id, cases_opened, inventory_count, inventory_value, total_spent, total_earned)
+    SELECT u.user_id,
+        (SELECT COUNT(*) FROM opening_history h WHERE h.user_id = u.user_id),
+        (SELECT COALESCE(SUM(inv.quantity), 0) FROM inventory inv
+         WHERE inv.user_id = u.user_id AND inv.quantity > 0),
+        (SELECT COALESCE(SUM(inv.quantity * i.price), 0) FROM inventory inv
+         JOIN items i ON inv.item_id = i.item_id
+         WHERE inv.user_id = u.user_id AND inv.quantity > 0),
+        (SELECT COALESCE(-SUM(t.amount), 0) FROM transactions t
+         WHERE t.user_id = u.user_id AND t.amount < 0),
+        (SELECT COALESCE(SUM(t.amount), 0) FROM transactions t
+         WHERE t.user_id = u.user_id AND t.amount > 0)
+    FROM users u"""
+
+# Пересчет с учетом архивации: сырые строки плюс дневные сводки по
+# строкам, которые обслуживание уже перенесло в архив (см. maintenance.py)
+REBUILD_USER_STATS_WITH_ROLLUPS_SQL = """INSERT OR REPLACE INTO user_stats
+    (user_id, cases_opened, inventory_count, inventory_value, total_spent, total_earned)
+    SELECT u.user_id,
+        (SELECT COUNT(*) FROM opening_history h WHERE h.user_id = u.user_id)
+        + (SELECT COALESCE(SUM(d.opens), 0) FROM opening_daily d WHERE d.user_id = u.user_id),
+        (SELECT COALESCE(SUM(inv.quantity), 0) FROM inventory inv
+         WHERE inv.user_id = u.user_id AND inv.quantity > 0),
+        (SELECT COALESCE(SUM(inv.quantity * i.price), 0) FROM inventory inv
+         JOIN items i ON inv.item_id = i.item_id
+         WHERE inv.user_id = u.user_id AND inv.quantity > 0),
+        (SELECT COALESCE(-SUM(t.amount), 0) FROM transactions t
+         WHERE t.user_id = u.user_id AND t.amount < 0)
+        + (SELECT COALESCE(SUM(d.spent), 0) FROM transaction_daily d WHERE d.user_id = u.user_id),
+        (SELECT COALESCE(SUM(t.amount), 0) FROM transactions t
+         WHERE t.user_id = u.user_id AND t.amount > 0)
+        + (SELECT COALESCE(SUM(d.earned), 0) FROM transaction_daily d WHERE d.user_id = u.user_id)
+    FROM users u"""
+
+
+def create_user_stats(cursor: sqlite3.Cursor):
+    """Счетчики пользователя для меню вместо подсчета по истории"""
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS user_stats (
+        user_id INTEGER PRIMARY KEY,
+        cases_opened INTEGER NOT NULL DEFAULT 0,
+        inventory_count INTEGER NOT NULL DEFAULT 0,
+        inventory_value INTEGER NOT NULL DEFAULT 0,
+        total_spent INTEGER NOT NULL DEFAULT 0,
+        total_earned INTEGER NOT NULL DEFAULT 0,
+        FOREIGN KEY (user_id) REFERENCES users(user_id) ON DELETE CASCADE
+    )
+    ''')
+    cursor.execute(REBUILD_USER_STATS_SQL)
+
+
+def create_inventory_page_indexes(cursor: sqlite3.Cursor):
+    """Индексы для постраничного вывода инвентаря по дате и по цене"""
+    # get_inventory_page, сортировка по дате: ключ (obtained_at, item_id)
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_inventory_user_obtained_item "
+        "ON inventory(user_id, obtained_at, item_id)"
+    )
+    # get_inventory_page, сортировка по цене: обход предметов по цене
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_items_price ON items(price)")
+
+
+def create_balance_guard(cursor: sqlite3.Cursor):
+    """Запрет отрицательного баланса на уровне базы данных"""
+    cursor.execute('''
+    CREATE TRIGGER IF NOT EXISTS trg_users_balance_non_negative
+    BEFORE UPDATE OF balance ON users
+    WHEN NEW.balance < 0
+    BEGIN
+        SELECT RAISE(ABORT, 'negative balance');
+    END
+    ''')
+
+
+def create_processed_requests(cursor: sqlite3.Cursor):
+    """Результаты обработанных запросов Web App для защиты от повторов"""
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS processed_requests (
+        user_id INTEGER NOT NULL,
+        request_id TEXT NOT NULL,
+        action TEXT NOT NULL,
+        response TEXT NOT NULL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (user_id, request_id)
+    ) WITHOUT ROWID
+    ''')
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_processed_requests_created "
+        "ON processed_requests(created_at)"
+    )
+
+
+def create_chat_menu_buttons(cursor: sqlite3.Cursor):
+    """Адрес веб-приложения, последний установленный в кнопку меню чата"""
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS chat_menu_buttons (
+        chat_id INTEGER PRIMARY KEY,
+        url TEXT NOT NULL,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    ''')
+
+
+def create_daily_rollups(cursor: sqlite3.Cursor):
+    """Дневные сводки по открытиям и транзакциям для строк, ушедших в архив"""
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS opening_daily (
+        user_id INTEGER NOT NULL,
+        day TEXT NOT NULL,
+        case_id INTEGER NOT NULL,
+        opens INTEGER NOT NULL,
+        PRIMARY KEY (user_id, day, case_id)
+    ) WITHOUT ROWID
+    ''')
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_opening_daily_case_day ON opening_daily(case_id, day)"
+    )
+    # Расходы и доходы хранятся раздельно, чтобы total_spent и
+    # total_earned пересчитывались точно
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS transaction_daily (
+        user_id INTEGER NOT NULL,
+        day TEXT NOT NULL,
+        type TEXT NOT NULL,
+        count INTEGER NOT NULL,
+        earned INTEGER NOT NULL,
+        spent INTEGER NOT NULL,
+        PRIMARY KEY (user_id, day, type)
+    ) WITHOUT ROWID
+    ''')
+    # Отбор старых строк для обслуживания идет по времени
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_opening_history_opened ON opening_history(opened_at)"
+    )
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_transactions_created ON transactions(created_at)"
+    )
+
+
+# Список миграций: (версия, описание, функция). Новые миграции добавляются
+# только в конец, уже выпущенные не меняются.
+MIGRATIONS: List[Tuple[int, str, Callable[[sqlite3.Cursor], None]]] = [
+    (1, "Исходная схема", create_initial_schema),
+    (2, "Индексы для горячих запросов", create_hot_path_indexes),
+    (3, "Версия каталога предметов и кейсов", create_catalog_version_triggers),
+    (4, "Инвентарь со стопками предметов", stack_inventory),
+    (5, "Ревизии для дельта-синхронизации", add_sync_revisions),
+    (6, "Счетчики пользователей", create_user_stats),
+    (7, "Индексы для страниц инвентаря", create_inventory_page_indexes),
+    (8, "Защита от отрицательного баланса", create_balance_guard),
+    (9, "Идентификаторы обработанных запросов", create_processed_requests),
+    (10, "Кнопки меню чатов", create_chat_menu_buttons),
+    (11, "Дневные сводки истории и транзакций", create_daily_rollups),
+]
+
+
+def get_schema_version(conn: sqlite3.Connection) -> int:
+    """Текущая версия схемы из PRAGMA user_version"""
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(conn: sqlite3.Connection) -> int:
+    """Применение недостающих миграций.
+
+    Каждая миграция выполняется в своей транзакции вместе с обновлением
+    user_version, поэтому прерванное обновление безопасно повторить, а
+    несколько процессов, запущенных одновременно, не применят миграцию
+    дважды.
+    Существующие базы без версии (user_version = 0) обновляются на месте:
+    исходная схема создается через IF NOT EXISTS.
+
+    Соединение должно быть открыто с isolation_level=None.
+    """
+    current = get_schema_version(conn)
+    cursor = conn.cursor()
+
+    for version, description, func in MIGRATIONS:
+        if version <= current:
+            continue
+
+        cursor.execute("BEGIN IMMEDIATE")
+        # Другой процесс мог применить миграцию, пока мы ждали блокировку
+        if get_schema_version(conn) >= version:
+            cursor.execute("COMMIT")
+            current = version
+            continue
+
+        print(f"🔧 Миграция схемы {version}: {description}")
+        try:
+            func(cursor)
+            cursor.execute(f"PRAGMA user_version = {version}")
+            cursor.execute("COMMIT")
+        except BaseException:
+            cursor.execute("ROLLBACK")
+            raise
+        current = version
+
+    return current
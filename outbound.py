@@ -0,0 +1,222 @@
+import asyncio
+import itertools
+import logging
+import time
+from collections import deque
+from typing import Any, Dict, Optional, Tuple
+
+from aiogram import Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.exceptions import TelegramNetworkError, TelegramRetryAfter
+from aiogram.methods import (
+    AnswerCallbackQuery, EditMessageCaption, EditMessageReplyMarkup, EditMessageText,
+    SetChatMenuButton, TelegramMethod
+)
+
+log = logging.getLogger(__name__)
+
+# Приоритеты: меньше - раньше. Ответ на нажатие кнопки Telegram ждет
+# недолго, а кнопка меню может подождать.
+PRIORITY_CALLBACK = 0
+PRIORITY_REPLY = 1
+PRIORITY_BACKGROUND = 2
+
+EDIT_METHODS = (EditMessageText, EditMessageReplyMarkup, EditMessageCaption)
+
+
+class _Request:
+    __slots__ = ("method", "make_request", "bot", "chat_id", "future", "superseded")
+
+    def __init__(self, method, make_request, bot, chat_id):
+        self.method = method
+        self.make_request = make_request
+        self.bot = bot
+        self.chat_id = chat_id
+        self.future: asyncio.Future = asyncio.get_running_loop().create_future()
+        self.superseded: Optional["_Request"] = None
+
+
+class OutboundDispatcher(BaseRequestMiddleware):
+    """Очередь исходящих запросов к Bot API.
+
+    Подключается как middleware сессии бота, поэтому обработчики по-прежнему
+    вызывают message.answer и edit_text, а запросы к чатам проходят через
+    общую очередь с приоритетами:
+
+    - общий темп не выше global_rate запросов в секунду;
+    - в один чат не чаще одного запроса в chat_interval секунд, порядок
+      сообщений в чате сохраняется;
+    - на 429 отправка приостанавливается на retry_after и запрос
+      повторяется;
+    - если правка сообщения еще ждет в очереди, а пришла новая правка того
+      же сообщения, отправляется только последняя, оба вызова получают ее
+      результат.
+
+    Запросы без чата (getUpdates, setWebhook и т.п.) идут напрямую.
+    """
+
+    def __init__(self, global_rate: float = 30, chat_interval: float = 1.0,
+                 workers: int = 8, max_retries: int = 5):
+        self.global_interval = 1 / global_rate if global_rate > 0 else 0
+        self.chat_interval = chat_interval
+        self.workers = workers
+        self.max_retries = max_retries
+
+        self._queue: Optional[asyncio.PriorityQueue] = None
+        self._sequence = itertools.count()
+        self._worker_tasks = []
+        self._chat_backlogs: Dict[Any, deque] = {}
+        self._chat_next: Dict[Any, float] = {}
+        self._global_next = 0.0
+        self._paused_until = 0.0
+        self._pending_edits: Dict[Tuple[Any, Any], _Request] = {}
+        self.stats: Dict[str, int] = {"sent": 0, "retried": 0, "superseded": 0, "failed": 0}
+
+    @staticmethod
+    def _priority(method: TelegramMethod) -> Optional[int]:
+        if isinstance(method, AnswerCallbackQuery):
+            return PRIORITY_CALLBACK
+        if isinstance(method, SetChatMenuButton):
+            return PRIORITY_BACKGROUND
+        if getattr(method, "chat_id", None) is not None:
+            return PRIORITY_REPLY
+        return None
+
+    def _ensure_started(self):
+        if self._queue is None:
+            self._queue = asyncio.PriorityQueue()
+            self._worker_tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def __call__(self, make_request: NextRequestMiddlewareType, bot: Bot, method: TelegramMethod):
+        priority = self._priority(method)
+        if priority is None:
+            return await make_request(bot, method)
+
+        self._ensure_started()
+        chat_id = getattr(method, "chat_id", None)
+        request = _Request(method, make_request, bot, chat_id)
+
+        if isinstance(method, EDIT_METHODS) and method.message_id is not None:
+            key = (chat_id, method.message_id)
+            previous = self._pending_edits.get(key)
+            if previous is not None:
+                previous.superseded = request
+                self.stats["superseded"] += 1
+            self._pending_edits[key] = request
+
+        self._queue.put_nowait((priority, next(self._sequence), request))
+        return await request.future
+
+    async def _worker(self):
+        while True:
+            _, _, request = await self._queue.get()
+            # Запросы без чата (ответы на нажатия) друг друга не ждут
+            lane = request.chat_id if request.chat_id is not None else request
+            backlog = self._chat_backlogs.get(lane)
+            if backlog is not None:
+                # Чат уже обслуживает другой воркер, он отправит и этот
+                # запрос следом, сохранив порядок сообщений в чате
+                backlog.append(request)
+                continue
+
+            backlog = self._chat_backlogs[lane] = deque([request])
+            try:
+                while backlog:
+                    current = backlog.popleft()
+                    try:
+                        await self._process(current)
+                    finally:
+                        self._queue.task_done()
+            finally:
+                del self._chat_backlogs[lane]
+
+    async def _process(self, request: _Request):
+        if request.superseded is not None:
+            self._chain(request)
+            return
+        if isinstance(request.method, EDIT_METHODS):
+            key = (request.chat_id, request.method.message_id)
+            if self._pending_edits.get(key) is request:
+                del self._pending_edits[key]
+        await self._send(request)
+
+    @staticmethod
+    def _chain(request: _Request):
+        """Результат вытесненной правки - результат последней правки"""
+        latest = request.superseded
+        while latest.superseded is not None:
+            latest = latest.superseded
+
+        def copy_result(done: asyncio.Future):
+            if request.future.done():
+                return
+            if done.exception() is not None:
+                request.future.set_exception(done.exception())
+            else:
+                request.future.set_result(done.result())
+
+        latest.future.add_done_callback(copy_result)
+
+    async def _wait_turn(self, chat_id):
+        """Ожидание очереди: пауза после 429, общий темп и темп чата"""
+        while True:
+            now = time.monotonic()
+            ready_at = max(self._paused_until, self._global_next, self._chat_next.get(chat_id, 0.0))
+            if ready_at <= now:
+                break
+            await asyncio.sleep(ready_at - now)
+        self._global_next = now + self.global_interval
+        if chat_id is not None:
+            self._chat_next[chat_id] = now + self.chat_interval
+            if len(self._chat_next) > 10000:
+                self._chat_next = {
+                    chat: next_at for chat, next_at in self._chat_next.items() if next_at > now
+                }
+
+    async def _send(self, request: _Request):
+        """Отправка с повторами после 429 и сетевых ошибок"""
+        error: Optional[Exception] = None
+        for attempt in range(self.max_retries + 1):
+            await self._wait_turn(request.chat_id)
+            try:
+                response = await request.make_request(request.bot, request.method)
+            except TelegramRetryAfter as e:
+                self.stats["retried"] += 1
+                self._paused_until = max(self._paused_until, time.monotonic() + e.retry_after)
+                log.warning("Bot API просит подождать %s с", e.retry_after)
+                error = e
+            except TelegramNetworkError as e:
+                self.stats["retried"] += 1
+                await asyncio.sleep(min(2 ** attempt, 30))
+                error = e
+            except Exception as e:
+                self.stats["failed"] += 1
+                if not request.future.done():
+                    request.future.set_exception(e)
+                return
+            else:
+                self.stats["sent"] += 1
+                if not request.future.done():
+                    request.future.set_result(response)
+                return
+
+        self.stats["failed"] += 1
+        if not request.future.done():
+            request.future.set_exception(error)
+
+    def queued(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+
+    async def close(self, timeout: float = 10):
+        """Отправка оставшихся запросов и остановка воркеров"""
+        if self._queue is None:
+            return
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout)
+        except asyncio.TimeoutError:
+            log.warning("Не отправлено исходящих запросов: %s", self._queue.qsize())
+        for task in self._worker_tasks:
+            task.cancel()
+        await asyncio.gather(*self._worker_tasks, return_exceptions=True)
+        self._worker_tasks = []
+        self._queue = None
@@ -0,0 +1,222 @@
+import asyncio
+import cProfile
+import io
+import json
+import logging
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from datetime import datetime
+from pathlib import Path
+from typing import Awaitable, Callable, List, Optional
+
+log = logging.getLogger(__name__)
+
+MODES = ("sample", "cpu", "memory")
+
+
+class ProfileSession:
+    """Один сеанс профилирования цели: обработчика, действия Web App или всего.
+
+    Цель задается именем функции-обработчика (cmd_start, handle_profile),
+    "webapp:<действие>" (webapp:open_case) или "all". Сеанс завершается
+    по истечении seconds или после requests обработанных запросов цели.
+
+    - sample: отдельный поток раз в sample_interval снимает стек потока
+      цикла, пока выполняется запрос цели; результат - свернутые стеки
+      (collapsed) для flamegraph.pl или speedscope;
+    - cpu: cProfile включается на время запросов цели, результат - pstats;
+    - memory: tracemalloc на всё окно, результат - разница снимков.
+
+    Корутины чередуются, поэтому в sample и cpu попадает и то, что цикл
+    успел выполнить для других обновлений, пока запрос цели ждал ввода-вывода.
+    """
+
+    def __init__(self, target: str, mode: str, seconds: Optional[float], requests: Optional[int],
+                 directory: Path, sample_interval: float = 0.005):
+        self.target = target
+        self.mode = mode
+        self.seconds = seconds
+        self.requests = requests
+        self.directory = directory
+        self.sample_interval = sample_interval
+        self.started_at = time.time()
+        self.completed = 0
+        self.finished = False
+        self._active = 0
+        self._loop_thread_id = threading.get_ident()
+        self._profile: Optional[cProfile.Profile] = None
+        self._stacks: Counter = Counter()
+        self._sampler: Optional[threading.Thread] = None
+        self._stop_sampler = threading.Event()
+        self._snapshot: Optional[tracemalloc.Snapshot] = None
+        self._started_tracemalloc = False
+        self._final_snapshot: Optional[tracemalloc.Snapshot] = None
+        self._diff: list = []
+
+        if mode == "cpu":
+            self._profile = cProfile.Profile()
+        elif mode == "sample":
+            self._sampler = threading.Thread(target=self._sample, name="profiler-sampler", daemon=True)
+            self._sampler.start()
+        elif mode == "memory":
+            if not tracemalloc.is_tracing():
+                tracemalloc.start(25)
+                self._started_tracemalloc = True
+            self._snapshot = tracemalloc.take_snapshot()
+
+    def matches(self, handler_name: str, event) -> bool:
+        if self.target == "all" or self.target == handler_name:
+            return True
+        if self.target.startswith("webapp:"):
+            web_app_data = getattr(event, "web_app_data", None)
+            if web_app_data is None:
+                return False
+            try:
+                action = json.loads(web_app_data.data).get("action")
+            except (ValueError, AttributeError):
+                return False
+            return self.target == f"webapp:{action}"
+        return False
+
+    def enter(self):
+        self._active += 1
+        if self._profile is not None and self._active == 1:
+            self._profile.enable()
+
+    def exit(self) -> bool:
+        """Конец запроса цели; True, если набрано нужное число запросов"""
+        self._active -= 1
+        if self._profile is not None and self._active == 0:
+            self._profile.disable()
+        self.completed += 1
+        return self.requests is not None and self.completed >= self.requests
+
+    def _sample(self):
+        while not self._stop_sampler.wait(self.sample_interval):
+            if not self._active:
+                continue
+            frame = sys._current_frames().get(self._loop_thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{Path(code.co_filename).name}:{code.co_name}")
+                frame = frame.f_back
+            if stack:
+                self._stacks[";".join(reversed(stack))] += 1
+
+    def stop(self):
+        """Остановка сбора в потоке цикла: дальше только запись файлов"""
+        self.finished = True
+        if self._profile is not None and self._active:
+            self._profile.disable()
+        self._stop_sampler.set()
+        if self.mode == "memory":
+            snapshot = tracemalloc.take_snapshot()
+            self._diff = snapshot.compare_to(self._snapshot, "lineno")
+            self._final_snapshot = snapshot
+            if self._started_tracemalloc:
+                tracemalloc.stop()
+
+    def write(self) -> List[Path]:
+        """Запись результатов в каталог журналов (выполняется вне цикла событий)"""
+        if self._sampler is not None:
+            self._sampler.join(timeout=1)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        safe_target = self.target.replace(":", "-").replace("/", "-")
+        base = self.directory / f"profile-{safe_target}-{self.mode}-{datetime.now():%Y%m%d-%H%M%S}"
+        paths = []
+        if self.mode == "cpu":
+            path = base.with_suffix(".pstats")
+            self._profile.dump_stats(path)
+            summary = io.StringIO()
+            pstats.Stats(self._profile, stream=summary).sort_stats("cumulative").print_stats(40)
+            base.with_suffix(".txt").write_text(summary.getvalue(), encoding="utf-8")
+            paths += [path, base.with_suffix(".txt")]
+        elif self.mode == "sample":
+            path = base.with_suffix(".collapsed")
+            path.write_text(
+                "".join(f"{stack} {count}\n" for stack, count in self._stacks.most_common()),
+                encoding="utf-8"
+            )
+            paths.append(path)
+        elif self.mode == "memory":
+            path = base.with_suffix(".tracemalloc")
+            self._final_snapshot.dump(str(path))
+            text = base.with_suffix(".txt")
+            text.write_text("".join(f"{stat}\n" for stat in self._diff[:50]), encoding="utf-8")
+            paths += [path, text]
+        return paths
+
+    def describe(self) -> str:
+        limit = f"{self.requests} запросов" if self.requests else f"{self.seconds:g} с"
+        return (f"{self.target} ({self.mode}, до {limit}): запросов {self.completed}, "
+                f"идет {time.time() - self.started_at:.0f} с")
+
+
+class HandlerProfiler:
+    """Профилирование живого бота по команде администратора.
+
+    Подключается как внутренний middleware роутера. Пока сеанса нет,
+    цена - одна проверка атрибута на обновление.
+    """
+
+    def __init__(self, directory: str = "logs", sample_interval_ms: float = 5):
+        self.directory = Path(directory)
+        self.sample_interval = sample_interval_ms / 1000
+        self.session: Optional[ProfileSession] = None
+        self._on_finish: Optional[Callable[[ProfileSession, List[Path]], Awaitable]] = None
+        self._timer: Optional[asyncio.TimerHandle] = None
+
+    def start(self, target: str, mode: str = "sample", seconds: Optional[float] = 30,
+              requests: Optional[int] = None,
+              on_finish: Optional[Callable[[ProfileSession, List[Path]], Awaitable]] = None) -> ProfileSession:
+        if self.session is not None:
+            raise RuntimeError(f"Уже идет профилирование: {self.session.describe()}")
+        if mode not in MODES:
+            raise ValueError(f"Режим должен быть одним из: {', '.join(MODES)}")
+        self.session = ProfileSession(target, mode, seconds, requests, self.directory, self.sample_interval)
+        self._on_finish = on_finish
+        if seconds:
+            self._timer = asyncio.get_running_loop().call_later(
+                seconds, lambda: asyncio.ensure_future(self.stop())
+            )
+        log.info("Профилирование начато: %s", self.session.describe())
+        return self.session
+
+    async def stop(self) -> List[Path]:
+        session, self.session = self.session, None
+        if session is None:
+            return []
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        session.stop()
+        paths = await asyncio.get_running_loop().run_in_executor(None, session.write)
+        log.info("Профилирование завершено: %s", session.describe(),
+                 extra={"files": [str(path) for path in paths]})
+        on_finish, self._on_finish = self._on_finish, None
+        if on_finish is not None:
+            try:
+                await on_finish(session, paths)
+            except Exception:
+                log.exception("Ошибка уведомления о профилировании")
+        return paths
+
+    async def __call__(self, handler, event, data):
+        session = self.session
+        if session is None:
+            return await handler(event, data)
+        callback = getattr(data.get("handler"), "callback", None)
+        if not session.matches(getattr(callback, "__name__", ""), event):
+            return await handler(event, data)
+
+        session.enter()
+        try:
+            return await handler(event, data)
+        finally:
+            if session.exit() and self.session is session:
+                asyncio.ensure_future(self.stop())
@@ -0,0 +1,151 @@
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Iterable, Optional, Tuple
+
+from aiogram import BaseMiddleware
+from aiogram.types import CallbackQuery, Message, TelegramObject
+
+from cache import TTLCache
+from wire import dumps, split_message
+
+# Классы действий по умолчанию: (токенов в секунду, размер корзины)
+DEFAULT_LIMITS: Dict[str, Tuple[float, float]] = {
+    "command": (1.0, 5),
+    "callback": (2.0, 8),
+    "webapp": (3.0, 10),
+    "message": (0.5, 3),
+}
+
+
+def parse_limits(value: str) -> Dict[str, Tuple[float, float]]:
+    """Разбор лимитов вида "command=1:5,callback=2:8" поверх значений по умолчанию"""
+    limits = dict(DEFAULT_LIMITS)
+    for part in filter(None, (chunk.strip() for chunk in value.split(","))):
+        name, _, spec = part.partition("=")
+        rate, _, burst = spec.partition(":")
+        limits[name.strip()] = (float(rate), float(burst or rate))
+    return limits
+
+
+class RateLimiter:
+    """Корзины токенов по паре (пользователь, класс действия).
+
+    Корзина, простоявшая без обращений столько, что успела бы заполниться
+    целиком, ничем не отличается от новой, поэтому такие корзины
+    удаляются: память зависит от числа активных пользователей, а не от
+    всех, кто когда-либо писал боту.
+    """
+
+    def __init__(self, limits: Dict[str, Tuple[float, float]], max_buckets: int = 100000,
+                 sweep_interval: float = 60):
+        self.limits = limits
+        self.max_buckets = max_buckets
+        self.sweep_interval = sweep_interval
+        # (user_id, класс) -> [токены, время последнего обновления]
+        self._buckets: "OrderedDict[Tuple[int, str], list]" = OrderedDict()
+        self._next_sweep = 0.0
+        self.limited = 0
+
+    def allow(self, user_id: int, action_class: str, now: Optional[float] = None) -> bool:
+        """Списание токена, False - если корзина пуста"""
+        limit = self.limits.get(action_class)
+        if limit is None:
+            return True
+        rate, burst = limit
+        now = time.monotonic() if now is None else now
+
+        if now >= self._next_sweep:
+            self.sweep(now)
+
+        key = (user_id, action_class)
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = [burst, now]
+            self._buckets[key] = bucket
+            if len(self._buckets) > self.max_buckets:
+                self._buckets.popitem(last=False)
+        else:
+            bucket[0] = min(burst, bucket[0] + (now - bucket[1]) * rate)
+            bucket[1] = now
+            self._buckets.move_to_end(key)
+
+        if bucket[0] < 1:
+            self.limited += 1
+            return False
+        bucket[0] -= 1
+        return True
+
+    def sweep(self, now: Optional[float] = None) -> int:
+        """Удаление корзин, которые успели заполниться заново"""
+        now = time.monotonic() if now is None else now
+        self._next_sweep = now + self.sweep_interval
+        removed = 0
+        # Корзины упорядочены по времени последнего обращения
+        while self._buckets:
+            (user_id, action_class), (tokens, updated) = next(iter(self._buckets.items()))
+            rate, burst = self.limits[action_class]
+            if tokens + (now - updated) * rate < burst:
+                break
+            self._buckets.popitem(last=False)
+            removed += 1
+        return removed
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+
+def action_class(event: TelegramObject) -> str:
+    """Класс действия для выбора лимита"""
+    if isinstance(event, CallbackQuery):
+        return "callback"
+    if isinstance(event, Message):
+        if event.web_app_data is not None:
+            return "webapp"
+        if event.text and event.text.startswith("/"):
+            return "command"
+    return "message"
+
+
+class RateLimitMiddleware(BaseMiddleware):
+    """Ограничение частоты сообщений и нажатий до вызова обработчиков.
+
+    Повторное нажатие той же кнопки из coalesce_callbacks в течение
+    coalesce_window секунд только гасит индикатор загрузки и не доходит
+    до обработчика.
+    """
+
+    def __init__(self, limiter: RateLimiter, coalesce_callbacks: Iterable[str] = (),
+                 coalesce_window: float = 1.0, exempt_user_ids: Iterable[int] = ()):
+        self.limiter = limiter
+        self.coalesce_callbacks = frozenset(coalesce_callbacks)
+        self.exempt_user_ids = frozenset(user_id for user_id in exempt_user_ids if user_id)
+        self._recent_presses = TTLCache(max_entries=limiter.max_buckets, ttl_seconds=coalesce_window)
+        self.coalesced = 0
+
+    async def __call__(self, handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+                       event: TelegramObject, data: Dict[str, Any]) -> Any:
+        user = getattr(event, "from_user", None)
+        if user is None or user.id in self.exempt_user_ids:
+            return await handler(event, data)
+
+        if isinstance(event, CallbackQuery) and event.data in self.coalesce_callbacks:
+            key = (user.id, event.data)
+            if self._recent_presses.get(key) is not None:
+                self.coalesced += 1
+                await event.answer()
+                return None
+            self._recent_presses.set(key, True)
+
+        kind = action_class(event)
+        if self.limiter.allow(user.id, kind):
+            return await handler(event, data)
+
+        if isinstance(event, CallbackQuery):
+            await event.answer("⏳ Слишком часто, подождите немного")
+        elif kind == "webapp":
+            # Веб-приложение ждет ответ, иначе оно уйдет в демо-режим по таймауту;
+            # в статистику размеров ответов отказ не попадает
+            response = {"success": False, "error": "Слишком много запросов, подождите немного"}
+            for text in split_message(dumps(response)):
+                await event.answer(text, parse_mode=None)
+        return None
@@ -0,0 +1,297 @@
+import argparse
+import asyncio
+import gzip
+import heapq
+import json
+import logging
+import os
+import queue
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+import uuid
+from collections import defaultdict
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional
+
+from sharding import update_user_id
+
+log = logging.getLogger(__name__)
+
+
+def _open(path: Path, mode: str):
+    if path.suffix == ".gz":
+        return gzip.open(path, mode + "t", encoding="utf-8")
+    return open(path, mode, encoding="utf-8")
+
+
+class UpdateRecorder:
+    """Запись входящих обновлений в файл для последующего воспроизведения.
+
+    Подключается как outer-middleware dp.update. В цикле событий только
+    кладет объект Update в очередь; сериализацию и запись ведет фоновый
+    поток. Формат - строки JSON {"t": время, "u": обновление}, файлы .gz
+    сжимаются (дописывание создает новый член gzip, это допустимо).
+    Запись включается и выключается на ходу, при достижении max_bytes
+    останавливается сама.
+    """
+
+    def __init__(self, path: str, enabled: bool = False, max_bytes: int = 512 * 1024 * 1024):
+        self.path = Path(path)
+        self.enabled = enabled
+        self.max_bytes = max_bytes
+        self.recorded = 0
+        self._queue: "queue.SimpleQueue" = queue.SimpleQueue()
+        self._thread: Optional[threading.Thread] = None
+
+    async def __call__(self, handler, event, data):
+        if self.enabled:
+            self._queue.put((time.time(), event))
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._writer, name="update-recorder", daemon=True)
+                self._thread.start()
+        return await handler(event, data)
+
+    def toggle(self, enabled: Optional[bool] = None) -> bool:
+        self.enabled = not self.enabled if enabled is None else enabled
+        return self.enabled
+
+    def _writer(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            # Остальное из очереди пишется той же пачкой
+            batch = [item]
+            while True:
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    self._write(batch)
+                    return
+                batch.append(item)
+            self._write(batch)
+
+    def _write(self, batch):
+        try:
+            with _open(self.path, "a") as file:
+                for received_at, update in batch:
+                    payload = update.model_dump(mode="json", exclude_none=True, by_alias=True)
+                    file.write(json.dumps({"t": round(received_at, 3), "u": payload},
+                                          ensure_ascii=False, separators=(",", ":")) + "\n")
+            self.recorded += len(batch)
+            if self.path.stat().st_size >= self.max_bytes:
+                self.enabled = False
+                log.warning("Запись обновлений остановлена: файл %s достиг предела", self.path)
+        except Exception:
+            log.exception("Ошибка записи обновлений в %s", self.path)
+
+    def close(self):
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join(timeout=10)
+            self._thread = None
+
+
+def read_recordings(paths: List[str]) -> Iterator[Dict]:
+    """Записи из нескольких файлов (например, от воркеров) в порядке времени"""
+    def read(path: str):
+        with _open(Path(path), "r") as file:
+            for line in file:
+                if line.strip():
+                    yield json.loads(line)
+
+    return heapq.merge(*(read(path) for path in paths), key=lambda record: record["t"])
+
+
+def update_kind(update: Dict) -> str:
+    """Тип обновления для отчета: действие Web App, команда или кнопка"""
+    message = update.get("message") or {}
+    if "web_app_data" in message:
+        try:
+            action = json.loads(message["web_app_data"]["data"]).get("action")
+        except (ValueError, AttributeError):
+            action = None
+        return f"webapp:{action or 'unknown'}"
+    text = message.get("text") or ""
+    if text.startswith("/"):
+        return "command:" + text.split()[0].split("@")[0][1:]
+    callback = update.get("callback_query")
+    if callback:
+        # Страницы инвентаря отличаются только параметрами
+        return "callback:" + (callback.get("data") or "").split(":")[0]
+    return "other"
+
+
+def fresh_request_id(update: Dict, salt: str) -> Dict:
+    """Новые идентификаторы запросов Web App, чтобы изменения выполнялись заново,
+    а не отвечались из таблицы обработанных запросов копии базы"""
+    web_app_data = (update.get("message") or {}).get("web_app_data")
+    if not web_app_data:
+        return update
+    try:
+        payload = json.loads(web_app_data["data"])
+    except ValueError:
+        return update
+    if not isinstance(payload, dict) or not payload.get("request_id"):
+        return update
+    payload["request_id"] = f"{str(payload['request_id'])[:40]}-{salt}"
+    web_app_data["data"] = json.dumps(payload, ensure_ascii=False)
+    return update
+
+
+def copy_database(source: str, target: str):
+    """Согласованная копия базы через backup API, даже при работающем боте"""
+    src = sqlite3.connect(source)
+    dst = sqlite3.connect(target)
+    try:
+        src.backup(dst)
+    finally:
+        dst.close()
+        src.close()
+
+
+async def replay(records: Iterator[Dict], feed, speed: float, max_in_flight: int) -> Dict:
+    """Воспроизведение с сохранением порядка обновлений каждого пользователя.
+
+    speed=1 - в реальном времени, 10 - в десять раз быстрее, 0 - без пауз.
+    """
+    latencies: Dict[str, List[float]] = defaultdict(list)
+    errors: Dict[str, int] = defaultdict(int)
+    tails: Dict[int, asyncio.Task] = {}
+    in_flight = asyncio.Semaphore(max_in_flight)
+    max_behind = 0.0
+
+    def forget(user_id: int, task: asyncio.Task):
+        if tails.get(user_id) is task:
+            del tails[user_id]
+
+    async def process(update: Dict, previous: Optional[asyncio.Task]):
+        kind = update_kind(update)
+        try:
+            if previous is not None:
+                await asyncio.gather(previous, return_exceptions=True)
+            started = time.perf_counter()
+            try:
+                await feed(update)
+            except Exception:
+                errors[kind] += 1
+            latencies[kind].append(time.perf_counter() - started)
+        finally:
+            in_flight.release()
+
+    started = time.perf_counter()
+    first_t = None
+    for record in records:
+        if first_t is None:
+            first_t = record["t"]
+        if speed > 0:
+            due = started + (record["t"] - first_t) / speed
+            delay = due - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            else:
+                max_behind = max(max_behind, -delay)
+        await in_flight.acquire()
+        update = record["u"]
+        user_id = update_user_id(update)
+        task = asyncio.create_task(process(update, tails.get(user_id)))
+        tails[user_id] = task
+        task.add_done_callback(lambda done, user_id=user_id: forget(user_id, done))
+
+    while tails:
+        await asyncio.gather(*list(tails.values()), return_exceptions=True)
+
+    from bench import summarize
+    elapsed = time.perf_counter() - started
+    report = {kind: summarize(values, errors[kind], elapsed) for kind, values in sorted(latencies.items())}
+    report["_total"] = summarize([v for values in latencies.values() for v in values], sum(errors.values()), elapsed)
+    report["_total"]["max_behind_schedule_ms"] = round(max_behind * 1000, 1)
+    return report
+
+
+async def run(args) -> Dict:
+    from bench import configure_bot_environment, start_fake_api
+
+    workdir = tempfile.mkdtemp(prefix="replay-")
+    db_path = os.path.join(workdir, "replay.db")
+    copy_database(args.db, db_path)
+    print(f"🗄️ Копия базы: {db_path}")
+
+    fake, fake_runner, api_url = await start_fake_api()
+    configure_bot_environment(db_path, api_url)
+    from bot import bot, db, dp, outbound
+
+    await db.connect()
+    salt = uuid.uuid4().hex[:8]
+
+    async def feed(update: Dict):
+        if not args.keep_request_ids:
+            update = fresh_request_id(update, salt)
+        await dp.feed_raw_update(bot, update)
+
+    try:
+        report = await replay(read_recordings(args.recordings), feed, args.speed, args.max_in_flight)
+    finally:
+        await outbound.close()
+        await db.close()
+        await bot.session.close()
+        await fake_runner.cleanup()
+        if not args.keep_db:
+            shutil.rmtree(workdir, ignore_errors=True)
+    report["_total"]["bot_api_calls"] = len(fake.calls)
+    return report
+
+
+def main():
+    """Воспроизведение записанных обновлений: python replay.py logs/updates.jsonl.gz --speed 10
+
+    Обновления прогоняются через настоящий диспетчер против копии базы и
+    фейкового Bot API. Отчет - задержки по типам обновлений (действия
+    Web App, команды, кнопки); --baseline сравнивает его с прошлым
+    прогоном так же, как bench.py.
+    """
+    parser = argparse.ArgumentParser(description="Воспроизведение записанных обновлений")
+    parser.add_argument("recordings", nargs="+", help="файлы записи, .jsonl или .jsonl.gz")
+    parser.add_argument("--db", default=os.getenv("DATABASE_URL", "sqlite:///minecraft_cases.db")
+                        .replace("sqlite:///", ""), help="исходная база, копируется во временный файл")
+    parser.add_argument("--speed", type=float, default=1, help="1 - реальное время, 10 - быстрее, 0 - без пауз")
+    parser.add_argument("--max-in-flight", type=int, default=256)
+    parser.add_argument("--keep-request-ids", action="store_true",
+                        help="не менять request_id (повторы ответятся из копии базы)")
+    parser.add_argument("--keep-db", action="store_true")
+    parser.add_argument("--output", help="файл для отчета в JSON")
+    parser.add_argument("--baseline", help="отчет прошлого прогона для сравнения")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args()
+
+    report = asyncio.run(run(args))
+    for kind, stats in report.items():
+        print(f"  {kind:<24} {stats['requests']:>7}  p50 {stats['p50_ms']:>7} мс  "
+              f"p95 {stats['p95_ms']:>7} мс  p99 {stats['p99_ms']:>7} мс  ошибок {stats['errors']}")
+    total = report["_total"]
+    print(f"📡 Вызовов Bot API: {total['bot_api_calls']}, "
+          f"макс. отставание от расписания: {total['max_behind_schedule_ms']} мс")
+
+    if args.output:
+        Path(args.output).write_text(json.dumps(report, indent=2, ensure_ascii=False) + "\n")
+    if args.baseline:
+        from bench import compare
+        baseline = json.loads(Path(args.baseline).read_text())
+        # Пропускная способность при воспроизведении по расписанию задана записью
+        regressions = [line for line in compare(report, baseline, args.tolerance) if "throughput" not in line]
+        if regressions:
+            print("❌ Регрессия:")
+            for line in regressions:
+                print(f"  {line}")
+            raise SystemExit(1)
+        print("✅ Регрессий нет")
+
+
+if __name__ == "__main__":
+    main()
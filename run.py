@@ -64,8 +64,41 @@ def create_directories():
     
     print("✅ Директории созданы")
 
+def parse_workers() -> int:
+    """Число процессов из аргумента --workers N или BOT_WORKERS"""
+    if "--workers" in sys.argv:
+        index = sys.argv.index("--workers")
+        try:
+            return max(1, int(sys.argv[index + 1]))
+        except (IndexError, ValueError):
+            print("❌ Укажите число процессов: python run.py --workers 4")
+            sys.exit(1)
+    return max(1, int(os.getenv("BOT_WORKERS", 1)))
+
+def run_sharded(workers: int):
+    """Запуск нескольких процессов бота под управлением супервизора"""
+    print(f"🚀 Запуск Minecraft Case Bot в {workers} процессах...")
+    
+    try:
+        from config import config
+        from sharding import ShardSupervisor
+        import asyncio
+        
+        supervisor = ShardSupervisor(workers, queue_size=config.WORKER_QUEUE_SIZE)
+        asyncio.run(supervisor.run(config))
+    except KeyboardInterrupt:
+        print("\n🛑 Бот остановлен пользователем")
+    except Exception as e:
+        print(f"❌ Ошибка при запуске бота: {e}")
+        sys.exit(1)
+
 def run_bot():
     """Запуск бота"""
+    workers = parse_workers()
+    if workers > 1:
+        run_sharded(workers)
+        return
+    
     print("🚀 Запуск Minecraft Case Bot...")
     
     try:
@@ -20,6 +20,24 @@ let userData = {
 
 let casesData = [];
 let inventoryData = [];
+
+// Состояние дельта-синхронизации с ботом
+let syncRevision = null;
+let catalogVersion = null;
+// Каталог предметов и кейсов для компактных ответов бота
+let compactCatalog = null;
+// Части ответов, разбитых ботом на несколько сообщений
+const pendingChunks = {};
+// Идентификаторы запросов, на которые еще не пришел ответ: повтор того же
+// действия (двойное нажатие, повтор после таймаута) отправляется с тем же
+// id, и бот вернет сохраненный результат вместо повторного списания
+const pendingRequestIds = {};
+// Действия, которые меняют баланс или инвентарь
+const IDEMPOTENT_ACTIONS = ['open_case', 'open_cases', 'sell_item'];
+// Сколько кейсов открывает кнопка "Открыть ×N" (действие open_cases)
+const BATCH_OPEN_COUNT = 10;
+// Редкости от худшей к лучшей: лучший предмет пачки показывается крупно
+const RARITY_ORDER = ['common', 'uncommon', 'rare', 'epic', 'legendary'];
 let currentCase = null;
 let currentItem = null;
 let isOpening = false;
@@ -62,6 +80,7 @@ const elements = {
     closeInventory: document.getElementById('close-inventory'),
     closeResult: document.getElementById('close-result'),
     openCaseBtn: document.getElementById('open-case-btn'),
+    openManyBtn: document.getElementById('open-many-btn'),
     
     // Текстовые элементы
     caseName: document.getElementById('case-name'),
@@ -72,6 +91,7 @@ const elements = {
     resultItemRarity: document.getElementById('result-item-rarity'),
     resultItemPrice: document.getElementById('result-item-price'),
     resultItemIcon: document.getElementById('result-icon'),
+    resultItems: document.getElementById('result-items'),
     newBalance: document.getElementById('new-balance'),
 };
 
@@ -276,6 +296,9 @@ function loadFromLocalStorage() {
             userData.experience = parsed.experience || 0;
             userData.level = parsed.level || 1;
             inventoryData = parsed.inventory || [];
+            casesData = parsed.cases || [];
+            syncRevision = parsed.revision ?? null;
+            catalogVersion = parsed.catalogVersion ?? null;
             console.log('Данные загружены из localStorage');
         } catch (e) {
             console.error('Ошибка загрузки из localStorage:', e);
@@ -289,11 +312,131 @@ function saveToLocalStorage() {
         balance: userData.balance,
         experience: userData.experience,
         level: userData.level,
-        inventory: inventoryData
+        inventory: inventoryData,
+        cases: casesData,
+        revision: syncRevision,
+        catalogVersion: catalogVersion
     };
     localStorage.setItem('minecraftCaseData', JSON.stringify(data));
 }
 
+// Применение ответа бота: полный снимок или изменения с прошлой ревизии
+function applySyncResponse(response) {
+    if (response.user) {
+        userData.balance = response.user.balance ?? userData.balance;
+        userData.experience = response.user.experience ?? userData.experience;
+        userData.level = response.user.level ?? userData.level;
+    }
+    
+    if (response.full === false) {
+        const changed = response.inventory_changed || [];
+        const changedIds = new Set(changed.map(item => item.id));
+        const removedIds = new Set(response.inventory_removed || []);
+        inventoryData = changed.concat(
+            inventoryData.filter(item => !changedIds.has(item.id) && !removedIds.has(item.id))
+        );
+    } else if (response.inventory) {
+        inventoryData = response.inventory;
+    }
+    
+    if (response.cases) {
+        casesData = response.cases;
+    }
+    if (response.revision !== undefined) {
+        syncRevision = response.revision;
+    }
+    if (response.catalog_version !== undefined) {
+        catalogVersion = response.catalog_version;
+    }
+}
+
+// Загрузка каталога, сохраненного для компактного формата
+function loadCompactCatalog() {
+    if (compactCatalog) {
+        return compactCatalog;
+    }
+    try {
+        compactCatalog = JSON.parse(localStorage.getItem('minecraftCaseCatalog'));
+    } catch (e) {
+        compactCatalog = null;
+    }
+    return compactCatalog;
+}
+
+// Развертывание компактного ответа бота в обычный формат
+function expandCompactResponse(packed) {
+    if (packed.cat) {
+        compactCatalog = packed.cat;
+        localStorage.setItem('minecraftCaseCatalog', JSON.stringify(packed.cat));
+    }
+    const catalog = loadCompactCatalog();
+    const items = {};
+    (catalog ? catalog.i : []).forEach(row => {
+        const [id, name, icon, rarity, category, price, sell_price, description, texture_url] = row;
+        items[id] = { id, name, icon, rarity, category, price, sell_price, description, texture_url };
+    });
+    const unpackStack = ([id, quantity, obtained_at, is_favorite]) => ({
+        ...items[id],
+        id, quantity, obtained_at,
+        is_favorite: Boolean(is_favorite)
+    });
+    
+    const response = {
+        success: packed.ok,
+        error: packed.e,
+        new_balance: packed.nb,
+        experience_gained: packed.xg,
+        case_price: packed.cp,
+        total_price: packed.tp,
+        count: packed.n,
+        sell_price: packed.sp,
+        inventory_id: packed.iid,
+        experience: packed.x,
+        level: packed.l,
+        revision: packed.r,
+        full: packed.f,
+        config: packed.cfg,
+        catalog_version: packed.cv
+    };
+    if (packed.u) {
+        const [balance, experience, level] = packed.u;
+        response.user = { balance, experience, level };
+    }
+    if (packed.inv) response.inventory = packed.inv.map(unpackStack);
+    if (packed.ic) response.inventory_changed = packed.ic.map(unpackStack);
+    if (packed.ir) response.inventory_removed = packed.ir;
+    if (packed.it !== undefined) response.item = items[packed.it];
+    if (packed.its) response.items = packed.its.map(id => items[id]);
+    if (packed.cat) {
+        response.cases = packed.cat.c.map(row => {
+            const [id, name, price, icon, description, rarity_weights, texture_url] = row;
+            return { id, name, price, icon, description, rarity_weights, texture_url };
+        });
+    }
+    Object.keys(response).forEach(key => response[key] === undefined && delete response[key]);
+    return response;
+}
+
+// Склейка частей ответа вида "~id:номер/всего:фрагмент".
+// Возвращает полный текст или null, если пришли еще не все части.
+function collectResponseChunk(text) {
+    if (!text.startsWith('~')) {
+        return text;
+    }
+    const match = /^~([0-9a-f]+):(\d+)\/(\d+):/.exec(text);
+    if (!match) {
+        return text;
+    }
+    const [header, id, index, total] = match;
+    const parts = pendingChunks[id] || (pendingChunks[id] = []);
+    parts[Number(index) - 1] = text.slice(header.length);
+    if (parts.filter(part => part !== undefined).length < Number(total)) {
+        return null;
+    }
+    delete pendingChunks[id];
+    return parts.join('');
+}
+
 // Синхронизация с сервером через Telegram Web App
 async function syncWithServer() {
     console.log('Синхронизация с сервером...');
@@ -304,12 +447,7 @@ async function syncWithServer() {
         
         if (response && response.success) {
             // Используем данные с сервера
-            userData.balance = response.user.balance || 0;
-            userData.experience = response.user.experience || 0;
-            userData.level = response.user.level || 1;
-            
-            inventoryData = response.inventory || [];
-            casesData = response.cases || [];
+            applySyncResponse(response);
             
             // Сохраняем в localStorage
             saveToLocalStorage();
@@ -402,6 +540,23 @@ function loadDemoData() {
     console.log('Демо-данные загружены');
 }
 
+// Новый идентификатор запроса
+function generateRequestId() {
+    if (window.crypto && crypto.randomUUID) {
+        return crypto.randomUUID();
+    }
+    return Date.now().toString(36) + Math.random().toString(36).slice(2, 10);
+}
+
+// Идентификатор запроса для действия: тот же, пока прошлый запрос без ответа
+function getRequestId(action, data) {
+    const intentKey = action + ':' + JSON.stringify(data);
+    if (!pendingRequestIds[intentKey]) {
+        pendingRequestIds[intentKey] = generateRequestId();
+    }
+    return { intentKey, requestId: pendingRequestIds[intentKey] };
+}
+
 // Отправка данных боту через Web App - УПРОЩЕННАЯ ВЕРСИЯ
 async function sendDataToBot(action, data) {
     return new Promise((resolve) => {
@@ -413,10 +568,17 @@ async function sendDataToBot(action, data) {
         
         console.log(`Отправка данных боту: ${action}`, data);
         
+        const request = IDEMPOTENT_ACTIONS.includes(action) ? getRequestId(action, data) : null;
+        
         // Подготавливаем данные для отправки
         const requestData = JSON.stringify({
             action: action,
             ...data,
+            request_id: request ? request.requestId : undefined,
+            revision: syncRevision,
+            catalog_version: catalogVersion,
+            compact: true,
+            catalog_hash: loadCompactCatalog()?.h ?? null,
             timestamp: Date.now()
         });
         
@@ -434,10 +596,22 @@ async function sendDataToBot(action, data) {
                     console.log('Получено сообщение от бота:', message);
                     
                     if (message.text) {
+                        const text = collectResponseChunk(message.text);
+                        if (text === null) {
+                            return;
+                        }
                         try {
-                            const parsedData = JSON.parse(message.text);
+                            let parsedData = JSON.parse(text);
+                            if (parsedData.ok !== undefined) {
+                                parsedData = expandCompactResponse(parsedData);
+                            }
                             console.log('Парсинг ответа от бота:', parsedData);
                             
+                            // Ответ получен, следующее такое же действие будет новым запросом
+                            if (request) {
+                                delete pendingRequestIds[request.intentKey];
+                            }
+                            
                             // Удаляем обработчик после получения ответа
                             if (window._botResponseHandler) {
                                 window.removeEventListener('message', window._botResponseHandler);
@@ -546,6 +720,40 @@ function handleDemoMode(action, data) {
                 }
             };
             
+        case 'open_cases': {
+            const batchCase = casesData.find(c => c.id === data.case_id);
+            if (!batchCase) {
+                return { success: false, error: 'Кейс не найден' };
+            }
+            const totalPrice = batchCase.price * data.count;
+            if (userData.balance < totalPrice) {
+                return { success: false, error: 'Недостаточно средств' };
+            }
+            
+            const wonItems = [];
+            for (let i = 0; i < data.count; i++) {
+                wonItems.push(generateWonItem(batchCase));
+            }
+            userData.balance -= totalPrice;
+            wonItems.forEach((item, index) => {
+                inventoryData.unshift({
+                    ...item,
+                    id: Date.now() + index,
+                    obtained_at: new Date().toISOString()
+                });
+            });
+            saveToLocalStorage();
+            
+            return {
+                success: true,
+                items: wonItems,
+                count: data.count,
+                new_balance: userData.balance,
+                total_price: totalPrice,
+                inventory: inventoryData
+            };
+        }
+            
         case 'sell_item':
             const itemId = data.item_id;
             const itemIndex = inventoryData.findIndex(item => item.id === itemId);
@@ -738,7 +946,7 @@ function renderInventory() {
         
         itemElement.innerHTML = `
             ${getItemImageHTML(item)}
-            <h4>${item.name}</h4>
+            <h4>${item.name}${item.quantity > 1 ? ` ×${item.quantity}` : ''}</h4>
             <span class="item-rarity ${item.rarity}">${getRarityText(item.rarity)}</span>
             <p style="font-size: 0.8rem; color: var(--accent-diamond); margin-top: 5px;">
                 💎 ${item.price}
@@ -775,6 +983,8 @@ function openCaseModal(caseItem) {
         elements.openCaseBtn.innerHTML = `⛏️ Открыть за ${caseItem.price} 💎`;
     }
     
+    updateOpenManyButton(caseItem);
+    
     // Создаем предпросмотр предметов
     createCaseItemsPreview(caseItem);
     
@@ -784,6 +994,14 @@ function openCaseModal(caseItem) {
     showModal(elements.caseModal);
 }
 
+// Кнопка открытия пачки кейсов: цена за все BATCH_OPEN_COUNT штук
+function updateOpenManyButton(caseItem) {
+    if (!elements.openManyBtn) return;
+    const total = caseItem.price * BATCH_OPEN_COUNT;
+    elements.openManyBtn.disabled = userData.balance < total;
+    elements.openManyBtn.innerHTML = `⛏️ Открыть ×${BATCH_OPEN_COUNT} за ${total} 💎`;
+}
+
 // Создание превью предметов в модальном окне
 function createCaseItemsPreview(caseItem) {
     const previewContainer = document.querySelector('.case-items-preview-modal');
@@ -942,16 +1160,10 @@ async function openCase() {
         
         if (response && response.success) {
             // Обновляем данные с сервера
+            applySyncResponse(response);
             userData.balance = response.new_balance;
-            userData.experience = response.experience || userData.experience;
-            userData.level = response.level || userData.level;
             currentItem = response.item;
             
-            // Обновляем инвентарь
-            if (response.inventory) {
-                inventoryData = response.inventory;
-            }
-            
             // Сохраняем в localStorage
             saveToLocalStorage();
             
@@ -987,6 +1199,59 @@ async function openCase() {
     }
 }
 
+// Открытие нескольких кейсов одним запросом, без рулетки
+async function openCases() {
+    if (!currentCase || !userData || isOpening) {
+        return;
+    }
+    
+    const total = currentCase.price * BATCH_OPEN_COUNT;
+    if (userData.balance < total) {
+        alert('❌ Недостаточно алмазов!');
+        return;
+    }
+    
+    elements.openCaseBtn.disabled = true;
+    elements.openManyBtn.disabled = true;
+    elements.openManyBtn.innerHTML = '⏳ Открывается...';
+    isOpening = true;
+    
+    try {
+        const response = await sendDataToBot('open_cases', {
+            case_id: currentCase.id,
+            count: BATCH_OPEN_COUNT
+        });
+        
+        if (response && response.success) {
+            applySyncResponse(response);
+            userData.balance = response.new_balance;
+            saveToLocalStorage();
+            
+            const items = response.items || [];
+            // Крупно показываем самый редкий предмет, остальные - списком
+            currentItem = items.reduce((best, item) =>
+                RARITY_ORDER.indexOf(item.rarity) > RARITY_ORDER.indexOf(best.rarity) ? item : best,
+                items[0]);
+            hideModal(elements.caseModal);
+            if (currentItem) {
+                showResult(currentItem, items);
+            }
+            updateUI();
+        } else {
+            console.error('Ошибка открытия кейсов:', response?.error);
+            alert(response?.error || 'Ошибка при открытии кейсов');
+        }
+    } catch (error) {
+        console.error('Ошибка при открытии кейсов:', error);
+        alert('Ошибка соединения с сервером');
+    } finally {
+        isOpening = false;
+        elements.openCaseBtn.disabled = userData.balance < currentCase.price;
+        elements.openCaseBtn.innerHTML = `⛏️ Открыть за ${currentCase.price} 💎`;
+        updateOpenManyButton(currentCase);
+    }
+}
+
 // Генерация выигрышного предмета
 function generateWonItem(caseItem) {
     const totalWeight = Object.values(caseItem.rarityWeights).reduce((a, b) => a + b, 0);
@@ -1199,8 +1464,8 @@ function finishRouletteAnimation(resolve) {
     }, 300);
 }
 
-// Показ результата с PNG изображением
-function showResult(item) {
+// Показ результата с PNG изображением; items - все предметы пачки open_cases
+function showResult(item, items = null) {
     console.log('Показ результата:', item);
     const resultCard = elements.resultModal?.querySelector('.result-modal');
     if (resultCard) {
@@ -1220,6 +1485,12 @@ function showResult(item) {
     
     elements.newBalance.textContent = userData.balance.toLocaleString();
     
+    if (elements.resultItems) {
+        elements.resultItems.innerHTML = (items || []).map(wonItem =>
+            `<div class="result-items-entry" title="${wonItem.name}">${getItemImageHTML(wonItem)}</div>`
+        ).join('');
+    }
+    
     createParticles();
     showModal(elements.resultModal);
 }
@@ -1385,6 +1656,10 @@ function initEventListeners() {
         addTouchHandlers(elements.openCaseBtn, openCase);
     }
     
+    if (elements.openManyBtn) {
+        addTouchHandlers(elements.openManyBtn, openCases);
+    }
+    
     // Закрытие модальных окон по клику на overlay
     document.querySelectorAll('.modal-overlay').forEach(overlay => {
         overlay.addEventListener('click', (e) => {
@@ -0,0 +1,303 @@
+import asyncio
+import logging
+import multiprocessing
+import signal
+import sqlite3
+import time
+from queue import Full
+from typing import Dict, List, Optional
+
+import metrics
+
+log = logging.getLogger(__name__)
+
+# Ключи обновления, которые не являются его содержимым
+_UPDATE_META_KEYS = ("update_id",)
+
+
+def update_user_id(update: Dict) -> int:
+    """Идентификатор пользователя, от которого пришло обновление.
+
+    Для обновлений без отправителя берется чат, а если нет и его - 0,
+    такие обновления всегда попадают в первый воркер.
+    """
+    for key, payload in update.items():
+        if key in _UPDATE_META_KEYS or not isinstance(payload, dict):
+            continue
+        sender = payload.get("from") or payload.get("user")
+        if isinstance(sender, dict) and "id" in sender:
+            return int(sender["id"])
+        chat = payload.get("chat") or (payload.get("message") or {}).get("chat")
+        if isinstance(chat, dict) and "id" in chat:
+            return int(chat["id"])
+    return 0
+
+
+# Команды администратора, которые супервизор рассылает всем воркерам:
+# иначе они действовали бы только на долю пользователей воркера, которому
+# досталось сообщение. Отвечает администратору только этот воркер.
+BROADCAST_COMMANDS = ("record_updates", "profile", "profile_stop", "reload_catalog")
+
+
+def broadcast_command(update: Dict, admin_id: int) -> Optional[str]:
+    """Текст команды администратора для рассылки всем воркерам или None"""
+    message = update.get("message")
+    if not isinstance(message, dict) or (message.get("from") or {}).get("id") != admin_id:
+        return None
+    text = message.get("text") or ""
+    if not text.startswith("/"):
+        return None
+    command = text.split()[0][1:].split("@")[0]
+    return text if command in BROADCAST_COMMANDS else None
+
+
+def shard_for(user_id: int, shards: int) -> int:
+    """Номер воркера для пользователя"""
+    return abs(user_id) % shards
+
+
+class UserOrderedFeeder:
+    """Обработка обновлений внутри воркера.
+
+    Обновления разных пользователей обрабатываются параллельно, а одного
+    пользователя - строго по очереди: каждое следующее ждет предыдущее.
+    """
+
+    def __init__(self, bot, dp):
+        self.bot = bot
+        self.dp = dp
+        self._tails: Dict[int, asyncio.Task] = {}
+
+    def submit(self, update: Dict):
+        user_id = update_user_id(update)
+        previous = self._tails.get(user_id)
+        task = asyncio.create_task(self._process(update, previous))
+        self._tails[user_id] = task
+        task.add_done_callback(lambda done: self._forget(user_id, done))
+
+    async def _process(self, update: Dict, previous: Optional[asyncio.Task]):
+        if previous is not None:
+            await asyncio.gather(previous, return_exceptions=True)
+        try:
+            await self.dp.feed_raw_update(self.bot, update)
+        except Exception:
+            log.exception("Ошибка обработки обновления %s", update.get("update_id"))
+
+    def _forget(self, user_id: int, task: asyncio.Task):
+        if self._tails.get(user_id) is task:
+            del self._tails[user_id]
+
+    async def drain(self):
+        while self._tails:
+            await asyncio.gather(*list(self._tails.values()), return_exceptions=True)
+
+
+def worker_main(index: int, workers: int, updates: multiprocessing.Queue):
+    """Точка входа процесса-воркера"""
+    # Ctrl+C приходит всей группе процессов, а останавливает воркеры
+    # супервизор, дождавшись обработки их очередей
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    try:
+        asyncio.run(_worker_loop(index, workers, updates))
+    except KeyboardInterrupt:
+        pass
+
+
+async def _worker_loop(index: int, workers: int, updates: multiprocessing.Queue):
+    # Каждый процесс создает свои бот, каталог и соединения с базой
+    from bot import (
+        apply_broadcast_command, bot, config, configure_logging, db, dp, loop_watchdog, maintenance,
+        menu_button, outbound, profiler, update_recorder
+    )
+
+    # Число воркеров могло прийти из --workers, а не из BOT_WORKERS
+    config.BOT_WORKERS = workers
+    config.BOT_WORKER_INDEX = index
+    # Лимит Telegram общий для бота, а диспетчер исходящих у каждого
+    # процесса свой: делим темп поровну, чтобы в сумме не выйти за него
+    if config.OUTBOUND_GLOBAL_RATE > 0:
+        outbound.global_interval = workers / config.OUTBOUND_GLOBAL_RATE
+
+    # У каждого процесса свой файл: ротация из нескольких процессов небезопасна
+    configure_logging(f"bot-worker{index}.log")
+    update_recorder.path = update_recorder.path.with_name(f"worker{index}-{update_recorder.path.name}")
+    profiler.directory = profiler.directory / f"worker{index}"
+    await db.connect()
+    if config.LOOP_LAG_THRESHOLD_MS > 0:
+        loop_watchdog.start()
+    metrics_runner = None
+    if config.METRICS_PORT:
+        metrics_runner = await metrics.start_metrics_server(
+            config.METRICS_HOST, config.METRICS_PORT + 1 + index
+        )
+    if index == 0:
+        # Обновление кнопок меню по всем чатам и архивацию достаточно
+        # одного воркера
+        menu_button.start_refresh()
+        maintenance.start()
+    print(f"👷 Воркер {index} запущен")
+    feeder = UserOrderedFeeder(bot, dp)
+    loop = asyncio.get_running_loop()
+    try:
+        while True:
+            update = await loop.run_in_executor(None, updates.get)
+            if update is None:
+                break
+            if "_control" in update:
+                # Команда администратора, принятая другим воркером
+                await apply_broadcast_command(update["_control"])
+                continue
+            feeder.submit(update)
+        await feeder.drain()
+    finally:
+        await loop_watchdog.stop()
+        update_recorder.close()
+        await maintenance.close()
+        await menu_button.close()
+        await outbound.close()
+        await db.close()
+        await bot.session.close()
+        if metrics_runner is not None:
+            await metrics_runner.cleanup()
+        print(f"👷 Воркер {index} остановлен")
+
+
+class ShardSupervisor:
+    """Запуск N процессов бота с раздачей обновлений по user_id.
+
+    Супервизор сам получает обновления (long polling или webhook) и
+    отправляет каждое в очередь воркера, выбранного по from_user.id,
+    поэтому действия одного пользователя всегда выполняются в одном
+    процессе по порядку. Упавшие воркеры перезапускаются.
+    """
+
+    def __init__(self, workers: int, queue_size: int = 1000, restart_delay: float = 1.0):
+        self.workers = workers
+        self.restart_delay = restart_delay
+        self._context = multiprocessing.get_context("spawn")
+        self.queues: List[multiprocessing.Queue] = [
+            self._context.Queue(maxsize=queue_size) for _ in range(workers)
+        ]
+        self.processes: List[Optional[multiprocessing.Process]] = [None] * workers
+        self.restarts = 0
+        self.admin_id = 0
+        self._stopping = False
+
+    def _start_worker(self, index: int):
+        process = self._context.Process(
+            target=worker_main, args=(index, self.workers, self.queues[index]),
+            name=f"bot-worker-{index}", daemon=False
+        )
+        process.start()
+        self.processes[index] = process
+
+    async def route(self, update: Dict):
+        """Отправка обновления воркеру пользователя.
+
+        Если очередь воркера заполнена, ожидание уходит в поток, и
+        получение новых обновлений приостанавливается. Вызывать из одного
+        потребителя, иначе порядок обновлений пользователя не сохранится.
+        Команды из BROADCAST_COMMANDS остальные воркеры получают как
+        {"_control": текст}.
+        """
+        index = shard_for(update_user_id(update), self.workers)
+        await self._put(index, update)
+        command = broadcast_command(update, self.admin_id)
+        if command is not None:
+            for other in range(self.workers):
+                if other != index:
+                    await self._put(other, {"_control": command})
+
+    async def _put(self, index: int, item: Dict):
+        queue = self.queues[index]
+        try:
+            queue.put_nowait(item)
+        except Full:
+            await asyncio.get_running_loop().run_in_executor(None, queue.put, item)
+
+    async def _watch_workers(self):
+        while not self._stopping:
+            for index, process in enumerate(self.processes):
+                if process is not None and not process.is_alive() and not self._stopping:
+                    log.warning("Воркер %s завершился с кодом %s, перезапускаем", index, process.exitcode)
+                    self.restarts += 1
+                    await asyncio.sleep(self.restart_delay)
+                    self._start_worker(index)
+            await asyncio.sleep(1)
+
+    async def _poll(self, bot, dp, stop_event: asyncio.Event):
+        """Long polling в супервизоре с передачей сырых обновлений воркерам"""
+        offset = None
+        allowed_updates = dp.resolve_used_update_types()
+        await bot.delete_webhook(drop_pending_updates=False)
+        while not stop_event.is_set():
+            try:
+                batch = await bot.get_updates(offset=offset, timeout=25, allowed_updates=allowed_updates)
+            except Exception as e:
+                log.error("Ошибка получения обновлений: %s", e)
+                await asyncio.sleep(1)
+                continue
+            for update in batch:
+                offset = update.update_id + 1
+                await self.route(update.model_dump(mode="json", by_alias=True, exclude_none=True))
+
+    async def run(self, config):
+        """Работа до SIGINT/SIGTERM, затем остановка воркеров с доработкой очередей"""
+        from bot import ADMIN_ID, DB_PATH, bot, configure_logging, dp
+        from storage import init_db
+
+        self.admin_id = ADMIN_ID
+        configure_logging()
+        # Миграции применяются один раз до запуска воркеров
+        conn = sqlite3.connect(DB_PATH, isolation_level=None)
+        try:
+            init_db(conn)
+        finally:
+            conn.close()
+
+        for index in range(self.workers):
+            self._start_worker(index)
+            metrics.register_queue(f"worker_{index}", self.queues[index].qsize)
+        print(f"🚀 Запущено воркеров: {self.workers}")
+        metrics_runner = None
+        if config.METRICS_PORT:
+            metrics_runner = await metrics.start_metrics_server(config.METRICS_HOST, config.METRICS_PORT)
+
+        stop_event = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(sig, stop_event.set)
+            except NotImplementedError:
+                pass
+
+        watcher = asyncio.create_task(self._watch_workers())
+        try:
+            if config.BOT_MODE == "webhook":
+                from webhook import run_webhook
+                await run_webhook(bot, dp, config, process_update=self.route)
+            else:
+                poller = asyncio.create_task(self._poll(bot, dp, stop_event))
+                await stop_event.wait()
+                poller.cancel()
+                await asyncio.gather(poller, return_exceptions=True)
+        finally:
+            self._stopping = True
+            watcher.cancel()
+            await bot.session.close()
+            await loop.run_in_executor(None, self._stop_workers, config.WEBHOOK_DRAIN_SECONDS)
+            if metrics_runner is not None:
+                await metrics_runner.cleanup()
+
+    def _stop_workers(self, timeout: float):
+        for queue in self.queues:
+            queue.put(None)
+        deadline = time.monotonic() + timeout
+        for index, process in enumerate(self.processes):
+            if process is None:
+                continue
+            process.join(max(0.0, deadline - time.monotonic()))
+            if process.is_alive():
+                log.warning("Воркер %s не завершился вовремя, останавливаем принудительно", index)
+                process.terminate()
+                process.join()
@@ -0,0 +1,1166 @@
+import asyncio
+import functools
+import json
+import logging
+import sqlite3
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import metrics
+from cache import TTLCache
+from catalog import Catalog, get_catalog_version
+from migrations import REBUILD_USER_STATS_WITH_ROLLUPS_SQL, apply_pragmas, migrate
+
+log = logging.getLogger(__name__)
+
+
+def init_db(conn: sqlite3.Connection):
+    """Инициализация базы данных"""
+    version = migrate(conn)
+    cursor = conn.cursor()
+
+    # Добавляем тестовые данные только если таблицы пустые
+    cursor.execute("SELECT COUNT(*) FROM items")
+    if cursor.fetchone()[0] == 0:
+        cursor.execute("BEGIN IMMEDIATE")
+        add_initial_data(cursor)
+        cursor.execute("COMMIT")
+
+    return version
+
+def add_initial_data(cursor):
+    """Добавление начальных данных в БД"""
+    print("📦 Добавление начальных данных...")
+
+    # Minecraft предметы
+    minecraft_items = [
+        # Common - Еда
+        ("Яблоко", "🍎", "common", "food", 40, 20, "Восстанавливает 2 единицы голода", "apple.png"),
+        ("Хлеб", "🍞", "common", "food", 45, 22, "Восстанавливает 5 единиц голода", "bread.png"),
+        ("Мясо", "🍖", "common", "food", 50, 25, "Восстанавливает 8 единиц голода", "meat.png"),
+        ("Тыквенный пирог", "🥧", "common", "food", 60, 30, "Восстанавливает 8 единицы голода", "pie.png"),
+        ("Золотое яблоко", "🍏", "uncommon", "food", 400, 200, "Даёт регенерацию здоровья", "golden_apple.png"),
+
+        # Common - Ресурсы
+        ("Уголь", "⚫", "common", "resources", 30, 15, "Топливо и краситель", "coal.png"),
+        ("Железный слиток", "⛓️", "common", "resources", 50, 25, "Базовый ресурс для крафта", "iron.png"),
+        ("Золотой слиток", "🟨", "common", "resources", 80, 40, "Редкий ресурс", "gold.png"),
+        ("Красная пыль", "🔴", "common", "resources", 40, 20, "Для механизмов и зелий", "redstone.png"),
+
+        # Uncommon
+        ("Алмаз", "💎", "uncommon", "resources", 150, 75, "Ценный минерал", "diamond.png"),
+        ("Изумруд", "🟩", "uncommon", "resources", 200, 100, "Торговая валюта", "emerald.png"),
+        ("Лазурит", "🔵", "uncommon", "resources", 100, 50, "Для зачарования", "lapis.png"),
+
+        # Uncommon - Оружие
+        ("Железный меч", "⚔️", "uncommon", "weapons", 180, 90, "Базовое оружие", "iron_sword.png"),
+        ("Лук", "🏹", "uncommon", "weapons", 120, 60, "Дальнобойное оружие", "bow.png"),
+        ("Щит", "🛡️", "uncommon", "weapons", 150, 75, "Защита от атак", "shield.png"),
+
+        # Rare
+        ("Алмазный меч", "⚔️💎", "rare", "weapons", 250, 125, "Мощное оружие", "diamond_sword.png"),
+        ("Алмазная кирка", "⛏️💎", "rare", "tools", 300, 150, "Быстрая добыча", "diamond_pickaxe.png"),
+        ("Незеритовый слиток", "🔱", "rare", "resources", 500, 250, "Элитный материал", "netherite.png"),
+        ("Элитра", "🧥", "rare", "special", 800, 400, "Позволяет летать", "elytra.png"),
+
+        # Epic
+        ("Тотем бессмертия", "🐦", "epic", "special", 1000, 500, "Спасение от смерти", "totem.png"),
+        ("Сердце моря", "💙", "epic", "resources", 1200, 600, "Редкая реликвия", "heart.png"),
+        ("Голова дракона", "🐲", "epic", "special", 1500, 750, "Трофей дракона", "dragon_head.png"),
+
+        # Legendary
+        ("Командный блок", "🟪", "legendary", "special", 5000, 2500, "Божественный предмет", "command_block.png"),
+        ("Меч незера", "🗡️", "legendary", "weapons", 3000, 1500, "Легендарное оружие", "netherite_sword.png"),
+        ("Корона власти", "👑", "legendary", "special", 10000, 5000, "Знак абсолютной власти", "crown.png"),
+        ("Броня незера", "🛡️🔥", "legendary", "weapons", 4000, 2000, "Неуязвимая защита", "netherite_armor.png"),
+    ]
+
+    cursor.executemany(
+        """INSERT INTO items (name, icon, rarity, category, price, sell_price, description, texture_url)
+           VALUES (?, ?, ?, ?, ?, ?, ?, ?)""",
+        minecraft_items
+    )
+
+    # Кейсы
+    cases = [
+        ("Кейс с Едой", 100, "🍎", "Содержит разнообразную еду",
+        '{"common": 70, "uncommon": 30}', "bot.py"),
+        ("Ресурсный Кейс", 250, "⛏️", "Руды, минералы и базовые ресурсы",
+        '{"common": 50, "uncommon": 40, "rare": 10}', "assets/textures/cases/case_resources.png"),
+        ("Оружейный Кейс", 500, "⚔️", "Оружие, броня и инструменты",
+        '{"uncommon": 40, "rare": 50, "epic": 10}', "assets/textures/cases/case_weapons.png"),
+        ("Легендарный Кейс", 1000, "🌟", "Уникальные предметы",
+        '{"rare": 30, "epic": 50, "legendary": 20}', "assets/textures/cases/case_legendary.png"),
+        ("Донат Кейс", 5000, "👑", "Эксклюзивные донат предметы",
+        '{"epic": 40, "legendary": 60}', "assets/textures/cases/case_donate.png"),
+        ("Случайный Кейс", 750, "🧰", "Микс из всех категорий",
+        '{"common": 30, "uncommon": 40, "rare": 20, "epic": 10}', "assets/textures/cases/case_random.png"),
+    ]
+
+    cursor.executemany(
+        """INSERT INTO cases (name, price, icon, description, rarity_weights, texture_url)
+           VALUES (?, ?, ?, ?, ?, ?)""",
+        cases
+    )
+
+    print(f"✅ Добавлено {len(minecraft_items)} предметов и {len(cases)} кейсов")
+
+# Добавление предметов в стопку (user_id, item_id):
+# параметры user_id, item_id, quantity, revision
+INVENTORY_UPSERT_SQL = """INSERT INTO inventory (user_id, item_id, quantity, revision)
+    VALUES (?, ?, ?, ?)
+    ON CONFLICT (user_id, item_id) DO UPDATE SET
+        quantity = quantity + excluded.quantity,
+        obtained_at = CURRENT_TIMESTAMP,
+        revision = excluded.revision"""
+
+# Приращение счетчиков пользователя: параметры user_id, cases_opened,
+# inventory_count, inventory_value, total_spent, total_earned
+USER_STATS_ADD_SQL = """INSERT INTO user_stats
+    (user_id, cases_opened, inventory_count, inventory_value, total_spent, total_earned)
+    VALUES (?, ?, ?, ?, ?, ?)
+    ON CONFLICT (user_id) DO UPDATE SET
+        cases_opened = cases_opened + excluded.cases_opened,
+        inventory_count = inventory_count + excluded.inventory_count,
+        inventory_value = inventory_value + excluded.inventory_value,
+        total_spent = total_spent + excluded.total_spent,
+        total_earned = total_earned + excluded.total_earned"""
+
+INVENTORY_COLUMNS = """i.item_id, i.name, i.icon, i.rarity, i.category, i.price, i.sell_price,
+           i.description, i.texture_url, inv.quantity, inv.obtained_at, inv.is_favorite"""
+
+def _user_from_row(row) -> Dict:
+    return {
+        "user_id": row[0],
+        "username": row[1],
+        "first_name": row[2],
+        "last_name": row[3],
+        "balance": row[4],
+        "experience": row[5],
+        "level": row[6],
+        "revision": row[7]
+    }
+
+def _inventory_from_row(row) -> Dict:
+    return {
+        "id": row[0],
+        "name": row[1],
+        "icon": row[2],
+        "rarity": row[3],
+        "category": row[4],
+        "price": row[5],
+        "sell_price": row[6],
+        "description": row[7],
+        "texture_url": row[8],
+        "quantity": row[9],
+        "obtained_at": row[10],
+        "is_favorite": bool(row[11])
+    }
+
+def _add_user_stats(cursor: sqlite3.Cursor, user_id: int, cases_opened: int = 0,
+                    inventory_count: int = 0, inventory_value: int = 0,
+                    total_spent: int = 0, total_earned: int = 0):
+    """Изменение счетчиков пользователя в той же транзакции, что и сама операция"""
+    cursor.execute(
+        USER_STATS_ADD_SQL,
+        (user_id, cases_opened, inventory_count, inventory_value, total_spent, total_earned)
+    )
+
+def fetch_user(conn: sqlite3.Connection, user_id: int) -> Optional[Dict]:
+    """Получение пользователя без создания"""
+    cursor = conn.cursor()
+    cursor.execute(
+        """SELECT user_id, username, first_name, last_name, balance, experience, level, revision
+           FROM users WHERE user_id = ?""",
+        (user_id,)
+    )
+    row = cursor.fetchone()
+    return _user_from_row(row) if row else None
+
+def create_user(conn: sqlite3.Connection, user_id: int) -> Dict:
+    """Создание пользователя со стартовым бонусом"""
+    cursor = conn.cursor()
+    cursor.execute(
+        """INSERT OR IGNORE INTO users (user_id, balance, experience, level, last_login)
+           VALUES (?, 10000, 0, 1, CURRENT_TIMESTAMP)""",
+        (user_id,)
+    )
+
+    # Создаем начальную транзакцию, только если пользователь действительно новый
+    if cursor.rowcount:
+        cursor.execute(
+            """INSERT INTO transactions (user_id, type, amount, description)
+               VALUES (?, 'reward', 10000, 'Стартовый бонус')""",
+            (user_id,)
+        )
+        _add_user_stats(cursor, user_id, total_earned=10000)
+
+    return fetch_user(conn, user_id)
+
+def touch_last_login(conn: sqlite3.Connection, user_id: int):
+    """Обновление времени последнего входа"""
+    conn.execute(
+        "UPDATE users SET last_login = CURRENT_TIMESTAMP WHERE user_id = ?",
+        (user_id,)
+    )
+
+def update_balance(conn: sqlite3.Connection, user_id: int, amount: int,
+                   transaction_type: str, description: str = "") -> Dict:
+    """Обновление баланса пользователя, возвращает новый баланс и ревизию"""
+    cursor = conn.cursor()
+
+    cursor.execute(
+        "UPDATE users SET balance = balance + ?, revision = revision + 1 WHERE user_id = ? "
+        "RETURNING balance, revision",
+        (amount, user_id)
+    )
+    new_balance, revision = cursor.fetchone()
+
+    cursor.execute(
+        """INSERT INTO transactions (user_id, type, amount, description)
+           VALUES (?, ?, ?, ?)""",
+        (user_id, transaction_type, amount, description)
+    )
+    if amount >= 0:
+        _add_user_stats(cursor, user_id, total_earned=amount)
+    else:
+        _add_user_stats(cursor, user_id, total_spent=-amount)
+
+    return {"new_balance": new_balance, "revision": revision}
+
+def get_inventory(conn: sqlite3.Connection, user_id: int) -> List[Dict]:
+    """Получение инвентаря пользователя"""
+    cursor = conn.cursor()
+
+    cursor.execute(f'''
+    SELECT {INVENTORY_COLUMNS}
+    FROM inventory inv
+    JOIN items i ON inv.item_id = i.item_id
+    WHERE inv.user_id = ? AND inv.quantity > 0
+    ORDER BY inv.is_favorite DESC, inv.obtained_at DESC
+    ''', (user_id,))
+
+    return [_inventory_from_row(row) for row in cursor.fetchall()]
+
+# Сортировки страниц инвентаря: (таблицы, колонка ключа, колонка item_id).
+# По дате обходится индекс инвентаря пользователя, по цене - индекс цен
+# предметов с проверкой стопки по (user_id, item_id): CROSS JOIN фиксирует
+# порядок таблиц, иначе SQLite сортирует весь инвентарь.
+INVENTORY_PAGE_ORDER = {
+    "date": ("inventory inv JOIN items i ON inv.item_id = i.item_id",
+             "inv.obtained_at", "inv.item_id"),
+    "price": ("items i CROSS JOIN inventory inv ON inv.item_id = i.item_id",
+              "i.price", "i.item_id"),
+}
+
+def get_inventory_page(conn: sqlite3.Connection, user_id: int, sort: str = "date",
+                       rarity: Optional[str] = None, category: Optional[str] = None,
+                       cursor: Optional[Tuple[Any, int]] = None, backward: bool = False,
+                       limit: int = 8) -> Dict:
+    """Страница инвентаря с пагинацией по ключу.
+
+    Курсор - пара (значение сортировки, item_id) первой или последней
+    строки соседней страницы. Запрос читает только limit + 1 строк
+    начиная с курсора, поэтому стоимость страницы не зависит от размера
+    инвентаря. При backward=True возвращается страница перед курсором.
+    """
+    tables, order_column, id_column = INVENTORY_PAGE_ORDER[sort]
+    conditions = ["inv.user_id = ?", "inv.quantity > 0"]
+    params: List[Any] = [user_id]
+
+    if rarity:
+        conditions.append("i.rarity = ?")
+        params.append(rarity)
+    if category:
+        conditions.append("i.category = ?")
+        params.append(category)
+    if cursor is not None:
+        conditions.append(f"({order_column}, {id_column}) {'>' if backward else '<'} (?, ?)")
+        params.extend(cursor)
+
+    direction = "ASC" if backward else "DESC"
+    params.append(limit + 1)
+    rows = conn.execute(f'''
+    SELECT {INVENTORY_COLUMNS}
+    FROM {tables}
+    WHERE {" AND ".join(conditions)}
+    ORDER BY {order_column} {direction}, {id_column} {direction}
+    LIMIT ?
+    ''', params).fetchall()
+
+    has_more = len(rows) > limit
+    items = [_inventory_from_row(row) for row in rows[:limit]]
+    if backward:
+        items.reverse()
+
+    key_field = "obtained_at" if sort == "date" else "price"
+    return {
+        "items": items,
+        "has_next": has_more if not backward else True,
+        "has_prev": has_more if backward else cursor is not None,
+        "first": (items[0][key_field], items[0]["id"]) if items else None,
+        "last": (items[-1][key_field], items[-1]["id"]) if items else None
+    }
+
+def get_inventory_changes(conn: sqlite3.Connection, user_id: int, since_revision: int) -> List[Dict]:
+    """Стопки инвентаря, измененные после указанной ревизии.
+
+    Проданные целиком стопки остаются в таблице с нулевым количеством,
+    чтобы клиент узнал об их удалении.
+    """
+    cursor = conn.cursor()
+
+    cursor.execute(f'''
+    SELECT {INVENTORY_COLUMNS}
+    FROM inventory inv
+    JOIN items i ON inv.item_id = i.item_id
+    WHERE inv.user_id = ? AND inv.revision > ?
+    ORDER BY inv.obtained_at DESC
+    ''', (user_id, since_revision))
+
+    return [_inventory_from_row(row) for row in cursor.fetchall()]
+
+def get_user_stats(conn: sqlite3.Connection, user_id: int) -> Dict:
+    """Счетчики пользователя для меню и профиля"""
+    row = conn.execute(
+        """SELECT cases_opened, inventory_count, inventory_value, total_spent, total_earned
+           FROM user_stats WHERE user_id = ?""",
+        (user_id,)
+    ).fetchone()
+    row = row or (0, 0, 0, 0, 0)
+    return {
+        "cases_opened": row[0],
+        "inventory_count": row[1],
+        "inventory_value": row[2],
+        "total_spent": row[3],
+        "total_earned": row[4]
+    }
+
+def rebuild_user_stats(conn: sqlite3.Connection) -> int:
+    """Пересчет счетчиков всех пользователей по истории и инвентарю.
+
+    Нужен для старых данных и после изменения цен предметов: стоимость
+    инвентаря хранится в ценах на момент получения и продажи.
+    """
+    cursor = conn.cursor()
+    cursor.execute(REBUILD_USER_STATS_WITH_ROLLUPS_SQL)
+    return cursor.rowcount
+
+def _public_item(item: Dict) -> Dict:
+    """Поля выигранного предмета для ответа веб-приложению"""
+    return {
+        "id": item["id"],
+        "name": item["name"],
+        "icon": item["icon"],
+        "rarity": item["rarity"],
+        "price": item["price"],
+        "description": item["description"],
+        "texture_url": item["texture_url"]
+    }
+
+def _charge_for_opening(cursor: sqlite3.Cursor, user_id: int, price: int,
+                        experience_gained: int) -> Optional[Tuple[int, int, int, int]]:
+    """Списание цены кейса с начислением опыта одним условным UPDATE.
+
+    Проверка баланса, списание, опыт, повышение уровня (1000 опыта за
+    уровень) и новая ревизия выполняются одной командой, поэтому
+    параллельные открытия не могут увести баланс в минус. Возвращает
+    (баланс, опыт, уровень, ревизия) или None, если средств не хватило.
+    """
+    cursor.execute(
+        """UPDATE users SET
+               balance = balance - ?,
+               experience = experience + ?,
+               level = MAX(level, (experience + ?) / 1000 + 1),
+               revision = revision + 1
+           WHERE user_id = ? AND balance >= ?
+           RETURNING balance, experience, level, revision""",
+        (price, experience_gained, experience_gained, user_id, price)
+    )
+    return cursor.fetchone()
+
+def _opening_error(cursor: sqlite3.Cursor, user_id: int) -> Dict:
+    """Причина, по которой списание не прошло"""
+    cursor.execute("SELECT 1 FROM users WHERE user_id = ?", (user_id,))
+    if cursor.fetchone() is None:
+        return {"error": "Пользователь не найден"}
+    return {"error": "Недостаточно средств"}
+
+def open_case(conn: sqlite3.Connection, catalog: Catalog, user_id: int, case_id: int) -> Dict:
+    """Открытие кейса"""
+    cursor = conn.cursor()
+
+    # Кейс и выигрыш берем из каталога в памяти
+    case = catalog.cases.get(case_id)
+    if not case:
+        return {"error": "Кейс не найден"}
+
+    case_name, case_price = case["name"], case["price"]
+
+    won_item = catalog.roll(case_id)
+    if not won_item:
+        return {"error": "Не удалось выбрать предмет"}
+
+    item = _public_item(won_item)
+
+    # Списание средств вместе с опытом, проверка баланса в том же UPDATE
+    experience_gained = case_price // 10
+    updated_user = _charge_for_opening(cursor, user_id, case_price, experience_gained)
+    if updated_user is None:
+        return _opening_error(cursor, user_id)
+
+    cursor.execute(
+        """INSERT INTO transactions (user_id, type, amount, description)
+           VALUES (?, 'purchase', ?, ?)""",
+        (user_id, -case_price, f"Покупка кейса: {case_name}")
+    )
+
+    # Добавляем предмет в стопку инвентаря
+    revision = updated_user[3]
+    cursor.execute(INVENTORY_UPSERT_SQL + " RETURNING inventory_id", (user_id, item["id"], 1, revision))
+
+    # Получаем ID стопки с предметом
+    inventory_id = cursor.fetchone()[0]
+
+    # Добавляем в историю открытий
+    cursor.execute(
+        """INSERT INTO opening_history (user_id, case_id, item_id)
+           VALUES (?, ?, ?)""",
+        (user_id, case_id, item["id"])
+    )
+
+    _add_user_stats(cursor, user_id, cases_opened=1, inventory_count=1,
+                    inventory_value=item["price"], total_spent=case_price)
+
+    return {
+        "success": True,
+        "item": item,
+        "new_balance": updated_user[0],
+        "experience_gained": experience_gained,
+        "case_price": case_price,
+        "inventory_id": inventory_id,
+        "experience": updated_user[1],
+        "level": updated_user[2],
+        "revision": updated_user[3]
+    }
+
+def open_cases(conn: sqlite3.Connection, catalog: Catalog, user_id: int,
+               case_id: int, count: int) -> Dict:
+    """Открытие нескольких одинаковых кейсов одной операцией"""
+    cursor = conn.cursor()
+
+    case = catalog.cases.get(case_id)
+    if not case:
+        return {"error": "Кейс не найден"}
+
+    case_name, case_price = case["name"], case["price"]
+    total_price = case_price * count
+
+    won_items = catalog.roll_many(case_id, count)
+    if won_items is None:
+        return {"error": "Не удалось выбрать предмет"}
+
+    # Баланс проверяется и списывается одной командой на всю пачку
+    experience_gained = (case_price // 10) * count
+    updated_user = _charge_for_opening(cursor, user_id, total_price, experience_gained)
+    if updated_user is None:
+        return _opening_error(cursor, user_id)
+
+    purchase_description = f"Покупка кейса: {case_name}"
+    cursor.executemany(
+        """INSERT INTO transactions (user_id, type, amount, description)
+           VALUES (?, 'purchase', ?, ?)""",
+        [(user_id, -case_price, purchase_description)] * count
+    )
+    revision = updated_user[3]
+    won_counts = Counter(item["id"] for item in won_items)
+    cursor.executemany(
+        INVENTORY_UPSERT_SQL,
+        [(user_id, item_id, quantity, revision) for item_id, quantity in won_counts.items()]
+    )
+    cursor.executemany(
+        """INSERT INTO opening_history (user_id, case_id, item_id)
+           VALUES (?, ?, ?)""",
+        [(user_id, case_id, item["id"]) for item in won_items]
+    )
+    _add_user_stats(cursor, user_id, cases_opened=count, inventory_count=count,
+                    inventory_value=sum(item["price"] for item in won_items),
+                    total_spent=total_price)
+
+    return {
+        "success": True,
+        "items": [_public_item(item) for item in won_items],
+        "count": count,
+        "new_balance": updated_user[0],
+        "experience_gained": experience_gained,
+        "case_price": case_price,
+        "total_price": total_price,
+        "experience": updated_user[1],
+        "level": updated_user[2],
+        "revision": updated_user[3]
+    }
+
+def sell_item(conn: sqlite3.Connection, catalog: Catalog, user_id: int, item_id: int) -> Dict:
+    """Продажа предмета из инвентаря"""
+    cursor = conn.cursor()
+
+    # Получаем цену предмета
+    item = catalog.items.get(item_id)
+    if not item:
+        return {"error": "Предмет не найден"}
+
+    sell_price, item_name = item["sell_price"], item["name"]
+
+    # Уменьшаем стопку на один предмет. Пустая стопка остается с нулевым
+    # количеством как отметка об удалении для дельта-синхронизации.
+    cursor.execute(
+        """UPDATE inventory SET quantity = quantity - 1,
+               revision = (SELECT revision + 1 FROM users WHERE user_id = ?)
+           WHERE user_id = ? AND item_id = ? AND quantity > 0""",
+        (user_id, user_id, item_id)
+    )
+
+    if cursor.rowcount == 0:
+        return {"error": "Предмет не найден в инвентаре"}
+
+    # Добавляем деньги вместе с новой ревизией
+    cursor.execute(
+        "UPDATE users SET balance = balance + ?, revision = revision + 1 WHERE user_id = ? "
+        "RETURNING balance, revision",
+        (sell_price, user_id)
+    )
+    new_balance, revision = cursor.fetchone()
+
+    cursor.execute(
+        """INSERT INTO transactions (user_id, type, amount, description)
+           VALUES (?, 'reward', ?, ?)""",
+        (user_id, sell_price, f"Продажа предмета: {item_name}")
+    )
+    _add_user_stats(cursor, user_id, inventory_count=-1,
+                    inventory_value=-item["price"], total_earned=sell_price)
+
+    return {
+        "success": True,
+        "sell_price": sell_price,
+        "new_balance": new_balance,
+        "revision": revision
+    }
+
+def get_user_data_for_webapp(conn: sqlite3.Connection, catalog: Catalog, user_id: int,
+                             since_revision: Optional[int] = None,
+                             catalog_version: Optional[int] = None,
+                             max_delta_revisions: int = 500,
+                             user: Optional[Dict] = None) -> Optional[Dict]:
+    """Получение данных пользователя для веб-приложения.
+
+    Если клиент прислал ревизию, с которой он синхронизирован, в ответ
+    попадают только изменившиеся стопки инвентаря. Полный снимок
+    отправляется при первой синхронизации и когда клиент отстал больше
+    чем на max_delta_revisions. Кейсы отправляются, только если версия
+    каталога у клиента устарела. Пользователя можно передать готовым,
+    например из кэша, тогда он не читается из базы.
+    """
+    if user is None:
+        user = fetch_user(conn, user_id)
+    if user is None:
+        return None
+
+    revision = user["revision"]
+    data = {
+        "user": {
+            "balance": user["balance"],
+            "experience": user["experience"],
+            "level": user["level"]
+        },
+        "revision": revision,
+        "catalog_version": catalog.version
+    }
+
+    if (since_revision is None or since_revision > revision
+            or revision - since_revision > max_delta_revisions):
+        data["full"] = True
+        data["inventory"] = get_inventory(conn, user_id)
+    else:
+        changes = get_inventory_changes(conn, user_id, since_revision)
+        data["full"] = False
+        data["inventory_changed"] = [item for item in changes if item["quantity"] > 0]
+        data["inventory_removed"] = [item["id"] for item in changes if item["quantity"] <= 0]
+
+    if data["full"] or catalog_version != catalog.version:
+        data["cases"] = catalog.active_cases
+
+    return data
+
+def get_menu_button_url(conn: sqlite3.Connection, chat_id: int) -> Optional[str]:
+    """Адрес, установленный в кнопку меню чата"""
+    row = conn.execute(
+        "SELECT url FROM chat_menu_buttons WHERE chat_id = ?", (chat_id,)
+    ).fetchone()
+    return row[0] if row else None
+
+def set_menu_button_url(conn: sqlite3.Connection, chat_id: int, url: str):
+    """Запоминание адреса после успешной установки кнопки меню"""
+    conn.execute(
+        """INSERT INTO chat_menu_buttons (chat_id, url) VALUES (?, ?)
+           ON CONFLICT (chat_id) DO UPDATE SET url = excluded.url, updated_at = CURRENT_TIMESTAMP""",
+        (chat_id, url)
+    )
+
+def get_stale_menu_button_chats(conn: sqlite3.Connection, url: str,
+                                after_chat_id: int, limit: int) -> List[int]:
+    """Чаты с кнопкой меню на другой адрес, по возрастанию chat_id"""
+    rows = conn.execute(
+        """SELECT chat_id FROM chat_menu_buttons
+           WHERE chat_id > ? AND url != ?
+           ORDER BY chat_id LIMIT ?""",
+        (after_chat_id, url, limit)
+    ).fetchall()
+    return [row[0] for row in rows]
+
+def run_idempotent(conn: sqlite3.Connection, user_id: int, request_id: str, action: str,
+                   func: Callable, *args) -> Dict:
+    """Выполнение изменения не более одного раза на идентификатор запроса.
+
+    Результат сохраняется в processed_requests в той же транзакции, что и
+    само изменение, поэтому повтор после перезапуска бота вернет
+    сохраненный ответ, а не спишет деньги второй раз.
+    """
+    cursor = conn.cursor()
+    cursor.execute(
+        "SELECT response FROM processed_requests WHERE user_id = ? AND request_id = ?",
+        (user_id, request_id)
+    )
+    row = cursor.fetchone()
+    if row:
+        return json.loads(row[0])
+
+    result = func(conn, *args)
+    cursor.execute(
+        """INSERT INTO processed_requests (user_id, request_id, action, response)
+           VALUES (?, ?, ?, ?)""",
+        (user_id, request_id, action, json.dumps(result, ensure_ascii=False))
+    )
+    return result
+
+def prune_processed_requests(conn: sqlite3.Connection, retention_hours: float) -> int:
+    """Удаление идентификаторов запросов старше срока хранения"""
+    cursor = conn.cursor()
+    cursor.execute(
+        "DELETE FROM processed_requests WHERE created_at < datetime('now', ?)",
+        (f"-{float(retention_hours)} hours",)
+    )
+    return cursor.rowcount
+
+# Таблицы, которые обслуживание переносит в архив: ключ, время строки,
+# переносимые столбцы и пополнение дневной сводки отобранными строками
+ARCHIVED_TABLES = {
+    "opening_history": (
+        "history_id", "opened_at", "history_id, user_id, case_id, item_id, opened_at",
+        """INSERT INTO opening_daily (user_id, day, case_id, opens)
+           SELECT user_id, date(opened_at), case_id, COUNT(*)
+           FROM opening_history WHERE {where}
+           GROUP BY user_id, date(opened_at), case_id
+           ON CONFLICT (user_id, day, case_id) DO UPDATE SET opens = opens + excluded.opens"""
+    ),
+    "transactions": (
+        "transaction_id", "created_at", "transaction_id, user_id, type, amount, description, created_at",
+        """INSERT INTO transaction_daily (user_id, day, type, count, earned, spent)
+           SELECT user_id, date(created_at), type, COUNT(*),
+                  COALESCE(SUM(CASE WHEN amount > 0 THEN amount END), 0),
+                  COALESCE(-SUM(CASE WHEN amount < 0 THEN amount END), 0)
+           FROM transactions WHERE {where}
+           GROUP BY user_id, date(created_at), type
+           ON CONFLICT (user_id, day, type) DO UPDATE SET
+               count = count + excluded.count,
+               earned = earned + excluded.earned,
+               spent = spent + excluded.spent"""
+    ),
+}
+
+
+def attach_archive(conn: sqlite3.Connection, path: str):
+    """Подключение файла архива к соединению писателя как схемы archive.
+
+    Строки хранятся с исходными ключами, поэтому повторный перенос той же
+    пачки (после сбоя между фиксацией архива и основной базы) ничего не
+    дублирует.
+    """
+    conn.execute("ATTACH DATABASE ? AS archive", (path,))
+    conn.execute("PRAGMA archive.journal_mode = WAL")
+    conn.execute("PRAGMA archive.synchronous = NORMAL")
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS archive.opening_history (
+        history_id INTEGER PRIMARY KEY,
+        user_id INTEGER NOT NULL,
+        case_id INTEGER NOT NULL,
+        item_id INTEGER NOT NULL,
+        opened_at TIMESTAMP
+    )
+    ''')
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS archive.idx_opening_history_user_opened "
+        "ON opening_history(user_id, opened_at)"
+    )
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS archive.transactions (
+        transaction_id INTEGER PRIMARY KEY,
+        user_id INTEGER NOT NULL,
+        type TEXT NOT NULL,
+        amount INTEGER NOT NULL,
+        description TEXT,
+        created_at TIMESTAMP
+    )
+    ''')
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS archive.idx_transactions_user_created "
+        "ON transactions(user_id, created_at)"
+    )
+
+def archive_old_rows(conn: sqlite3.Connection, table: str, retention_days: float,
+                     batch_size: int, to_archive: bool) -> int:
+    """Перенос одной пачки строк старше срока хранения, возвращает их число.
+
+    Строки сначала копируются в архив (если он подключен), затем
+    добавляются в дневные сводки и удаляются. Сводка и удаление идут в
+    одной транзакции основной базы, поэтому счетчики, пересчитанные по
+    сырым строкам и сводкам, не меняются.
+    """
+    id_column, time_column, columns, rollup_sql = ARCHIVED_TABLES[table]
+    cursor = conn.cursor()
+    cutoff = cursor.execute(
+        "SELECT datetime('now', ?)", (f"-{float(retention_days)} days",)
+    ).fetchone()[0]
+    # Самые старые строки идут первыми по ключу, пачка - до upper включительно
+    upper = cursor.execute(
+        f"""SELECT MAX({id_column}) FROM (
+                SELECT {id_column} FROM {table} WHERE {time_column} < ?
+                ORDER BY {id_column} LIMIT ?
+            )""",
+        (cutoff, batch_size)
+    ).fetchone()[0]
+    if upper is None:
+        return 0
+
+    where = f"{id_column} <= ? AND {time_column} < ?"
+    params = (upper, cutoff)
+    if to_archive:
+        cursor.execute(
+            f"""INSERT OR IGNORE INTO archive.{table} ({columns})
+                SELECT {columns} FROM main.{table} WHERE {where}""",
+            params
+        )
+    cursor.execute(rollup_sql.format(where=where), params)
+    cursor.execute(f"DELETE FROM main.{table} WHERE {where}", params)
+    return cursor.rowcount
+
+def incremental_vacuum(conn: sqlite3.Connection, pages: int) -> int:
+    """Возврат до pages свободных страниц файлу (0 - всех), возвращает их число.
+
+    Работает только при auto_vacuum = INCREMENTAL; executescript нужен,
+    чтобы прагма выполнилась целиком, а не на один шаг.
+    """
+    if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+        return 0
+    before = conn.execute("PRAGMA freelist_count").fetchone()[0]
+    conn.executescript(f"PRAGMA incremental_vacuum({int(pages)});")
+    return before - conn.execute("PRAGMA freelist_count").fetchone()[0]
+
+def checkpoint(conn: sqlite3.Connection, schema: str = "main") -> Tuple[int, int]:
+    """Перенос WAL в файл базы без ожидания читателей.
+
+    Если PASSIVE перенес весь журнал, TRUNCATE обрезает файл WAL до нуля
+    почти без ожидания. Возвращает (страниц в журнале, перенесено).
+    """
+    busy, log_pages, done = conn.execute(f"PRAGMA {schema}.wal_checkpoint(PASSIVE)").fetchone()
+    if not busy and log_pages > 0 and log_pages == done:
+        conn.execute(f"PRAGMA {schema}.wal_checkpoint(TRUNCATE)").fetchone()
+    return log_pages, done
+
+def run_write_batch(conn: sqlite3.Connection, operations: List[Tuple[Callable, tuple]]) -> List[Tuple[bool, Any]]:
+    """Выполнение пачки изменений в одной транзакции.
+
+    Каждая операция изолирована точкой сохранения: ошибка в одной из них
+    откатывает только ее изменения, остальные фиксируются общим COMMIT.
+    """
+    results = []
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        for func, args in operations:
+            conn.execute("SAVEPOINT op")
+            started = time.perf_counter()
+            try:
+                value = func(conn, *args)
+            except Exception as e:
+                conn.execute("ROLLBACK TO op")
+                conn.execute("RELEASE op")
+                results.append((False, e))
+            else:
+                conn.execute("RELEASE op")
+                results.append((True, value))
+            metrics.db_query_seconds.observe(
+                time.perf_counter() - started, query=query_name(func, args), kind="write"
+            )
+        started = time.perf_counter()
+        conn.execute("COMMIT")
+        metrics.db_commit_seconds.observe(time.perf_counter() - started)
+        metrics.db_batch_size.observe(len(operations))
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    return results
+
+
+def query_name(func: Callable, args: tuple) -> str:
+    """Имя запроса для метрик: идемпотентная обертка называется по операции"""
+    if func is run_idempotent and len(args) > 3:
+        func = args[3]
+    return getattr(func, "__name__", "unknown")
+
+
+def _timed_read(func: Callable, conn: sqlite3.Connection, *args):
+    started = time.perf_counter()
+    try:
+        return func(conn, *args)
+    finally:
+        metrics.db_query_seconds.observe(
+            time.perf_counter() - started, query=query_name(func, args), kind="read"
+        )
+
+
+class Database:
+    """Асинхронный доступ к SQLite через выделенные потоки.
+
+    Соединения открываются один раз и живут всё время работы бота. Чтение
+    выполняется в отдельном потоке-исполнителе, поэтому обработчики не
+    блокируют цикл событий. Все изменения проходят через единственного
+    писателя: он собирает операции разных пользователей из очереди и
+    фиксирует их одной транзакцией (group commit), а каждый вызывающий
+    получает свой собственный результат.
+    """
+
+    def __init__(self, path: str, batch_max_ops: int = 64, batch_delay_ms: float = 2,
+                 mmap_size_mb: int = 256, cache_size_mb: int = 64,
+                 catalog_refresh_seconds: float = 30, max_delta_revisions: int = 500,
+                 idempotency_cache_size: int = 10000, idempotency_ttl_seconds: float = 600,
+                 idempotency_retention_hours: float = 24,
+                 user_cache_size: int = 10000, user_cache_ttl_seconds: float = 60,
+                 archive_path: str = ""):
+        self.path = path
+        # Файл для старых строк истории и транзакций, пусто - без архива
+        self.archive_path = archive_path
+        self.mmap_size_mb = mmap_size_mb
+        self.cache_size_mb = cache_size_mb
+        self.catalog_refresh_seconds = catalog_refresh_seconds
+        self.max_delta_revisions = max_delta_revisions
+        self.catalog: Optional[Catalog] = None
+        self.batch_max_ops = batch_max_ops
+        self.batch_delay = batch_delay_ms / 1000
+        self._reader = ThreadPoolExecutor(max_workers=1, thread_name_prefix="db-read")
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="db-write")
+        self._read_conn: Optional[sqlite3.Connection] = None
+        self._write_conn: Optional[sqlite3.Connection] = None
+        self._write_queue: Optional[asyncio.Queue] = None
+        self._writer_task: Optional[asyncio.Task] = None
+        self._catalog_task: Optional[asyncio.Task] = None
+        # Результаты недавних запросов по (user_id, request_id): повторы
+        # отвечаются из памяти, одновременные дубли ждут первый запрос
+        self.idempotency = TTLCache(idempotency_cache_size, idempotency_ttl_seconds)
+        self.idempotency_retention_hours = idempotency_retention_hours
+        self._inflight: Dict[Tuple[int, str], asyncio.Future] = {}
+        self._prune_task: Optional[asyncio.Task] = None
+        # Баланс, опыт, уровень и ревизия пользователей. Обновляется сразу
+        # после изменений этого процесса; TTL ограничивает устаревание при
+        # правках базы извне.
+        self.users = TTLCache(user_cache_size, user_cache_ttl_seconds)
+        metrics.register_cache("users", self.users)
+        metrics.register_cache("idempotency", self.idempotency)
+        metrics.register_queue(
+            "db_write", lambda: self._write_queue.qsize() if self._write_queue is not None else 0
+        )
+
+    async def _read(self, func, *args):
+        """Выполнение читающей функции в потоке чтения"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self._reader, functools.partial(_timed_read, func, self._read_conn, *args)
+        )
+
+    async def _write(self, func, *args):
+        """Постановка изменения в очередь писателя и ожидание результата"""
+        future = asyncio.get_running_loop().create_future()
+        await self._write_queue.put((func, args, future))
+        return await future
+
+    async def _write_once(self, action: str, user_id: int, request_id: Optional[str],
+                          func, *args) -> Dict:
+        """Изменение с защитой от повторов по идентификатору запроса"""
+        if not request_id:
+            return await self._write(func, *args)
+
+        key = (user_id, request_id)
+        cached = self.idempotency.get(key)
+        if cached is not None:
+            return dict(cached)
+
+        inflight = self._inflight.get(key)
+        if inflight is not None:
+            return dict(await asyncio.shield(inflight))
+
+        task = asyncio.ensure_future(
+            self._write(run_idempotent, user_id, request_id, action, func, *args)
+        )
+        self._inflight[key] = task
+        try:
+            result = await asyncio.shield(task)
+        finally:
+            self._inflight.pop(key, None)
+        self.idempotency.set(key, result)
+        return dict(result)
+
+    async def _writer_loop(self):
+        """Сбор изменений в пачки и их фиксация"""
+        loop = asyncio.get_running_loop()
+        stopping = False
+        while not stopping:
+            operation = await self._write_queue.get()
+            if operation is None:
+                break
+            batch = [operation]
+            deadline = loop.time() + self.batch_delay
+
+            while len(batch) < self.batch_max_ops:
+                if self._write_queue.empty():
+                    timeout = deadline - loop.time()
+                    if timeout <= 0:
+                        break
+                    try:
+                        operation = await asyncio.wait_for(self._write_queue.get(), timeout)
+                    except asyncio.TimeoutError:
+                        break
+                else:
+                    operation = self._write_queue.get_nowait()
+                if operation is None:
+                    stopping = True
+                    break
+                batch.append(operation)
+
+            await self._flush(batch)
+
+    async def _flush(self, batch):
+        """Фиксация пачки и раздача результатов вызывающим"""
+        loop = asyncio.get_running_loop()
+        operations = [(func, args) for func, args, _ in batch]
+        try:
+            results = await loop.run_in_executor(
+                self._writer, run_write_batch, self._write_conn, operations
+            )
+        except Exception as e:
+            log.error("Ошибка фиксации пачки из %s операций: %s", len(batch), e)
+            for _, _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for (_, _, future), (ok, value) in zip(batch, results):
+            if future.done():
+                continue
+            if ok:
+                future.set_result(value)
+            else:
+                future.set_exception(value)
+
+    def _open_connection(self, **kwargs) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, **kwargs)
+        apply_pragmas(conn, self.mmap_size_mb, self.cache_size_mb)
+        return conn
+
+    async def connect(self):
+        """Открытие соединений, миграция схемы и запуск писателя"""
+        loop = asyncio.get_running_loop()
+        self._write_conn = await loop.run_in_executor(
+            self._writer, functools.partial(self._open_connection, isolation_level=None)
+        )
+        version = await loop.run_in_executor(self._writer, init_db, self._write_conn)
+        if self.archive_path:
+            await loop.run_in_executor(self._writer, attach_archive, self._write_conn, self.archive_path)
+        self._read_conn = await loop.run_in_executor(self._reader, self._open_connection)
+        await self.reload_catalog()
+
+        self._write_queue = asyncio.Queue()
+        self._writer_task = asyncio.create_task(self._writer_loop())
+        if self.catalog_refresh_seconds > 0:
+            self._catalog_task = asyncio.create_task(self._catalog_refresh_loop())
+        if self.idempotency_retention_hours > 0:
+            self._prune_task = asyncio.create_task(self._prune_loop())
+        print(f"✅ База данных инициализирована: {self.path} (схема v{version})")
+
+    async def reload_catalog(self) -> Catalog:
+        """Перезагрузка каталога предметов и кейсов"""
+        self.catalog = await self._read(Catalog.load)
+        log.info("Каталог загружен: %s предметов, %s кейсов (версия %s)",
+                 len(self.catalog.items), len(self.catalog.cases), self.catalog.version)
+        return self.catalog
+
+    async def _catalog_refresh_loop(self):
+        """Сброс каталога при изменении items или cases в базе"""
+        while True:
+            await asyncio.sleep(self.catalog_refresh_seconds)
+            try:
+                version = await self._read(get_catalog_version)
+                if version != self.catalog.version:
+                    await self.reload_catalog()
+            except Exception:
+                log.exception("Ошибка проверки версии каталога")
+
+    async def _prune_loop(self):
+        """Периодическая очистка старых идентификаторов запросов"""
+        while True:
+            await asyncio.sleep(3600)
+            try:
+                await self._write(prune_processed_requests, self.idempotency_retention_hours)
+            except Exception:
+                log.exception("Ошибка очистки идентификаторов запросов")
+
+    async def close(self):
+        """Фиксация оставшихся изменений и закрытие соединений"""
+        loop = asyncio.get_running_loop()
+        for task in (self._catalog_task, self._prune_task):
+            if task is None:
+                continue
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self._catalog_task = None
+        self._prune_task = None
+        if self._writer_task is not None:
+            await self._write_queue.put(None)
+            await self._writer_task
+            self._writer_task = None
+        if self._write_conn is not None:
+            await loop.run_in_executor(self._writer, self._write_conn.close)
+            self._write_conn = None
+        if self._read_conn is not None:
+            await loop.run_in_executor(self._reader, self._read_conn.close)
+            self._read_conn = None
+        self._writer.shutdown(wait=True)
+        self._reader.shutdown(wait=True)
+
+    def _cache_user(self, user: Dict):
+        """Запись пользователя в кэш, если там нет более свежей ревизии"""
+        cached = self.users.peek(user["user_id"])
+        if cached is None or cached["revision"] <= user["revision"]:
+            self.users.set(user["user_id"], user)
+
+    def _apply_user_change(self, user_id: int, result: Dict):
+        """Сквозное обновление кэша по результату изменения.
+
+        Повтор запроса возвращает сохраненный старый результат, его ревизия
+        не новее закэшированной, и такой результат кэш не трогает.
+        """
+        cached = self.users.peek(user_id)
+        if cached is None or "revision" not in result or result["revision"] <= cached["revision"]:
+            return
+        updated = dict(cached, balance=result["new_balance"], revision=result["revision"])
+        if "experience" in result:
+            updated["experience"] = result["experience"]
+            updated["level"] = result["level"]
+        self.users.set(user_id, updated)
+
+    async def get_user(self, user_id: int) -> Dict:
+        cached = self.users.get(user_id)
+        if cached is not None:
+            return dict(cached)
+        user = await self._read(fetch_user, user_id)
+        if user is None:
+            user = await self._write(create_user, user_id)
+        self._cache_user(user)
+        return dict(user)
+
+    async def touch_last_login(self, user_id: int):
+        await self._write(touch_last_login, user_id)
+
+    async def update_balance(self, user_id: int, amount: int,
+                             transaction_type: str, description: str = "") -> int:
+        result = await self._write(update_balance, user_id, amount, transaction_type, description)
+        self._apply_user_change(user_id, result)
+        return result["new_balance"]
+
+    async def get_inventory(self, user_id: int) -> List[Dict]:
+        return await self._read(get_inventory, user_id)
+
+    async def get_inventory_page(self, user_id: int, sort: str = "date",
+                                 rarity: Optional[str] = None, category: Optional[str] = None,
+                                 cursor: Optional[Tuple[Any, int]] = None, backward: bool = False,
+                                 limit: int = 8) -> Dict:
+        return await self._read(get_inventory_page, user_id, sort, rarity, category,
+                                cursor, backward, limit)
+
+    async def get_cases(self) -> List[Dict]:
+        return self.catalog.active_cases
+
+    async def get_user_stats(self, user_id: int) -> Dict:
+        return await self._read(get_user_stats, user_id)
+
+    async def rebuild_user_stats(self) -> int:
+        return await self._write(rebuild_user_stats)
+
+    async def archive_old_rows(self, table: str, retention_days: float, batch_size: int) -> int:
+        return await self._write(archive_old_rows, table, retention_days, batch_size,
+                                 bool(self.archive_path))
+
+    async def incremental_vacuum(self, pages: int) -> int:
+        """Возврат свободных страниц в потоке писателя, между пачками:
+        прагма не работает внутри транзакции"""
+        return await asyncio.get_running_loop().run_in_executor(
+            self._writer, incremental_vacuum, self._write_conn, pages
+        )
+
+    async def checkpoint(self) -> Dict[str, Tuple[int, int]]:
+        """Контрольная точка WAL основной базы и архива в потоке писателя"""
+        def run():
+            result = {"main": checkpoint(self._write_conn)}
+            if self.archive_path:
+                result["archive"] = checkpoint(self._write_conn, "archive")
+            return result
+
+        return await asyncio.get_running_loop().run_in_executor(self._writer, run)
+
+    async def open_case(self, user_id: int, case_id: int, request_id: Optional[str] = None) -> Dict:
+        result = await self._write_once("open_case", user_id, request_id,
+                                        open_case, self.catalog, user_id, case_id)
+        self._apply_user_change(user_id, result)
+        return result
+
+    async def open_cases(self, user_id: int, case_id: int, count: int,
+                         request_id: Optional[str] = None) -> Dict:
+        result = await self._write_once("open_cases", user_id, request_id,
+                                        open_cases, self.catalog, user_id, case_id, count)
+        self._apply_user_change(user_id, result)
+        return result
+
+    async def sell_item(self, user_id: int, item_id: int, request_id: Optional[str] = None) -> Dict:
+        result = await self._write_once("sell_item", user_id, request_id,
+                                        sell_item, self.catalog, user_id, item_id)
+        self._apply_user_change(user_id, result)
+        return result
+
+    async def get_menu_button_url(self, chat_id: int) -> Optional[str]:
+        return await self._read(get_menu_button_url, chat_id)
+
+    async def set_menu_button_url(self, chat_id: int, url: str):
+        return await self._write(set_menu_button_url, chat_id, url)
+
+    async def get_stale_menu_button_chats(self, url: str, after_chat_id: int = -2 ** 63,
+                                          limit: int = 100) -> List[int]:
+        return await self._read(get_stale_menu_button_chats, url, after_chat_id, limit)
+
+    async def get_user_data_for_webapp(self, user_id: int, since_revision: Optional[int] = None,
+                                       catalog_version: Optional[int] = None) -> Dict:
+        # Пользователь берется из кэша, после открытия кейса он уже там
+        user = await self.get_user(user_id)
+        return await self._read(get_user_data_for_webapp, self.catalog, user_id, since_revision,
+                                catalog_version, self.max_delta_revisions, user)
@@ -0,0 +1,93 @@
+import asyncio
+import multiprocessing
+import os
+import sqlite3
+import sys
+import tempfile
+
+from storage import Database, get_user_stats, init_db, rebuild_user_stats
+
+USER_ID = 1
+CASE_ID = 1
+
+
+async def _hammer(path: str, attempts: int) -> int:
+    """Параллельные открытия кейсов одним пользователем, возвращает число успешных"""
+    db = Database(path)
+    await db.connect()
+    try:
+        results = await asyncio.gather(*(
+            db.open_cases(USER_ID, CASE_ID, 3) if attempt % 4 == 0 else db.open_case(USER_ID, CASE_ID)
+            for attempt in range(attempts)
+        ))
+    finally:
+        await db.close()
+    return sum(result.get("count", 1) for result in results if result.get("success"))
+
+
+def _worker(path: str, attempts: int, results):
+    results.put(asyncio.run(_hammer(path, attempts)))
+
+
+def main():
+    """Нагрузочная проверка списаний: python stress_balance.py [процессов] [открытий на процесс]
+
+    Несколько процессов со своими соединениями одновременно открывают
+    кейсы одного пользователя, денег у которого хватает лишь на часть
+    открытий. После этого проверяется, что баланс не ушел в минус и
+    сходится с журналом транзакций, а счетчики - с историей.
+    """
+    processes = int(sys.argv[1]) if len(sys.argv) > 1 else 4
+    attempts = int(sys.argv[2]) if len(sys.argv) > 2 else 500
+
+    path = os.path.join(tempfile.mkdtemp(), "stress.db")
+    conn = sqlite3.connect(path, isolation_level=None)
+    init_db(conn)
+    conn.execute(
+        "INSERT INTO users (user_id, balance) VALUES (?, 10000)", (USER_ID,)
+    )
+    conn.execute(
+        "INSERT INTO transactions (user_id, type, amount, description) VALUES (?, 'reward', 10000, 'Стартовый бонус')",
+        (USER_ID,)
+    )
+    conn.execute("BEGIN IMMEDIATE")
+    rebuild_user_stats(conn)
+    conn.execute("COMMIT")
+    case_price = conn.execute("SELECT price FROM cases WHERE case_id = ?", (CASE_ID,)).fetchone()[0]
+
+    context = multiprocessing.get_context("spawn")
+    results = context.Queue()
+    workers = [context.Process(target=_worker, args=(path, attempts, results)) for _ in range(processes)]
+    for worker in workers:
+        worker.start()
+    opened = sum(results.get() for _ in workers)
+    for worker in workers:
+        worker.join()
+
+    balance = conn.execute("SELECT balance FROM users WHERE user_id = ?", (USER_ID,)).fetchone()[0]
+    ledger = conn.execute("SELECT SUM(amount) FROM transactions WHERE user_id = ?", (USER_ID,)).fetchone()[0]
+    history = conn.execute("SELECT COUNT(*) FROM opening_history WHERE user_id = ?", (USER_ID,)).fetchone()[0]
+    stats = get_user_stats(conn, USER_ID)
+
+    print(f"🎲 Попыток: {processes * attempts}, открыто кейсов: {opened}, цена кейса: {case_price}")
+    print(f"💰 Баланс: {balance}, по журналу: {ledger}")
+
+    failures = []
+    if balance < 0:
+        failures.append("баланс ушел в минус")
+    if balance != ledger:
+        failures.append("баланс не совпадает с журналом транзакций")
+    if balance != 10000 - opened * case_price:
+        failures.append("списано не столько, сколько открыто кейсов")
+    if history != opened or stats["cases_opened"] != opened:
+        failures.append("история или счетчики не совпадают с числом открытий")
+
+    if failures:
+        for failure in failures:
+            print(f"❌ {failure}")
+        sys.exit(1)
+    print("✅ Баланс не ушел в минус, журнал и счетчики сходятся")
+
+
+if __name__ == "__main__":
+    main()
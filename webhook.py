@@ -0,0 +1,170 @@
+import asyncio
+import logging
+import signal
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from aiohttp import web
+from aiogram import Bot, Dispatcher
+
+import metrics
+
+log = logging.getLogger(__name__)
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+class WebhookServer:
+    """Прием обновлений Telegram через webhook с ограниченной очередью.
+
+    HTTP-обработчик только кладет обновление в очередь и сразу отвечает,
+    а обработку ведут несколько воркеров. Когда очередь заполнена,
+    сервер отвечает 503 с Retry-After: Telegram повторит доставку позже,
+    так что обновления не теряются, а нагрузка не растет без предела.
+    При остановке новые обновления не принимаются, а уже принятые
+    дорабатываются в течение drain_seconds.
+    """
+
+    def __init__(self, bot: Bot, dp: Dispatcher, path: str = "/webhook",
+                 secret: Optional[str] = None, queue_size: int = 1000,
+                 workers: int = 16, drain_seconds: float = 25,
+                 process_update: Optional[Callable[[Dict], Awaitable]] = None):
+        self.bot = bot
+        self.dp = dp
+        # По умолчанию обновление обрабатывается здесь же, супервизор
+        # процессов подставляет отправку в нужный воркер
+        self.process_update = process_update or self._feed_update
+        self.path = path
+        self.secret = secret
+        self.workers = workers
+        self.drain_seconds = drain_seconds
+
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self.draining = False
+        self.stats: Dict[str, int] = {"accepted": 0, "rejected": 0, "processed": 0, "failed": 0}
+
+        self._worker_tasks: List[asyncio.Task] = []
+        self._runner: Optional[web.AppRunner] = None
+
+        self.app = web.Application()
+        self.app.router.add_post(path, self.handle_update)
+        self.app.router.add_get("/health", self.handle_health)
+
+    async def handle_update(self, request: web.Request) -> web.Response:
+        """Постановка обновления в очередь"""
+        if self.secret and request.headers.get(SECRET_HEADER) != self.secret:
+            return web.Response(status=401)
+
+        if self.draining:
+            return web.Response(status=503, headers={"Retry-After": "5"})
+
+        try:
+            update = await request.json()
+        except ValueError:
+            return web.Response(status=400, text="Некорректный JSON")
+
+        try:
+            self.queue.put_nowait(update)
+        except asyncio.QueueFull:
+            self.stats["rejected"] += 1
+            return web.Response(status=503, headers={"Retry-After": "1"})
+
+        self.stats["accepted"] += 1
+        return web.Response()
+
+    async def handle_health(self, request: web.Request) -> web.Response:
+        """Состояние очереди для балансировщика и мониторинга"""
+        return web.json_response({
+            "draining": self.draining,
+            "queued": self.queue.qsize(),
+            "capacity": self.queue.maxsize,
+            **self.stats
+        }, status=503 if self.draining else 200)
+
+    async def _feed_update(self, update: Dict):
+        await self.dp.feed_raw_update(self.bot, update)
+
+    async def _worker(self):
+        while True:
+            update = await self.queue.get()
+            try:
+                await self.process_update(update)
+                self.stats["processed"] += 1
+            except Exception:
+                self.stats["failed"] += 1
+                log.exception("Ошибка обработки обновления %s", update.get("update_id"))
+            finally:
+                self.queue.task_done()
+
+    async def start(self, host: str, port: int):
+        """Запуск HTTP-сервера и воркеров"""
+        self._worker_tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        self._runner = web.AppRunner(self.app)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, host, port).start()
+        print(f"🌐 Webhook слушает http://{host}:{port}{self.path}")
+
+    async def stop(self):
+        """Плавная остановка: прием закрывается, очередь дорабатывается"""
+        self.draining = True
+        log.info("Дорабатываем очередь webhook: %s обновлений", self.queue.qsize())
+        try:
+            await asyncio.wait_for(self.queue.join(), timeout=self.drain_seconds)
+        except asyncio.TimeoutError:
+            log.warning("Не успели обработать %s обновлений", self.queue.qsize())
+
+        for task in self._worker_tasks:
+            task.cancel()
+        await asyncio.gather(*self._worker_tasks, return_exceptions=True)
+        self._worker_tasks = []
+
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+
+async def run_webhook(bot: Bot, dp: Dispatcher, config,
+                      process_update: Optional[Callable[[Dict], Awaitable]] = None):
+    """Работа бота в режиме webhook до SIGINT/SIGTERM.
+
+    Если WEBHOOK_URL не задан, webhook в Telegram не регистрируется и
+    сервер можно проверить локально, отправляя записанные обновления:
+    curl -X POST -H 'Content-Type: application/json' -d @update.json http://127.0.0.1:8080/webhook
+    """
+    server = WebhookServer(
+        bot, dp,
+        path=config.WEBHOOK_PATH,
+        secret=config.WEBHOOK_SECRET or None,
+        queue_size=config.WEBHOOK_QUEUE_SIZE,
+        # Супервизор процессов раздает обновления по очередям воркеров:
+        # один потребитель сохраняет порядок обновлений каждого пользователя
+        workers=1 if process_update is not None else config.WEBHOOK_WORKERS,
+        drain_seconds=config.WEBHOOK_DRAIN_SECONDS,
+        process_update=process_update
+    )
+    metrics.register_queue("webhook", server.queue.qsize)
+
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop_event.set)
+        except NotImplementedError:
+            # Windows: остановка через KeyboardInterrupt
+            pass
+
+    await server.start(config.WEBHOOK_HOST, config.WEBHOOK_PORT)
+    try:
+        if config.WEBHOOK_URL:
+            await bot.set_webhook(
+                url=config.WEBHOOK_URL.rstrip("/") + config.WEBHOOK_PATH,
+                secret_token=config.WEBHOOK_SECRET or None,
+                max_connections=config.WEBHOOK_MAX_CONNECTIONS,
+                allowed_updates=dp.resolve_used_update_types()
+            )
+            print(f"🔗 Webhook зарегистрирован: {config.WEBHOOK_URL}")
+        else:
+            print("⚠️ WEBHOOK_URL не указан, webhook в Telegram не регистрируется")
+
+        await stop_event.wait()
+    finally:
+        await server.stop()
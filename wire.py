@@ -0,0 +1,212 @@
+import hashlib
+import json
+import secrets
+import sqlite3
+import sys
+from functools import lru_cache
+from typing import Dict, List, Optional
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Лимит длины текста одного сообщения Telegram (в символах UTF-16)
+MESSAGE_LIMIT = 4096
+# Запас под заголовок части: "~<id>:<номер>/<всего>:"
+CHUNK_HEADER_RESERVE = 32
+CHUNK_PREFIX = "~"
+
+ITEM_FIELDS = ("id", "name", "icon", "rarity", "category", "price", "sell_price", "description", "texture_url")
+CASE_FIELDS = ("id", "name", "price", "icon", "description", "rarity_weights", "texture_url")
+
+# Короткие имена полей компактного ответа
+SHORT_KEYS = {
+    "success": "ok",
+    "error": "e",
+    "new_balance": "nb",
+    "experience_gained": "xg",
+    "case_price": "cp",
+    "total_price": "tp",
+    "count": "n",
+    "sell_price": "sp",
+    "inventory_id": "iid",
+    "experience": "x",
+    "level": "l",
+    "revision": "r",
+    "full": "f",
+    "config": "cfg",
+    "catalog_version": "cv",
+}
+
+
+def dumps(obj) -> str:
+    """Сериализация в JSON без пробелов и \\u-экранирования кириллицы"""
+    if orjson is not None:
+        return orjson.dumps(obj).decode()
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":"))
+
+
+@lru_cache(maxsize=4)
+def pack_catalog(catalog) -> Dict:
+    """Каталог в виде массивов и его хэш, по которому клиент кэширует его у себя"""
+    body = {
+        "i": [[item[field] for field in ITEM_FIELDS] for item in catalog.items.values()],
+        "c": [[case[field] for field in CASE_FIELDS] for case in catalog.active_cases],
+    }
+    body["h"] = hashlib.sha1(dumps(body).encode()).hexdigest()[:12]
+    return body
+
+
+def pack_stack(item: Dict) -> List:
+    """Стопка инвентаря: [item_id, количество, дата получения, избранное]"""
+    return [item["id"], item["quantity"], item["obtained_at"], int(item["is_favorite"])]
+
+
+def pack_response(response: Dict, catalog, client_catalog_hash: Optional[str] = None) -> Dict:
+    """Компактная форма ответа веб-приложению.
+
+    Предметы передаются только идентификаторами, их описание клиент берет
+    из каталога. Сам каталог прикладывается, только если хэш у клиента
+    устарел.
+    """
+    packed = {}
+    for key, value in response.items():
+        if key == "user":
+            packed["u"] = [value["balance"], value["experience"], value["level"]]
+        elif key == "inventory":
+            packed["inv"] = [pack_stack(item) for item in value]
+        elif key == "inventory_changed":
+            packed["ic"] = [pack_stack(item) for item in value]
+        elif key == "inventory_removed":
+            packed["ir"] = value
+        elif key == "item":
+            packed["it"] = value["id"]
+        elif key == "items":
+            packed["its"] = [item["id"] for item in value]
+        elif key == "cases":
+            # Кейсы входят в каталог. Версию каталога клиент присылает
+            # обратно, чтобы сервер не собирал кейсы для каждой дельты
+            continue
+        else:
+            packed[SHORT_KEYS.get(key, key)] = value
+
+    catalog_body = pack_catalog(catalog)
+    packed["ch"] = catalog_body["h"]
+    if packed.get("ok") and client_catalog_hash != catalog_body["h"]:
+        packed["cat"] = catalog_body
+    return packed
+
+
+def utf16_length(text: str) -> int:
+    """Длина строки так, как ее считает Telegram"""
+    return len(text.encode("utf-16-le")) // 2
+
+
+def split_message(text: str, limit: int = MESSAGE_LIMIT) -> List[str]:
+    """Разбиение ответа на части, каждая из которых помещается в сообщение.
+
+    Части имеют вид "~<id>:<номер>/<всего>:<фрагмент>", клиент склеивает
+    фрагменты по id. JSON никогда не начинается с "~", поэтому обычные
+    ответы не путаются с частями.
+    """
+    if utf16_length(text) <= limit:
+        return [text]
+
+    budget = limit - CHUNK_HEADER_RESERVE
+    parts = []
+    current = []
+    size = 0
+    for char in text:
+        width = 2 if ord(char) > 0xFFFF else 1
+        if size + width > budget:
+            parts.append("".join(current))
+            current = []
+            size = 0
+        current.append(char)
+        size += width
+    if current:
+        parts.append("".join(current))
+
+    chunk_id = secrets.token_hex(3)
+    total = len(parts)
+    return [f"{CHUNK_PREFIX}{chunk_id}:{index}/{total}:{part}" for index, part in enumerate(parts, 1)]
+
+
+class ResponseSizeStats:
+    """Размеры ответов веб-приложению по действиям"""
+
+    def __init__(self):
+        self.by_action: Dict[str, Dict[str, int]] = {}
+
+    def record(self, action: str, messages: List[str]) -> int:
+        size = sum(len(message.encode()) for message in messages)
+        stats = self.by_action.setdefault(
+            action, {"count": 0, "bytes": 0, "max": 0, "chunked": 0}
+        )
+        stats["count"] += 1
+        stats["bytes"] += size
+        stats["max"] = max(stats["max"], size)
+        if len(messages) > 1:
+            stats["chunked"] += 1
+        return size
+
+    def summary(self) -> List[str]:
+        lines = []
+        for action, stats in sorted(self.by_action.items()):
+            average = stats["bytes"] // stats["count"]
+            lines.append(
+                f"{action}: {stats['count']} отв., в среднем {average} Б, "
+                f"максимум {stats['max']} Б, разбито на части: {stats['chunked']}"
+            )
+        return lines
+
+
+size_stats = ResponseSizeStats()
+
+
+def encode_response(action: str, response: Dict, catalog, request: Optional[Dict] = None) -> List[str]:
+    """Готовые к отправке сообщения с ответом на действие веб-приложения"""
+    request = request if isinstance(request, dict) else {}
+    if request.get("compact"):
+        text = dumps(pack_response(response, catalog, request.get("catalog_hash")))
+    else:
+        text = dumps(response)
+
+    messages = split_message(text)
+    size_stats.record(action or "unknown", messages)
+    return messages
+
+
+def main():
+    """Сравнение размеров полного ответа init: python wire.py <база> <user_id>"""
+    from catalog import Catalog
+    from storage import get_user_data_for_webapp
+
+    if len(sys.argv) != 3:
+        print("Использование: python wire.py <путь к базе> <user_id>")
+        sys.exit(1)
+
+    conn = sqlite3.connect(sys.argv[1])
+    catalog = Catalog.load(conn)
+    data = get_user_data_for_webapp(conn, catalog, int(sys.argv[2]))
+    if data is None:
+        print("❌ Пользователь не найден")
+        sys.exit(1)
+    data["success"] = True
+
+    legacy = json.dumps(data)
+    compact_first = encode_response("init", data, catalog, {"compact": True})
+    compact_cached = encode_response(
+        "init", data, catalog, {"compact": True, "catalog_hash": pack_catalog(catalog)["h"]}
+    )
+
+    print(f"📦 Старый формат: {len(legacy.encode())} Б, сообщений: {len(split_message(legacy))}")
+    print(f"📦 Компактный, без каталога у клиента: {sum(len(m.encode()) for m in compact_first)} Б, "
+          f"сообщений: {len(compact_first)}")
+    print(f"📦 Компактный, каталог в кэше: {sum(len(m.encode()) for m in compact_cached)} Б, "
+          f"сообщений: {len(compact_cached)}")
+
+
+if __name__ == "__main__":
+    main()